@@ -0,0 +1,135 @@
+# Fill quality analytics for LN2 Fill control Server
+# Looks at the whole fill history (FillHistory.py) and trace archive (TraceArchive.py) at once with numpy.
+#
+#  - For each line: rolling mean and standard deviation of successful fill times over the last
+#       AnalyticsWindow fills, time to cold from the LED traces, and a boil-off estimate
+#       (fill time per day since the previous fill, in litres/day if FillFlowRate is set).
+#  - Flags per line, for the latest fill (once a line has at least 3 successful fills):
+#       'NearTimeout' - rolling mean fill time above AnalyticsSlowFraction of MaxFillTime
+#       'Slowing'     - linear trend of the last AnalyticsWindow fills reaches MaxFillTime within AnalyticsHorizon fills
+#       'Outlier'     - latest fill time more than AnalyticsOutlierLimit standard deviations from the rolling mean
+#  - Everything is array operations over memory mapped files, ten years of daily fills on four
+#       lines take around 10 ms (see Benchmarks/BenchAnalytics.py).
+
+import os
+
+import numpy as np
+
+import FillHistory
+import TraceArchive
+
+# Same layout as FillHistory.RecordFormat
+HistoryDtype = np.dtype([('Time', '<f8'), ('Line', '<u2'), ('Result', 'u1'), ('Active', 'u1'), ('FillTime', '<i4'),
+                         ('LedThresh', '<f4'), ('MinFillTime', '<u2'), ('MaxFillTime', '<u2'), ('FillHoldTime', '<u2'),
+                         ('Pad', 'V2')])
+assert HistoryDtype.itemsize == FillHistory.RecordSize
+
+AdcVoltsPerCount = 0.00495  # As Adc2Volts() in LN2Fill.ino
+Flags = ('NearTimeout', 'Slowing', 'Outlier')
+
+
+# Memory map every complete record of a fill history file as a HistoryDtype array
+def LoadHistory(Path):
+    if not os.path.isfile(Path) or os.path.getsize(Path) <= len(FillHistory.Magic):
+        return np.zeros(0, dtype=HistoryDtype)
+    N = (os.path.getsize(Path) - len(FillHistory.Magic)) // HistoryDtype.itemsize
+    if N == 0:
+        return np.zeros(0, dtype=HistoryDtype)
+    return np.memmap(Path, dtype=HistoryDtype, mode='r', offset=len(FillHistory.Magic), shape=(N,))
+
+
+# Rolling mean and standard deviation over the last Window values (fewer at the start)
+def RollingStats(Values, Window):
+    Values = np.asarray(Values, dtype=np.float64)
+    Sum = np.concatenate(([0.0], np.cumsum(Values)))
+    SumSq = np.concatenate(([0.0], np.cumsum(Values * Values)))
+    End = np.arange(1, len(Values) + 1)
+    Start = np.maximum(End - Window, 0)
+    N = End - Start
+    Mean = (Sum[End] - Sum[Start]) / N
+    Var = np.maximum((SumSq[End] - SumSq[Start]) / N - Mean * Mean, 0.0)
+    return Mean, np.sqrt(Var)
+
+
+# Time to cold of each trace: first point at or above the cold threshold, NaN if it never got there
+#   - Traces is (n, TraceWidth), Lengths/Intervals/ColdAdc are per trace (or scalars)
+def TimeToCold(Traces, Lengths, Intervals, ColdAdc):
+    Traces = np.asarray(Traces)
+    InTrace = np.arange(Traces.shape[1]) < np.asarray(Lengths).reshape(-1, 1)
+    Cold = (Traces >= np.asarray(ColdAdc).reshape(-1, 1)) & InTrace
+    First = Cold.argmax(axis=1).astype(np.float64)
+    First[~Cold.any(axis=1)] = np.nan
+    return First * Intervals
+
+
+# Analyse one line, returns a dict of arrays over its successful fills plus the flags of the latest one
+def AnalyseLine(S, History, Line, Index=None, Traces=None):
+    Rows = History[(History['Line'] == Line) & (History['Active'] == 1)]
+    Good = Rows[Rows['Result'] == FillHistory.SUCCESS]
+    Result = {'Line': Line, 'Fills': len(Rows), 'Failures': int(np.count_nonzero(Rows['Result'] == FillHistory.FAIL)),
+              'Time': np.array(Good['Time']), 'FillTime': np.array(Good['FillTime'], dtype=np.float64),
+              'Window': S['AnalyticsWindow'], 'MaxFillTime': int(Rows['MaxFillTime'][-1]) if len(Rows) else 0, 'Flags': []}
+    Result['Mean'], Result['Std'] = RollingStats(Result['FillTime'], S['AnalyticsWindow'])
+
+    # Boil-off: fill time per day since the previous fill (imported fills have no time, NaN)
+    Days = np.diff(Result['Time'], prepend=np.nan) / 86400.0
+    Days[(Days <= 0) | (Result['Time'] == 0)] = np.nan
+    Result['BoilOff'] = Result['FillTime'] / Days * (S['FillFlowRate'] or 1)
+
+    # Time to cold from the archived traces of this line
+    Result['TraceTime'], Result['TimeToCold'] = np.zeros(0), np.zeros(0)
+    if Index is not None:
+        Mask = Index['Line'] == Line
+        if Mask.any():
+            Thresh = Rows['LedThresh'][-1] if len(Rows) else 0
+            ColdAdc = Thresh / AdcVoltsPerCount if Thresh > 0 else np.inf
+            Result['TraceTime'] = np.array(Index['Time'][Mask])
+            Result['TimeToCold'] = TimeToCold(Traces[Mask], Index['Length'][Mask], Index['Interval'][Mask], ColdAdc)
+
+    # Flags for the latest fill, against the current MaxFillTime (not known for imported fills)
+    MaxFillTime = Result['MaxFillTime']
+    if len(Good) < 3:
+        return Result
+    if MaxFillTime and Result['Mean'][-1] > S['AnalyticsSlowFraction'] * MaxFillTime:
+        Result['Flags'].append('NearTimeout')
+    Recent = Result['FillTime'][-S['AnalyticsWindow']:]
+    if MaxFillTime:
+        Slope, Intercept = np.polyfit(np.arange(len(Recent)), Recent, 1)
+        if Slope > 0 and Intercept + Slope * (len(Recent) - 1 + S['AnalyticsHorizon']) >= MaxFillTime:
+            Result['Flags'].append('Slowing')
+    if len(Recent) > 3:
+        Mean, Std = Recent[:-1].mean(), Recent[:-1].std()
+        if Std > 0 and abs(Recent[-1] - Mean) > S['AnalyticsOutlierLimit'] * Std:
+            Result['Flags'].append('Outlier')
+    return Result
+
+
+# Analyse every line in a fill history (and trace archive, if given), returns {Line: AnalyseLine() dict}
+def Analyse(S, HistoryPath, ArchivePath=None):
+    History = LoadHistory(HistoryPath)
+    Index, Traces = TraceArchive.Map(ArchivePath) if ArchivePath else (None, None)
+    return {int(Line): AnalyseLine(S, History, Line, Index, Traces) for Line in np.unique(History['Line'])}
+
+
+# Warning messages for flagged lines
+#   - Warned is a set of (Line, Flag) already reported, each is only reported again once it has cleared.
+def Alerts(Analysis, Warned):
+    Messages = []
+    for Line, Result in sorted(Analysis.items()):
+        for Flag in Flags:
+            if Flag not in Result['Flags']:
+                Warned.discard((Line, Flag))
+                continue
+            if (Line, Flag) in Warned:
+                continue
+            Warned.add((Line, Flag))
+            if Flag == 'NearTimeout':
+                Messages.append("Line {} fills getting slower: mean of last {} fills {:.0f}s, timeout is {}s".format(
+                    Line, min(len(Result['FillTime']), Result['Window']), Result['Mean'][-1], Result['MaxFillTime']))
+            elif Flag == 'Slowing':
+                Messages.append("Line {} fills getting slower: trend reaches the {}s timeout soon (last fill {:.0f}s)".format(
+                    Line, Result['MaxFillTime'], Result['FillTime'][-1]))
+            else:
+                Messages.append("Line {} unusual fill time: {:.0f}s, recent mean {:.0f}s".format(
+                    Line, Result['FillTime'][-1], Result['Mean'][-2] if len(Result['Mean']) > 1 else Result['Mean'][-1]))
+    return Messages
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+# Benchmark for the fill analytics
+# ---------------------------------------------------------------
+# Builds a temporary fill history and trace archive holding ten years of daily fills
+#   on 4 lines (line 2 slowly getting slower), then times a full Analyse() of both.
+# Usage: python Benchmarks/BenchAnalytics.py [years]
+
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Config
+import FillHistory
+import Analytics
+from BenchTraceArchive import BuildArchive
+
+
+# Write Fills fake fills straight into a fill history file
+def BuildHistory(Path, Fills, Lines=4):
+    History = np.zeros(Fills * Lines, dtype=Analytics.HistoryDtype)
+    History['Time'] = np.repeat(np.arange(Fills) * 86400.0, Lines)
+    History['Line'] = np.tile(np.arange(1, Lines + 1), Fills)
+    History['Result'] = FillHistory.SUCCESS
+    History['Active'] = 1
+    FillTime = np.random.normal(300, 20, size=(Fills, Lines))
+    FillTime[:, 1] += np.linspace(0, 350, Fills)
+    History['FillTime'] = FillTime.ravel()
+    History['LedThresh'] = 1.75
+    History['MinFillTime'], History['MaxFillTime'], History['FillHoldTime'] = 60, 720, 20
+    with open(Path, 'wb') as File:
+        File.write(FillHistory.Magic)
+        History.tofile(File)
+
+
+if __name__ == '__main__':
+    Years = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    S = Config.Configure()
+    with tempfile.TemporaryDirectory() as Path:
+        HistoryPath = os.path.join(Path, 'History.bin')
+        BuildHistory(HistoryPath, Years * 365)
+        BuildArchive(Path, Years * 365)
+        Analysis = Analytics.Analyse(S, HistoryPath, Path)
+        print("Flags: " + ", ".join("line {} {}".format(Line, Result['Flags']) for Line, Result in sorted(Analysis.items())))
+        Best = min(timeit.repeat(lambda: Analytics.Analyse(S, HistoryPath, Path), number=10, repeat=5)) / 10
+        print("{} fills analysed in {:.2f} ms".format(len(Analytics.LoadHistory(HistoryPath)), Best * 1e3))
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+# Benchmark for the event bus
+# ---------------------------------------------------------------
+# Publishes a burst of FillResult events to a fast subscriber and a slow one (sleeps for each event,
+#   like mail or plots) and times Publish(), the time the control loop loses, for each policy of the
+#   slow subscriber.  Also reports the events the slow subscriber dropped.
+# Usage: python Benchmarks/BenchEventBus.py [events] [slow ms]
+
+import os
+import statistics
+import sys
+import time as t
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Config
+import EventBus
+import Logger
+
+
+if __name__ == '__main__':
+    Events = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    Slow = float(sys.argv[2]) / 1e3 if len(sys.argv) > 2 else 0.005
+    S = Config.Configure()
+    S.update(LogActive=0, LogTerminalLevel='ERROR', EventBusQueueSize=100, EventBusBlockTimeout=0.05)
+    Logger.Setup(S)
+    EventBus.Start(S)
+    EventBus.Subscribe('fast', lambda Event: None, ['FillResult'])
+    print("{} events, slow subscriber takes {:g} ms each, queues of {}".format(Events, Slow * 1e3, S['EventBusQueueSize']))
+    for Policy in EventBus.Policies:
+        EventBus.Subscribe('slow', lambda Event: t.sleep(Slow), ['FillResult'], Policy=Policy)
+        Times = []
+        for Number in range(Events):
+            Start = t.perf_counter()
+            EventBus.Publish('FillResult', Number=Number)
+            Times.append(t.perf_counter() - Start)
+        Dropped = EventBus.Subscribers['slow']['Dropped']
+        EventBus.Flush()
+        Times.sort()
+        print("{:<7} publish median {:>7.1f} us, p99 {:>8.1f} us, max {:>8.1f} ms, {} dropped".format(
+            Policy, statistics.median(Times) * 1e6, Times[int(len(Times) * 0.99)] * 1e6, Times[-1] * 1e3, Dropped))
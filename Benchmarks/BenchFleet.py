@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Fleet load benchmark for LN2Fill_Poller.py against simulated controllers
+# ---------------------------------------------------------------
+# Starts N "TestServer.py --simulate" controllers (see Simulator.py) running Speed times faster
+#  than real time, then runs the poller against all of them for a while and reports:
+#   polls/s   - requests sent per second over the fleet, with latency percentiles (Transport.py)
+#   parse     - time to parse one status message of each format (StatusParser.Parse)
+#   detection - delay from a line closing on a controller to the poller logging it finished,
+#               in real seconds and in controller seconds (real * Speed)
+#   spans     - time spent in each stage of the poller (see Metrics.py)
+# With --workers N the controllers are polled by Supervisor.py from N worker processes, polls/s is then
+#  status reads per second (counted by Metrics.py in the workers).
+# Fills are due every FillFrequency real seconds per line and polling intervals are scaled by
+#  1/Speed, so a run covers many fills.  Latency and errors are injected by the controllers.
+# Usage: python Benchmarks/BenchFleet.py [controllers] [seconds] [--speed 60] [--latency 0] [--errors 0] [--text] [--workers N]
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as t
+import timeit
+import urllib.request
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, Root)
+
+import Config
+import LN2Fill_Poller as Poller
+import Logger
+import Metrics
+import Notify
+import Scheduler
+import StatusParser
+import Supervisor
+import Transport
+
+
+def Fetch(Port, Path):
+    with urllib.request.urlopen('http://localhost:{}{}'.format(Port, Path), timeout=10) as Response:
+        return Response.read()
+
+
+# Start the simulated controllers and wait until they all answer
+def StartControllers(Args):
+    Servers = []
+    for Port in range(Args.port, Args.port + Args.controllers):
+        Servers.append(subprocess.Popen([sys.executable, os.path.join(Root, 'TestServer.py'), str(Port), '--simulate',
+                                         '--speed', str(Args.speed), '--latency', str(Args.latency), '--errors', str(Args.errors),
+                                         '--seed', str(Port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    Ready = t.time() + 20
+    for Port in range(Args.port, Args.port + Args.controllers):
+        while True:
+            try:
+                Fetch(Port, '/sim/state')
+                break
+            except OSError:
+                if t.time() > Ready:
+                    raise
+                t.sleep(0.1)
+    return Servers
+
+
+def Settings(Args, Dir):
+    S = Config.Configure()
+    S.update(DEBUG=0, LogActive=1, LogFilePath=os.path.join(Dir, 'log.txt'), LogLevel='INFO', LogTerminalLevel='ERROR',
+             MailNotificationActive=0, ELogActive=0, DashboardActive=0, MetricsActive=0, CompactStatus=0 if Args.text else 1,
+             ScheduleFile=os.path.join(Dir, 'schedule.json'), ScheduleStagger=0, ScheduleAdaptive=0, LastFillTime=0,
+             FillFrequency=Args.frequency, FillWindows=[], PollFrequency=10 / Args.speed,
+             FillPollMin=10 / Args.speed, FillPollMax=60 / Args.speed, RetryStatusTimeout=1, TransportBackoffBase=0.1)
+    S['Controllers'] = [{'Name': 'Sim{}'.format(Port), 'IP': 'localhost:{}'.format(Port)}
+                        for Port in range(Args.port, Args.port + Args.controllers)]
+    return S
+
+
+# Run the poller for Args.seconds
+def RunPoller(S, Seconds):
+    Poller.S = S
+    Logger.Setup(S)
+    Notify.Start(S)
+    Poller.Schedule = Scheduler.Load(S)
+    Controllers = [Poller.NewController(Controller) for Controller in S['Controllers']]
+
+    async def Run():
+        try:
+            await asyncio.wait_for(Poller.Supervise(Controllers), Seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(Run())
+    Logger.Flush()
+
+
+# Run the supervisor and its workers for Args.seconds
+def RunSupervisor(S, Seconds):
+    Logger.Setup(S)
+    Notify.Start(S)
+    Supervisor.Run(S, Seconds)
+
+
+# Requests (or status reads with workers), errors and latency histogram over the fleet
+def Requests(S):
+    if S['SupervisorWorkers']:
+        SpanItems, CounterItems = Metrics.Items()
+        Reads = [Span for (Name, Labels), Span in SpanItems if Name == 'fetch']
+        return (sum(Span['Count'] for Span in Reads), sum(Value for (Name, Labels), Value in CounterItems if Name == 'retries'),
+                [sum(Counts) for Counts in zip(*(Span['Histogram'] for Span in Reads))], Metrics.SpanBuckets)
+    Links = [Transport.Links[Controller['IP']] for Controller in S['Controllers']]
+    return (sum(Link['Requests'] for Link in Links), sum(Link['Errors'] for Link in Links),
+            [sum(Counts) for Counts in zip(*(Link['Histogram'] for Link in Links))], Transport.LatencyBuckets)
+
+
+# Delay of each LineFinished event after the close on the controller it reports
+def DetectionDelays(S):
+    Finished = []
+    with open(S['LogFilePath']) as File:
+        for Line in File:
+            Record = json.loads(Line)
+            if Record.get('Event') == 'LineFinished':
+                Finished.append(Record)
+    Delays = []
+    for Controller in S['Controllers']:
+        Closes = json.loads(Fetch(int(Controller['IP'].partition(':')[2]), '/sim/state'))['Closes']
+        for Record in Finished:
+            if Record['Controller'] != Controller['Name']:
+                continue
+            Before = [Close['Wall'] for Close in Closes if Close['Line'] == Record['Line'] and Close['Wall'] <= Record['Time']]
+            if Before:
+                Delays.append(Record['Time'] - max(Before))
+    return Delays
+
+
+def ParseTimes(Port):
+    Times = {}
+    for Name, Path in (('text', Poller.StatusPath), ('csv', Poller.StatusCsvPath + '0')):
+        Message = Fetch(Port, Path)
+        Runs, Total = timeit.Timer(lambda: StatusParser.Parse(Message)).autorange()
+        Times[Name] = Total / Runs
+    return Times
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Poll N simulated controllers and report polls/s, parse time and fill detection delay')
+    Parser.add_argument('controllers', type=int, nargs='?', default=4)
+    Parser.add_argument('seconds', type=float, nargs='?', default=60)
+    Parser.add_argument('--speed', type=float, default=60, help='Simulated seconds per real second')
+    Parser.add_argument('--latency', type=float, default=0, help='Extra seconds before each answer')
+    Parser.add_argument('--errors', type=float, default=0, help='Fraction of requests answered with HTTP 500')
+    Parser.add_argument('--frequency', type=float, default=30, help='Real seconds between fills of each line')
+    Parser.add_argument('--port', type=int, default=5100, help='Port of the first controller')
+    Parser.add_argument('--text', action='store_true', help='Poll readstatus instead of readstatuscsv')
+    Parser.add_argument('--workers', type=int, default=0, help='Poll from this many worker processes (Supervisor.py)')
+    Args = Parser.parse_args()
+
+    Servers = StartControllers(Args)
+    try:
+        with tempfile.TemporaryDirectory() as Dir:
+            S = Settings(Args, Dir)
+            S['SupervisorWorkers'] = Args.workers
+            Start = t.perf_counter()
+            with open(os.devnull, 'w') as Quiet, contextlib.redirect_stdout(Quiet):
+                (RunSupervisor if Args.workers else RunPoller)(S, Args.seconds)
+            Elapsed = t.perf_counter() - Start
+            Count, Errors, Histogram, Buckets = Requests(S)
+            print("{} controllers at {:g}x for {:.0f} s ({} status, {})".format(Args.controllers, Args.speed, Elapsed, 'text' if Args.text else 'csv',
+                                                                            '{} workers'.format(Args.workers) if Args.workers else 'one process'))
+            print("polls/s    {:>8.1f}  ({} requests, {} failed, p50 <= {} s, p95 <= {} s)".format(
+                Count / Elapsed, Count, Errors, Transport.Percentile({'Histogram': Histogram}, 0.5, Buckets),
+                Transport.Percentile({'Histogram': Histogram}, 0.95, Buckets)))
+            for Name, Time in ParseTimes(Args.port).items():
+                print("parse {:<4} {:>8.1f} us".format(Name, Time * 1e6))
+            Delays = DetectionDelays(S)
+            if Delays:
+                print("detection  {:>8.2f} s median, {:.2f} s max over {} fills ({:.0f} / {:.0f} controller s)".format(
+                    statistics.median(Delays), max(Delays), len(Delays),
+                    statistics.median(Delays) * Args.speed, max(Delays) * Args.speed))
+            else:
+                print("detection  no fills finished, try more seconds")
+            print()
+            print(Metrics.Profile())
+    finally:
+        for Server in Servers:
+            Server.terminate()
+            Server.wait()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+# Benchmark for the log query index
+# ---------------------------------------------------------------
+# Writes a temporary log of JSON records (a DEBUG=1 day is ~300 records, with a fill result each
+#   day), then times building the index from scratch, updating it after one more day is
+#   appended, and "when did line 3 last fail" against the up to date index.
+# Usage: python Benchmarks/BenchLogQuery.py [megabytes]
+
+import json
+import os
+import sys
+import tempfile
+import time as t
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import LogQuery
+
+
+# Append one day of records starting at Time to an open log file
+def WriteDay(File, Time, Day):
+    for Second in range(0, 86400, 300):
+        File.write(json.dumps({'Time': Time + Second, 'CTime': t.ctime(Time + Second), 'Level': 'DEBUG',
+                               'Message': 'Parsed status: Min/Max/Hold = 60/720/20 s, main tank Closed, 4 lines'}) + '\n')
+    Failed = Day % 30 == 0
+    File.write(json.dumps({'Time': Time + 600, 'CTime': t.ctime(Time + 600), 'Level': 'EVENT',
+                           'Message': 'Line 3 finished after 700s: ' + ('!!!!!!!!! FILL FAILED (-720s) TIMEOUT !!!!!!!!!!' if Failed
+                                                                       else 'Fill Success!!! (300s)'),
+                           'Event': 'LineFinished', 'Line': 3, 'Failed': Failed}) + '\n')
+
+
+if __name__ == '__main__':
+    Megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as Dir:
+        Path = os.path.join(Dir, 'LN2AutofillLog.txt')
+        Day = 0
+        with open(Path, 'w') as File:
+            while File.tell() < Megabytes * 1e6:
+                WriteDay(File, 1.5e9 + Day * 86400, Day)
+                Day += 1
+        Start = t.perf_counter()
+        LogQuery.Update(Path)
+        Build = t.perf_counter() - Start
+        with open(Path, 'a') as File:
+            WriteDay(File, 1.5e9 + Day * 86400, Day)
+        Start = t.perf_counter()
+        LogQuery.Update(Path)
+        Append = t.perf_counter() - Start
+        Best = min(timeit.repeat(lambda: LogQuery.Query(Path, Line=3, Failed=True, Last=1), number=10, repeat=5)) / 10
+        print("{:.0f} MB log, {} days".format(os.path.getsize(Path) / 1e6, Day + 1))
+        print("index build   {:>8.2f} s".format(Build))
+        print("index update  {:>8.2f} ms (one day appended)".format(Append * 1e3))
+        print("query         {:>8.2f} ms (last failure of line 3)".format(Best * 1e3))
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+
+# Benchmark for the offline report generator
+# ---------------------------------------------------------------
+# Builds temporary fill histories and trace archives for a fleet of controllers (daily fills
+#   on 4 lines), then times Report.Generate() from scratch with 1 worker and with one per core,
+#   and again with nothing changed (every report cached).
+# Usage: python Benchmarks/BenchReport.py [controllers] [years]
+
+import os
+import sys
+import tempfile
+import time as t
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Config
+import Report
+from BenchAnalytics import BuildHistory
+from BenchTraceArchive import BuildArchive
+
+
+def Time(S, Jobs, Force):
+    Start = t.perf_counter()
+    Rendered, Cached = Report.Generate(S, Jobs=Jobs, Force=Force)
+    return t.perf_counter() - Start, Rendered, Cached
+
+
+if __name__ == '__main__':
+    Controllers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    Years = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    S = Config.Configure()
+    with tempfile.TemporaryDirectory() as Dir:
+        S.update(ReportPath=os.path.join(Dir, 'Reports/'), LogFilePath=os.path.join(Dir, 'log.txt'), FillHistoryFile=os.path.join(Dir, 'none.bin'),
+                 Controllers=[])
+        for Number in range(Controllers):
+            Path = os.path.join(Dir, 'C{}'.format(Number))
+            os.makedirs(Path)
+            BuildHistory(os.path.join(Path, 'History.bin'), Years * 365)
+            BuildArchive(Path, Years * 365)
+            S['Controllers'].append({'Name': 'C{}'.format(Number), 'IP': 'localhost', 'FillHistoryFile': os.path.join(Path, 'History.bin'),
+                                     'TraceArchivePath': Path})
+        Cases = [('1 worker', 1, True), ('{} workers'.format(os.cpu_count()), os.cpu_count(), True), ('cached', None, False)]
+        for Name, Jobs, Force in Cases:
+            Elapsed, Rendered, Cached = Time(S, Jobs, Force)
+            print("{:<12} {:>8.2f} s ({} rendered, {} cached)".format(Name, Elapsed, Rendered, Cached))
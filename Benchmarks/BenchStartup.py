@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# Cold start benchmark for LN2Fill_Control.py
+# ---------------------------------------------------------------
+# Starts a fresh interpreter for each run and times:
+#   import    - importing the module only
+#   setup     - import + Setup() with PLOTS = 0 (no matplotlib)
+#   setup+plt - import + Setup() with PLOTS = 1
+#   warm      - import + Setup() with PLOTS = 0, restoring a checkpoint (see Checkpoint.py)
+# Setup() uses a temporary directory for the log and data files, holding Years of daily fills
+#   on 4 lines (fill history and trace archive) which a cold Setup() reads.
+# Usage: python Benchmarks/BenchStartup.py [runs] [years]
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as t
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, Root)
+from BenchAnalytics import BuildHistory
+from BenchTraceArchive import BuildArchive
+
+SetupCode = '''
+import Config, LN2Fill_Control
+S = Config.Configure()
+Dir = {Dir!r}
+S.update(PLOTS={Plots}, DEBUG=0, LogFilePath=Dir + 'log.txt', PlotPath=Dir, FillHistoryFile=Dir + 'h.bin',
+         FillRecordSaveFile=Dir + 'none.txt', TraceArchivePath=Dir + 'traces/', ScheduleFile=Dir + 'schedule.json',
+         TelemetryFile=Dir + 'telemetry.npz', MetricsActive=0, DashboardActive=0, CheckpointFile={Checkpoint!r})
+LN2Fill_Control.Setup(S)
+'''
+
+# Write a checkpoint after a cold Setup(), as the control loop would
+SaveCode = SetupCode + '''
+import StatusParser
+LN2Fill_Control.SaveCheckpoint(StatusParser.Status(0, 0, 0, 'Closed', [], 0, [], []), Force=True)
+'''
+
+
+def Time(Code, Runs):
+    Times = []
+    for Run in range(Runs):
+        Start = t.perf_counter()
+        subprocess.run([sys.executable, '-c', Code], cwd=Root, check=True, stdout=subprocess.DEVNULL)
+        Times.append(t.perf_counter() - Start)
+    return statistics.median(Times)
+
+
+if __name__ == '__main__':
+    Runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    Years = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as Dir:
+        Dir += '/'
+        BuildHistory(Dir + 'h.bin', Years * 365)
+        os.makedirs(Dir + 'traces/')
+        BuildArchive(Dir + 'traces/', Years * 365)
+        Time(SaveCode.format(Dir=Dir, Plots=0, Checkpoint=Dir + 'checkpoint.json'), 1)
+        Baseline = Time('pass', Runs)
+        Cases = [('import', 'import LN2Fill_Control'),
+                 ('setup', SetupCode.format(Dir=Dir, Plots=0, Checkpoint='')),
+                 ('setup+plt', SetupCode.format(Dir=Dir, Plots=1, Checkpoint='')),
+                 ('warm', SetupCode.format(Dir=Dir, Plots=0, Checkpoint=Dir + 'checkpoint.json'))]
+        print("{} years of fills".format(Years))
+        print("{:<10} {:>8.1f} ms (bare interpreter)".format('python', Baseline * 1e3))
+        for Name, Code in Cases:
+            Median = Time(Code, Runs)
+            print("{:<10} {:>8.1f} ms (+{:.1f} ms)".format(Name, Median * 1e3, (Median - Baseline) * 1e3))
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+
+# Microbenchmark for the status message parser
+# ---------------------------------------------------------------
+# Times StatusParser.ParseStatusMessage() on the TestServer.py fixture and on a
+#   worst-case message (every line with a full length fill trace).
+# Usage: python Benchmarks/BenchStatusParser.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import StatusParser
+from TestServer import StatusMessage
+
+
+# Build a status message where every line has a complete 73 point fill trace
+def FullTraceMessage(Message):
+    Head, Tail = Message.split('Time  :')
+    Points = 73
+    Lines = ['Time  : ' + ' '.join(str(i * 10) for i in range(Points))]
+    for Line in range(1, Message.count('\nLine ') + 1):
+        Lines.append('Line {}: '.format(Line) + ' '.join(str(100 + (i * 7) % 400) for i in range(Points)))
+    return Head + '\n'.join(Lines)
+
+
+def Bench(Name, Message, Iterations):
+    Data = Message.encode('ascii')
+    StatusParser.ParseStatusMessage(Data)  # Check it parses before timing
+    Total = min(timeit.repeat(lambda: StatusParser.ParseStatusMessage(Data), number=Iterations, repeat=5))
+    PerCall = Total / Iterations
+    print("{:<12} {:>6} bytes  {:>8.1f} us/parse  {:>10.0f} parses/s".format(Name, len(Data), PerCall * 1e6, 1 / PerCall))
+
+
+if __name__ == '__main__':
+    Iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    Bench('fixture', StatusMessage, Iterations)
+    Bench('full-trace', FullTraceMessage(StatusMessage), Iterations)
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+# Benchmark for the fill trace archive
+# ---------------------------------------------------------------
+# Builds a temporary archive holding ten years of daily fills on 4 lines, then
+#   times loading the last 365 traces of one line.
+# Usage: python Benchmarks/BenchTraceArchive.py [years]
+
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import TraceArchive
+
+
+# Write Fills fake fills straight into the archive files (much quicker than Append() per fill)
+def BuildArchive(Path, Fills, Lines=4, Points=73):
+    Index = np.zeros(Fills * Lines, dtype=TraceArchive.IndexDtype)
+    Index['Time'] = np.repeat(np.arange(Fills) * 86400.0, Lines)
+    Index['Line'] = np.tile(np.arange(1, Lines + 1), Fills)
+    Index['Length'] = Points
+    Index['Interval'] = 10
+    Traces = np.zeros((Fills * Lines, TraceArchive.TraceWidth), dtype=TraceArchive.TraceDtype)
+    Traces[:, 0:Points] = np.random.randint(100, 600, size=(Fills * Lines, Points))
+    Index.tofile(os.path.join(Path, TraceArchive.IndexFile))
+    Traces.tofile(os.path.join(Path, TraceArchive.TracesFile))
+
+
+if __name__ == '__main__':
+    Years = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as Path:
+        BuildArchive(Path, Years * 365)
+        Times, Lengths, Traces = TraceArchive.Load(Path, 2, Count=365)
+        assert Traces.shape == (365, TraceArchive.TraceWidth)
+        Best = min(timeit.repeat(lambda: TraceArchive.Load(Path, 2, Count=365), number=20, repeat=5)) / 20
+        print("{} traces archived, last 365 of one line loaded in {:.2f} ms".format(TraceArchive.Count(Path), Best * 1e3))
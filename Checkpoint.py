@@ -0,0 +1,102 @@
+# Checkpoint of runtime state for LN2 Fill control Server
+# Lets the control script restart warm: the state it otherwise rebuilds (or loses) at startup is saved
+#   to CheckpointFile and restored from it in a few milliseconds.
+#
+#  - The state is a dict (see LN2Fill_Control.SaveCheckpoint()): the fill time record, last fill traces,
+#       analytics warnings already sent, failed status reads, the trace cache and any fill underway.
+#  - Save() writes it as JSON to a temporary file, flushed to disk, then renamed over CheckpointFile, so a
+#       crash while saving leaves the previous checkpoint whole.  JSON rather than pickle, loading a pickle
+#       runs whatever code it names.  The sets, tuples, bytes and integer keys JSON has no form for are
+#       converted by Encode() and restored by Decode().
+#  - Load() only returns a checkpoint saved by this version for the same controller and number of
+#       lines, less than CheckpointMaxAge seconds ago, otherwise None and the script starts cold as before.
+#       The fill time record is only good while the fill history has the same records it had, compared by
+#       number of records and the time and line of the last one (HistoryMatches()).
+#  - The fill schedule is not part of it, Scheduler.py already saves that after every change.
+#  - Changed() compares the last fill result of each line in the checkpoint with a fresh status, to
+#       find fills which finished (or started) while the script was not running.
+
+import os
+import json
+import time as t
+
+import FillHistory
+import Logger
+
+CheckpointVersion = 3  # Change when the state saved changes, older checkpoints are then not used
+
+
+# Number of records in the fill history and (Time, Line) of the last one
+#   - Unlike the file size this does not change if a partial record left by a crash is trimmed.
+def HistoryMark(S):
+    Count, Record = FillHistory.Last(S['FillHistoryFile'])
+    return Count, (Record.Time, Record.Line) if Record is not None else None
+
+
+# Last fill result and time of each line, to compare with a later status
+def LineResults(Status):
+    return [(FillLine[8], FillLine[9]) for FillLine in Status.LineStatus]
+
+
+# State in the types JSON has
+#   - Warned is a set of (Line, Flag), the fill results in LineResults are bytes and the traces in
+#       TraceCache are keyed by line number, which JSON would turn into a string.
+def Encode(State):
+    TraceCache = dict(State['TraceCache'], Traces=[[Line, Trace] for Line, Trace in State['TraceCache']['Traces'].items()])
+    return dict(State, Warned=sorted(State['Warned']), TraceCache=TraceCache,
+                LineResults=[[Result.decode('latin-1'), Time] for Result, Time in State['LineResults']])
+
+
+# State as saved, from Encode()
+def Decode(State):
+    TraceCache = dict(State['TraceCache'], Traces={Line: Trace for Line, Trace in State['TraceCache']['Traces']})
+    Count, Record = State['HistoryMark']
+    return dict(State, Warned={tuple(Warning) for Warning in State['Warned']}, TraceCache=TraceCache,
+                LineResults=[(Result.encode('latin-1'), Time) for Result, Time in State['LineResults']],
+                HistoryMark=(Count, tuple(Record) if Record is not None else None))
+
+
+# Write State to CheckpointFile, atomically
+def Save(S, State):
+    State = dict(State, Version=CheckpointVersion, Controller=S['ControllerIP'], NumberOfFillLines=S['NumberOfFillLines'],
+                 Time=t.time(), HistoryMark=HistoryMark(S))
+    with open(S['CheckpointFile'] + '.tmp', 'w') as File:
+        json.dump(Encode(State), File)
+        File.flush()
+        os.fsync(File.fileno())
+    os.replace(S['CheckpointFile'] + '.tmp', S['CheckpointFile'])
+
+
+# State saved in CheckpointFile, or None if there is none usable
+def Load(S):
+    if not S['CheckpointFile'] or not os.path.isfile(S['CheckpointFile']):
+        return None
+    try:
+        with open(S['CheckpointFile'], 'r') as File:
+            State = json.load(File)
+        if isinstance(State, dict) and State.get('Version') == CheckpointVersion:
+            State = Decode(State)
+    except Exception as Error:
+        Logger.Warning("=== Cannot read checkpoint {} ({}), starting cold ===",S['CheckpointFile'],repr(Error))
+        return None
+    if not isinstance(State, dict) or State.get('Version') != CheckpointVersion:
+        Reason = "saved by another version"
+    elif State['Controller'] != S['ControllerIP'] or State['NumberOfFillLines'] != S['NumberOfFillLines']:
+        Reason = "saved for controller {} with {} lines".format(State['Controller'], State['NumberOfFillLines'])
+    elif t.time() - State['Time'] > S['CheckpointMaxAge']:
+        Reason = "saved {:.0f} s ago".format(t.time() - State['Time'])
+    else:
+        return State
+    Logger.Info("Checkpoint {} not used ({}), starting cold",S['CheckpointFile'],Reason)
+    return None
+
+
+# True if the fill history has not changed since State was saved
+def HistoryMatches(S, State):
+    return State['HistoryMark'] == HistoryMark(S)
+
+
+# Lines whose last fill result has changed since State was saved
+def Changed(State, Status):
+    return [FillLine[0] for FillLine, Saved in zip(Status.LineStatus, State['LineResults'])
+            if (FillLine[8], FillLine[9]) != Saved]
@@ -16,31 +16,169 @@ def Configure():
     # Setup urls for regular actions
     Settings['StatusUrl'] = 'http://' + Settings['ControllerIP'] + '/arduino/readstatus/0'
     Settings['FillAllUrl'] = 'http://' + Settings['ControllerIP'] + '/arduino/fillall/0'
-    Settings['RetryStatusMax'] = 5 # Max retries when contacting arduino, above this warning message sent
-    Settings['RetryStatusTimeout'] = 120 # seconds before retry
+    Settings['FillLineUrl'] = 'http://' + Settings['ControllerIP'] + '/arduino/fillline/' # Line number is added
+    # Compact status (readstatuscsv, the fill generation of the cached traces is added so only new traces
+    #   are sent), needs a controller running the current LN2Fill.ino, older firmware answers 404.  Set
+    #   CompactStatus to 1 once the controller has been reflashed, 0 uses readstatus (StatusUrl).
+    Settings['CompactStatus'] = 0
+    Settings['StatusCsvUrl'] = 'http://' + Settings['ControllerIP'] + '/arduino/readstatuscsv/'
+    # Status cache shared by the control loop and dashboard (see StatusCache.py)
+    Settings['StatusCacheTTL'] = 30 # Seconds a status is served from the cache before it is read again
+    Settings['StatusCacheMaxStale'] = 600 # Seconds, dashboard viewers get a status up to this old while it is refreshed
+    Settings['RetryStatusMax'] = 5 # Failed status reads in a row before contact is reported lost (polling carries on)
+    Settings['RetryStatusTimeout'] = 120 # seconds before the next status read after a failed one
+
+    # Requests to controllers (see Transport.py)
+    Settings['TransportConnectTimeout'] = 10 # Seconds, reading the response may take up to ControllerTimeout
+    Settings['TransportPoolSize'] = 2 # Connections kept open per controller
+    Settings['TransportRetries'] = 3 # Retries of a failed request...
+    Settings['TransportBackoffBase'] = 1 # ...after a random wait of up to this many seconds, doubled for each retry...
+    Settings['TransportBackoffMax'] = 60 # ...up to this
+    Settings['BreakerThreshold'] = 5 # Failed requests in a row before requests to a controller are stopped...
+    Settings['BreakerResetTime'] = 30 # ...for this many seconds, then a single trial request is sent...
+    Settings['BreakerResetMax'] = 600 # ...and if that fails they are stopped for twice as long, up to this
+
+    # Controllers polled by the asyncio poller (LN2Fill_Poller.py), one dict per Arduino.
+    #   'Timeout' (seconds per request) is optional, defaults to ControllerTimeout.
+    #   'FillHistoryFile' is optional, if given fill results are appended to it (see FillHistory.py).
+    #   'TraceArchivePath' is optional, if given LED traces of each fill are archived there (see TraceArchive.py).
+    #   'CompactStatus' is optional, defaults to CompactStatus (set 1 for controllers running the current firmware).
+    #   'FillMode' is optional, defaults to FillMode.
+    Settings['Controllers'] = [
+        {'Name': 'Main', 'IP': Settings['ControllerIP']},
+    ]
+    Settings['ControllerTimeout'] = 60 # seconds
+
+    # Supervisor.py, runs the poller in several worker processes each polling a share of Controllers
+    Settings['SupervisorWorkers'] = 0 # Worker processes, 0 = one per core
+    Settings['SupervisorHeartbeat'] = 10 # Seconds between heartbeats (and metrics) from each worker...
+    Settings['SupervisorStallTimeout'] = 120 # ...a worker sending none for this long is killed and restarted
+    Settings['SupervisorRestartDelay'] = 5 # Seconds before a worker is restarted, doubled each time it fails again...
+    Settings['SupervisorRestartMax'] = 300 # ...within this many seconds, up to this
+    Settings['SupervisorStopTimeout'] = 10 # Seconds workers are given to stop before being killed
 
     # Frequency/timing of actions
     Settings['PollFrequency'] = 300 # Seconds
-    Settings['FillFrequency'] = 24 * 60 * 60 # Seconds
-    Settings['LastFillTime'] = 0
+    Settings['FillFrequency'] = 24 * 60 * 60 # Seconds, starting interval between fills of each line (see Scheduler.py)
+    Settings['LastFillTime'] = 0 # Assumed last fill of lines with no saved schedule or fill history, 0 = fill straight away
     Settings['NumberOfFillLines'] = 4
 
+    # Fill scheduling (see Scheduler.py), state is kept in ScheduleFile across restarts
+    #   Controllers entries can set their own 'FillFrequency', 'FillWindows' and 'LineSchedules'.
+    Settings['ScheduleFile'] = '/Path/To/Data/LN2Schedule.json'
+    Settings['FillWindows'] = [] # (StartHour, EndHour) local time windows in which fills may start, [] = any time
+    Settings['LineSchedules'] = {} # Per line overrides, e.g. {3: {'FillFrequency': 12*3600, 'FillWindows': [(7, 19)]}}
+    Settings['ScheduleAdaptive'] = 1 # Adapt each line's interval to its measured fill times
+    Settings['ScheduleTargetFillTime'] = 300 # Seconds, interval is scaled by target/fill time after each fill...
+    Settings['ScheduleMaxStep'] = 1.25 # ...by at most this factor either way...
+    Settings['ScheduleMinInterval'] = 6 * 60 * 60 # ...and kept between these (seconds)
+    Settings['ScheduleMaxInterval'] = 3 * 24 * 60 * 60
+    Settings['ScheduleDriftDelay'] = 15 * 60 # Seconds, LED drift on a line brings its next fill forward to this long from now
+    Settings['ScheduleStagger'] = 15 * 60 # Seconds between fills starting on different controllers
+
+    # How lines are filled: 'lines' = only the lines due, one fillline command per line,
+    #   'all' = every active line with fillall whenever any line is due
+    Settings['FillMode'] = 'lines'
+    Settings['FillConcurrency'] = 1 # Lines filling at once in 'lines' mode, the next starts as one finishes (0 = no limit)
+    Settings['FillRetryMax'] = 1 # Times a failed line is filled again in 'lines' mode (not if it failed as too short)
+
+    # Status polling while a fill is underway: starts at FillPollMin seconds, grows by FillPollGrowth
+    #   each poll with no change up to FillPollMax, drops back to FillPollMin when a line finishes.
+    Settings['FillPollMin'] = 10 # Seconds, the controller logs LED values every 10 s
+    Settings['FillPollMax'] = 60 # Seconds
+    Settings['FillPollGrowth'] = 1.5
+
+    # Telemetry from routine status polls (see Telemetry.py)
+    #   Tiers are (seconds per entry, number of entries), 0 seconds = every poll
+    Settings['TelemetryTiers'] = [(0, 7 * 288), (300, 30 * 288), (3600, 10 * 365 * 24)]
+    Settings['TelemetryFile'] = '/Path/To/Data/LN2Telemetry.npz'
+    Settings['TelemetrySaveInterval'] = 3600 # Seconds
+    Settings['TelemetryDriftLimit'] = 0.1 # Fractional change of hourly LED reading vs previous day to warn at
+
+    # Fill analytics over the fill history, run after every fill (see Analytics.py)
+    Settings['AnalyticsWindow'] = 14 # Fills in the rolling mean/standard deviation and trend
+    Settings['AnalyticsSlowFraction'] = 0.8 # Warn when the rolling mean fill time passes this fraction of MaxFillTime...
+    Settings['AnalyticsHorizon'] = 30 # ...or the trend would reach MaxFillTime within this many fills
+    Settings['AnalyticsOutlierLimit'] = 4 # Standard deviations from the recent mean for a fill to count as unusual
+    Settings['FillFlowRate'] = 0 # Litres per second of filling, boil-off is given in fill seconds per day if 0
+
+    # Live dashboard and JSON API served from the cached status (see Dashboard.py)
+    Settings['DashboardActive'] = 1
+    Settings['DashboardHost'] = '127.0.0.1' # Address to listen on, '' = all interfaces
+    Settings['DashboardPort'] = 8080
+    Settings['DashboardToken'] = '' # Commands must give it, open the page as http://host:port/?token=<DashboardToken>, '' = random each start (logged)
+    Settings['DashboardCommands'] = ['fillall', 'fillline', 'activateline', 'deactivateline', 'openline', 'closeline',
+                                     'opentank', 'closetank', 'readled', 'readvalve', 'readtime'] # Commands passed on to controllers
+    Settings['DashboardCommandInterval'] = 10 # Seconds, at most one command per controller in this time
+    Settings['DashboardHistoryCount'] = 100 # Fills returned by /api/history by default
+    Settings['DashboardKeepAlive'] = 15 # Seconds between keep alive messages on idle event streams
+
+    # Event bus passing fill results and status to the history files, plots, mail and dashboard (see EventBus.py)
+    Settings['EventBusQueueSize'] = 100 # Events waiting per subscriber
+    Settings['EventBusBlockTimeout'] = 5 # Seconds the control loop waits for room on a full queue of a 'block' subscriber
+    Settings['EventBusExitTimeout'] = 30 # Seconds given to subscribers at exit to handle the events waiting
+
+    # Stage timings and counters (see Metrics.py)
+    Settings['MetricsActive'] = 1
+    Settings['MetricsHost'] = 'localhost' # Prometheus text served at http://MetricsHost:MetricsPort/metrics
+    Settings['MetricsPort'] = 9108
+    Settings['MetricsProfileFile'] = '' # If set, table of stage timings written here every MetricsDumpInterval s and at exit
+    Settings['MetricsDumpInterval'] = 3600 # Seconds
+    Settings['MetricsCProfile'] = 0 # 1 = also profile the control loop with cProfile, to MetricsProfileFile + '.prof'
+
     # Logging
     Settings['LogActive'] = 1
     Settings['LogPath'] = '/Path/To/Log/'
     Settings['LogFile']= 'LN2AutofillLog.txt'
     Settings['LogFilePath'] = Settings['LogPath'] + Settings['LogFile']
+    Settings['LogLevel'] = None          # 'DEBUG', 'INFO', 'WARNING' or 'ERROR', None means DEBUG if Settings['DEBUG'] else INFO
+    Settings['LogTerminalLevel'] = None  # Lowest level printed to terminal, None means same as LogLevel
+    Settings['LogFlushInterval'] = 5     # Seconds between writes of buffered records, fill events are written at once
+    Settings['LogBufferSize'] = 1000     # Write early if this many records are waiting
+    Settings['LogMaxBytes'] = 10*1024*1024   # Rotate log file when bigger than this...
+    Settings['LogRotateInterval'] = 0        # ...or older than this many seconds (0 = never)
+    Settings['LogBackupCount'] = 5           # Number of rotated files kept
 
     # Emails
     Settings['MailNotificationActive'] = 1
     Settings['MailAddressList'] = ["user@company.com"]
     Settings['SenderEmail'] = "user@company.com"
+    Settings['SmtpHost'] = 'localhost' # Use TestSmtpServer.py for testing
+    Settings['SmtpPort'] = 25
+    Settings['SmtpTimeout'] = 60 # Seconds
+    Settings['NotifyQueueSize'] = 100 # Messages waiting beyond this are dropped, oldest first
+    Settings['NotifyCoalesceTime'] = 10 # Seconds, messages arriving within this of each other go in one mail
+    Settings['NotifyRetryMax'] = 5 # Attempts to send each mail
+    Settings['NotifyRetryDelay'] = 30 # Seconds before first retry, doubled for each further retry
+
+    # ELog, the message (and -f <attachment> for each attachment) is added to the end of ELogCommand
+    Settings['ELogActive'] = 1
+    Settings['ELogCommand'] = ['/usr/local/bin64/elog', '-h', 'npa', '-p', '8080', '-l', 'Ln2 Autofill',
+                               '-u', 'ln2_user', 'ln2_user', '-a', 'Author=ln2_user', '-a', 'Type=Fill Record',
+                               '-a', 'Subject=AUTO: Fill status']
+    Settings['ELogTimeout'] = 60 # Seconds before a hung elog post is killed
 
     # Plots
     Settings['PlotColours'] = ['r','g','b','c','m','k','y']
     Settings['HistoryPlotPeriod'] = 90
+    Settings['PlotPath'] = Settings['LogPath'] # LN2Plots.pdf and per plot images are written here
+    Settings['PlotFormats'] = ['png', 'svg'] # Extra image formats for the web page
+    Settings['PlotMailFiles'] = 10 # Copies of the PDF kept for mails still waiting to be sent (LN2Plots_Mail<N>.pdf)
+
+    # Offline reports (python Report.py, see Report.py)
+    Settings['ReportPath'] = Settings['LogPath'] + 'Reports/'
+    Settings['ReportJobs'] = 0 # Worker processes, 0 = one per core
+    Settings['ReportFormats'] = ['pdf', 'png'] # pdf has a page per line, other formats a file per line
 
     # Fill record  and save location
-    Settings['FillRecordSaveFile'] = '/Path/To/Data/LN2AutofillData.txt'
+    Settings['FillRecordSaveFile'] = '/Path/To/Data/LN2AutofillData.txt' # Old text record, imported into FillHistoryFile on first run
+    Settings['FillHistoryFile'] = '/Path/To/Data/LN2AutofillData.bin' # Binary fill history (see FillHistory.py)
+    # Directory holding the LED ADC trace of every fill (see TraceArchive.py)
+    Settings['TraceArchivePath'] = '/Path/To/Data/Traces/'
+
+    # Runtime state of the control script, restored at startup (see Checkpoint.py), '' = always start cold
+    Settings['CheckpointFile'] = '/Path/To/Data/LN2Checkpoint.json'
+    Settings['CheckpointInterval'] = 300 # Seconds between saves, also saved as each fill starts and ends
+    Settings['CheckpointMaxAge'] = 24 * 60 * 60 # Seconds, an older checkpoint is not used
 
     return(Settings)
@@ -0,0 +1,341 @@
+# Live dashboard for LN2 Fill control Server
+# Serves a web page and JSON API from the status the control script (or poller) has already read,
+#   in place of the static Ln2Home.html whose links sent every viewer to the Arduino Bridge.
+#
+#  - Publish() is called with every parsed status.  The status is turned into JSON once there,
+#       every viewer gets that copy, so any number of viewers cost the controller no requests.
+#  - GET  /                        - the dashboard page, kept up to date from /events
+#  - GET  /api/status              - latest status of every controller, with the time it was read
+#                                    (refreshed through the status cache if old, see StatusCache.GetStale())
+#  - GET  /api/history?controller=<name>&count=<n>
+#                                  - last fills from the controller's fill history file
+#  - GET  /api/schedule            - last and next fill of every line (see Scheduler.py)
+#  - GET  /events                  - server-sent events, a "status" event for every status published
+#  - POST /api/command/<controller>/<command>/<arg>
+#                                  - sent on to the controller as /arduino/<command>/<arg>, only commands
+#       in DashboardCommands, and at most one per DashboardCommandInterval seconds per controller
+#       (429 with Retry-After otherwise).  readstatus is never proxied, it is served from the cache.
+#       Commands go through Transport.py, on the same Link (breaker) as the control loop's requests, and are
+#       sent once: one which timed out may still have been carried out, so it is not sent again.
+#       Refused (403) if the browser sent it from another site (Origin not this server) or without the
+#       token in an X-Dashboard-Token header (the page sends the ?token= it was opened with).  The token is
+#       DashboardToken, or a random one made at startup if that is not set, and is logged with the page address.
+#       It is what stops other web pages reaching a dashboard on 127.0.0.1 (e.g. by DNS rebinding).
+#  - Listens on DashboardHost, loopback only by default.
+#  - Runs in a ThreadingHTTPServer on background threads, started by Start().
+#  - If Forward is set (worker processes of Supervisor.py) Publish() passes the status to it, to be
+#       published by the process running the dashboard.
+#
+# Usage:
+#   Dashboard.Start(S, Schedule)
+#   Dashboard.Register(Name, IP, FillHistoryFile)
+#   Dashboard.Publish(Name, Status)     (after every status read)
+
+import collections
+import hmac
+import json
+import secrets
+import threading
+import time as t
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import FillHistory
+import Scheduler
+import Logger
+import Transport
+
+# Module state, set up by Start()
+S = None
+Schedule = None
+Server = None
+Controllers = {}        # Name -> {'IP', 'FillHistoryFile', 'Status' (JSON text), 'Updated', 'LastCommand'}
+Events = collections.deque(maxlen=100)  # (Number, JSON text) of recent status events
+EventNumber = 0
+Changed = threading.Condition()
+CommandLock = threading.Lock()
+Forward = None  # Called with (Name, Status) by Publish() instead of publishing, if set
+Token = None    # Needed with every command, set by Start()
+
+
+# Start the dashboard server (if DashboardActive), safe to call more than once
+#   - Schedule is the fill schedule shown by /api/schedule
+def Start(Settings, FillSchedule=None):
+    global S, Schedule, Server, Token
+    S = Settings
+    Schedule = FillSchedule
+    if Server is not None or not S['DashboardActive']:
+        return
+    Token = S['DashboardToken'] or secrets.token_urlsafe(16)
+    try:
+        Server = ThreadingHTTPServer((S['DashboardHost'], S['DashboardPort']), Handler)
+    except OSError as Error:
+        Logger.Warning("=== Cannot start dashboard on port {} ({}) ===",S['DashboardPort'],repr(Error))
+        return
+    Server.daemon_threads = True
+    threading.Thread(target=Server.serve_forever, name='Dashboard', daemon=True).start()
+    Logger.Info("Dashboard at http://{}:{}/?token={}",S['DashboardHost'] or 'localhost',Server.server_address[1],Token)
+
+
+# Add a controller to the dashboard
+#   - Refresh, if given, is called before /api/status is served to bring an out of date status up to date,
+#       e.g. StatusCache.GetStale(), it should return at once and Publish() the new status when it has one.
+def Register(Name, IP, FillHistoryFile=None, Refresh=None):
+    with Changed:
+        Controllers.setdefault(Name, {'Status': 'null', 'Updated': 0, 'LastCommand': 0})
+        Controllers[Name].update(IP=IP, FillHistoryFile=FillHistoryFile, Refresh=Refresh)
+
+
+# Status as plain JSON types, lines as dicts keyed by the LineStatus field names
+def StatusJson(Status):
+    Result = {Key: Value for Key, Value in Status._asdict().items() if Key not in ('LineStatus', 'TraceGenerations')}
+    Result['LineStatus'] = [{Field: Value.decode('ascii', 'replace') if isinstance(Value, bytes) else Value
+                             for Field, Value in FillLine._asdict().items()} for FillLine in Status.LineStatus]
+    return Result
+
+
+# Publish a freshly read status of a controller to the API and every event stream
+def Publish(Name, Status):
+    global EventNumber
+    if Forward is not None:
+        Forward(Name, Status)
+        return
+    if Server is None:
+        return
+    Now = t.time()
+    Text = json.dumps({'Controller': Name, 'Updated': Now, 'Status': StatusJson(Status)}, default=str)
+    with Changed:
+        Controllers.setdefault(Name, {'IP': None, 'FillHistoryFile': None, 'Refresh': None, 'LastCommand': 0})
+        Controllers[Name]['Status'] = Text
+        Controllers[Name]['Updated'] = Now
+        EventNumber += 1
+        Events.append((EventNumber, Text))
+        Changed.notify_all()
+
+
+# Send a command to a controller, returns (HTTP status, body text)
+def Command(Name, Command, Arg):
+    if Name not in Controllers:
+        return 404, "Unknown controller {}".format(Name)
+    if Command not in S['DashboardCommands'] or not Arg.isdigit():
+        return 403, "Command {}/{} not allowed".format(Command, Arg)
+    Controller = Controllers[Name]
+    with CommandLock:
+        Wait = Controller['LastCommand'] + S['DashboardCommandInterval'] - t.time()
+        if Wait > 0:
+            return 429, "Too many commands, try again in {:.0f} s".format(Wait)
+        Controller['LastCommand'] = t.time()
+    Logger.Event('DashboardCommand',"Dashboard command {}/{} sent to {}",Command,Arg,Name,Controller=Name)
+    try:
+        return 200, Transport.Request(S, 'http://{}/arduino/{}/{}'.format(Controller['IP'], Command, Arg), Retries=0).decode('ascii', 'replace')
+    except Transport.CircuitOpen as Error:
+        Logger.Warning("=== Dashboard command {}/{} to {} not sent ({}) ===",Command,Arg,Name,Error)
+        return 503, "Controller is not answering ({})".format(Error)
+    except OSError as Error:
+        Logger.Warning("=== Dashboard command {}/{} to {} failed ({}) ===",Command,Arg,Name,repr(Error))
+        return 502, "Controller did not answer ({}), check its status before sending the command again".format(Error)
+
+
+# Last Count fills of a controller's fill history as a list of dicts
+def History(Name, Count):
+    Controller = Controllers.get(Name)
+    if Controller is None or not Controller['FillHistoryFile']:
+        return []
+    return [Record._asdict() for Record in FillHistory.ReadAll(Controller['FillHistoryFile'])[-Count:]]
+
+
+# Last and next fill of every line in the schedule
+def ScheduleJson():
+    if Schedule is None:
+        return {}
+    return {Key: {'LastFill': Entry['LastFill'], 'Interval': Entry['Interval'], 'NextFill': Scheduler.NextFill(Entry)}
+            for Key, Entry in list(Schedule['Entries'].items())}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Requests go to the log at debug level instead of stderr
+    def log_message(self, Format, *Args):
+        if Logger.Enabled(Logger.DEBUG):
+            Logger.Debug("Dashboard {}: {}", self.address_string(), Format % Args)
+
+    def Reply(self, Code, Body, ContentType='application/json', Headers=()):
+        Body = Body.encode('utf-8')
+        self.send_response(Code)
+        self.send_header('Content-Type', ContentType + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(Body)))
+        self.send_header('Cache-Control', 'no-cache')
+        for Header in Headers:
+            self.send_header(*Header)
+        self.end_headers()
+        self.wfile.write(Body)
+
+    def do_GET(self):
+        Url = urllib.parse.urlsplit(self.path)
+        Query = dict(urllib.parse.parse_qsl(Url.query))
+        if Url.path == '/':
+            self.Reply(200, Page, 'text/html')
+        elif Url.path == '/api/status':
+            for Name, Controller in list(Controllers.items()):
+                if Controller['Refresh']:
+                    try:
+                        Controller['Refresh']()
+                    except Exception as Error:
+                        Logger.Debug("Dashboard status refresh of {} failed ({})",Name,repr(Error))
+            with Changed:
+                Text = '{' + ','.join('{}:{}'.format(json.dumps(Name), Controller['Status'])
+                                      for Name, Controller in Controllers.items()) + '}'
+            self.Reply(200, Text)
+        elif Url.path == '/api/history':
+            Name = Query.get('controller', next(iter(Controllers), ''))
+            Count = int(Query['count']) if Query.get('count', '').isdigit() else S['DashboardHistoryCount']
+            self.Reply(200, json.dumps(History(Name, Count)))
+        elif Url.path == '/api/schedule':
+            self.Reply(200, json.dumps(ScheduleJson()))
+        elif Url.path == '/events':
+            self.Stream()
+        else:
+            self.Reply(404, json.dumps({'Error': 'Not found'}))
+
+    # True if a command may come from this request: same origin (or not from a browser) and with the token
+    def Allowed(self):
+        Origin = self.headers.get('Origin')
+        if Origin is not None and urllib.parse.urlsplit(Origin).netloc != self.headers.get('Host'):
+            return False
+        return hmac.compare_digest(self.headers.get('X-Dashboard-Token', ''), Token)
+
+    def do_POST(self):
+        Parts = self.path.strip('/').split('/')
+        if len(Parts) != 5 or Parts[:2] != ['api', 'command']:
+            self.Reply(404, json.dumps({'Error': 'Not found'}))
+            return
+        if not self.Allowed():
+            Logger.Warning("=== Dashboard command {} from {} refused (origin {}) ===",self.path,self.address_string(),self.headers.get('Origin'))
+            self.Reply(403, json.dumps({'Error': 'Command refused'}))
+            return
+        Code, Text = Command(urllib.parse.unquote(Parts[2]), Parts[3], Parts[4])
+        Headers = [('Retry-After', str(S['DashboardCommandInterval']))] if Code == 429 else []
+        self.Reply(Code, json.dumps({'Response': Text} if Code == 200 else {'Error': Text}), Headers=Headers)
+
+    # Server-sent events: the latest status of every controller, then each new one as it is published
+    def Stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        with Changed:
+            Pending = [Controller['Status'] for Controller in Controllers.values() if Controller['Updated']]
+            Seen = EventNumber
+        try:
+            while True:
+                for Text in Pending:
+                    self.wfile.write(b'event: status\ndata: ' + Text.encode('utf-8') + b'\n\n')
+                # Comment line as a keep alive, also finds viewers which have gone away
+                self.wfile.write(b': \n\n')
+                self.wfile.flush()
+                with Changed:
+                    Changed.wait_for(lambda: EventNumber > Seen, timeout=S['DashboardKeepAlive'])
+                    Pending = [Text for Number, Text in Events if Number > Seen]
+                    Seen = EventNumber
+        except OSError:
+            pass
+
+
+# Dashboard page, fetches everything through the API above
+Page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8">
+<title>University of Liverpool - Nuclear Physics - LN2 Autofill</title>
+<style>
+  body { font-family: Arial, Helvetica, sans-serif; font-size: 14px; width: 95%; margin: 2% auto; }
+  table { border-collapse: collapse; margin-bottom: 1em; }
+  th, td { border-bottom: 1px solid #ccc; padding: 3px 10px; text-align: left; }
+  .Fail { color: #c00; } .Underway { color: #06c; }
+  button { margin: 1px; }
+</style>
+</head>
+<body>
+<h1>University of Liverpool - Nuclear Physics - LN2 Autofill</h1>
+<div id="Controllers"></div>
+<h2>Schedule</h2>
+<table id="Schedule"></table>
+<p id="Message"></p>
+<script>
+const LineCommands = [['fillline', 'Fill'], ['activateline', 'Activate'], ['deactivateline', 'Deactivate'],
+                      ['openline', 'Open valve'], ['closeline', 'Close valve']];
+
+const Token = new URLSearchParams(location.search).get('token') || '';
+
+function Send(Controller, Command, Arg) {
+  fetch('/api/command/' + encodeURIComponent(Controller) + '/' + Command + '/' + Arg,
+        {method: 'POST', headers: {'X-Dashboard-Token': Token}})
+    .then(Response => Response.json())
+    .then(Data => { document.getElementById('Message').textContent = Data.Response || Data.Error; });
+}
+
+// Every value from the controllers or the schedule goes in as text, never as HTML
+function Add(Parent, Tag, Text, Class) {
+  const Element = document.createElement(Tag);
+  if (Text !== undefined) Element.textContent = Text;
+  if (Class) Element.className = Class;
+  Parent.appendChild(Element);
+  return Element;
+}
+
+function AddButton(Parent, Label, Controller, Command, Arg) {
+  Add(Parent, 'button', Label).addEventListener('click', () => Send(Controller, Command, Arg));
+}
+
+function AddRow(Table, Tag, Texts) {
+  const Row = Add(Table, 'tr');
+  for (const Text of Texts) Add(Row, Tag, Text);
+  return Row;
+}
+
+function Show(Event) {
+  let Div = Array.from(document.getElementById('Controllers').children).find(Child => Child.dataset.controller === Event.Controller);
+  if (!Div) {
+    Div = Add(document.getElementById('Controllers'), 'div');
+    Div.dataset.controller = Event.Controller;
+  }
+  Div.replaceChildren();
+  const Status = Event.Status;
+  Add(Div, 'h2', Event.Controller);
+  const Summary = Add(Div, 'p', 'Read ' + new Date(Event.Updated * 1000).toLocaleString() +
+    ', min/max/hold fill time ' + Status.MinFillTime + '/' + Status.MaxFillTime + '/' + Status.FillHoldTime +
+    ' s, main tank ' + Status.MainTankStatus + ' ');
+  AddButton(Summary, 'Fill all active lines', Event.Controller, 'fillall', 0);
+  const Table = Add(Div, 'table');
+  AddRow(Table, 'th', ['Line', 'Active', 'LED V', 'Threshold V', 'Valve', 'Last fill', '']);
+  for (const Line of Status.LineStatus) {
+    const Row = AddRow(Table, 'td', [Line.LineNum, Line.Active, Line.LedVolts, Line.LedThresh, Line.ValveStatus]);
+    const Class = Line.FillResult.startsWith('Fail') ? 'Fail' : (Line.FillResult == 'Underway' ? 'Underway' : '');
+    Add(Row, 'td', Line.FillResult + ' (' + Line.FillTime + ' s)', Class);
+    const Buttons = Add(Row, 'td');
+    for (const [Command, Label] of LineCommands)
+      AddButton(Buttons, Label, Event.Controller, Command, Line.LineNum);
+  }
+}
+
+function ShowSchedule() {
+  fetch('/api/schedule').then(Response => Response.json()).then(Entries => {
+    const Table = document.getElementById('Schedule');
+    Table.replaceChildren();
+    AddRow(Table, 'th', ['Line', 'Last fill', 'Next fill']);
+    for (const [Key, Entry] of Object.entries(Entries))
+      AddRow(Table, 'td', [Key, Entry.LastFill ? new Date(Entry.LastFill * 1000).toLocaleString() : '-',
+                           Entry.NextFill ? new Date(Entry.NextFill * 1000).toLocaleString() : 'now']);
+  });
+}
+
+const Source = new EventSource('/events');
+Source.addEventListener('status', Message => { Show(JSON.parse(Message.data)); ShowSchedule(); });
+ShowSchedule();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,160 @@
+# Event bus for LN2 Fill control Server
+# Passes what happens in the control loop (status read, fill started, line finished, fill result...)
+#   to the code which acts on it (history files, plots, mail, dashboard), instead of the control loop
+#   calling each in turn and waiting for the slowest.
+#
+#  - Publish(Type, **Fields) is called from the control loop with one of EventTypes, and only puts the
+#       Event on the queue of each subscriber to that type, so it never waits on a subscriber
+#       (at most EventBusBlockTimeout seconds, for a full 'block' subscriber, see below).
+#  - Subscribe(Name, Handler, Types) gives Handler its own worker thread and bounded queue
+#       (QueueSize, default EventBusQueueSize).  Handler(Event) runs on that thread for each event
+#       in the order published, whatever the other subscribers are doing.
+#  - Policy says what happens when a subscriber's queue is full:
+#       'block'  - Publish() waits for room, up to EventBusBlockTimeout seconds, then drops the event
+#                  (for subscribers which should see every event, e.g. the fill result mail)
+#       'oldest' - the oldest waiting event is dropped (e.g. status for the dashboard, only the latest matters)
+#       'newest' - the new event is dropped
+#  - Each handler call is timed in a Metrics span (event_handler, by subscriber and event type), and
+#       dropped events and handler errors are counted.  An error is logged and the subscriber carries on.
+#  - Adding a subscriber needs no change to the control loop.
+#  - Events are only held in memory, so anything which must not be lost (e.g. the fill history) is
+#       written by the publisher before it publishes.
+#
+# Usage:
+#   EventBus.Start(S)
+#   EventBus.Subscribe('report', ReportFill, ['FillResult'], Policy='block')
+#   EventBus.Publish('FillResult', Status=Status, Lines=Lines)
+
+import atexit
+import collections
+import queue
+import threading
+import time as t
+
+import Logger
+import Metrics
+
+EventTypes = ('StatusPolled', 'FillStarted', 'LineFinished', 'FillResult', 'FillFailed', 'ContactLost', 'ContactRestored')
+Policies = ('block', 'oldest', 'newest')
+
+# One thing which happened, Fields depend on the Type
+Event = collections.namedtuple('Event', ['Type', 'Time', 'Fields'])
+
+# Module state, set up by Start()
+S = None
+Subscribers = {}    # Name -> {'Handler', 'Types', 'Policy', 'Queue', 'Thread', 'Dropped', 'Handled', 'Stopped'}
+Lock = threading.Lock()
+
+
+# Set up the bus, events still waiting at exit are handled (for up to EventBusExitTimeout seconds)
+def Start(Settings):
+    global S
+    if S is None:
+        atexit.register(lambda: Flush(S['EventBusExitTimeout']))
+    S = Settings
+
+
+# Run Handler(Event) on its own thread for every event of Types (default all) published from now on
+#   - A subscriber with the same Name is replaced (its thread stops once it has handled what it has)
+def Subscribe(Name, Handler, Types=None, Policy='oldest', QueueSize=None):
+    Types = set(EventTypes if Types is None else Types)
+    if not Types <= set(EventTypes) or Policy not in Policies:
+        raise ValueError("Bad subscription {}: types {}, policy {}".format(Name, sorted(Types), Policy))
+    Subscriber = {'Name': Name, 'Handler': Handler, 'Types': Types, 'Policy': Policy, 'Dropped': 0, 'Handled': 0, 'Stopped': False,
+                  'Queue': queue.Queue(maxsize=QueueSize or S['EventBusQueueSize'])}
+    Subscriber['Thread'] = threading.Thread(target=SubscriberLoop, args=(Subscriber,), name='Event-' + Name, daemon=True)
+    with Lock:
+        Old = Subscribers.get(Name)
+        Subscribers[Name] = Subscriber
+    if Old is not None:
+        Stop(Old)
+    Subscriber['Thread'].start()
+
+
+# Stop sending events to a subscriber, it handles those already queued first
+def Unsubscribe(Name):
+    with Lock:
+        Subscriber = Subscribers.pop(Name, None)
+    if Subscriber is not None:
+        Stop(Subscriber)
+
+
+# End a subscriber's thread once it has handled the events already queued
+def Stop(Subscriber):
+    Subscriber['Stopped'] = True
+    Subscriber['Queue'].put(None)
+
+
+# Send an event to every subscriber to its Type
+def Publish(Type, **Fields):
+    if Type not in EventTypes:
+        raise ValueError("Unknown event type {}".format(Type))
+    Item = Event(Type, t.time(), Fields)
+    with Lock:
+        Receivers = [Subscriber for Subscriber in Subscribers.values() if Type in Subscriber['Types']]
+    for Subscriber in Receivers:
+        Put(Subscriber, Item)
+
+
+# Put an event on a subscriber's queue, by its policy if the queue is full
+def Put(Subscriber, Item):
+    Queue = Subscriber['Queue']
+    if Subscriber['Stopped']:
+        return
+    if Subscriber['Policy'] == 'block':
+        try:
+            Queue.put(Item, timeout=S['EventBusBlockTimeout'])
+        except queue.Full:
+            Drop(Subscriber, Item)
+        return
+    while True:
+        try:
+            Queue.put_nowait(Item)
+            return
+        except queue.Full:
+            if Subscriber['Policy'] == 'newest':
+                Drop(Subscriber, Item)
+                return
+            try:
+                Oldest = Queue.get_nowait()
+                Queue.task_done()
+                Drop(Subscriber, Oldest)
+            except queue.Empty:
+                pass
+
+
+# Count (and now and then log) an event a subscriber will not see
+def Drop(Subscriber, Item):
+    Subscriber['Dropped'] += 1
+    Metrics.Count('events_dropped', Subscriber=Subscriber['Name'], Event=Item.Type)
+    if Subscriber['Dropped'] == 1 or Subscriber['Dropped'] % 100 == 0:
+        Logger.Warning("=== Event subscriber {} is behind, {} event(s) dropped ===",Subscriber['Name'],Subscriber['Dropped'])
+
+
+def SubscriberLoop(Subscriber):
+    while True:
+        Item = Subscriber['Queue'].get()
+        if Item is None:
+            Subscriber['Queue'].task_done()
+            return
+        try:
+            with Metrics.Span('event_handler', Subscriber=Subscriber['Name'], Event=Item.Type):
+                Subscriber['Handler'](Item)
+        except Exception as Error:
+            Metrics.Count('event_errors', Subscriber=Subscriber['Name'], Event=Item.Type)
+            Logger.Error("=== Event subscriber {} failed on {} ({}) ===",Subscriber['Name'],Item.Type,repr(Error))
+        Subscriber['Handled'] += 1
+        Subscriber['Queue'].task_done()
+
+
+# Block until every subscriber has handled every event published so far, returns False on timeout
+def Flush(Timeout=None):
+    Deadline = None if Timeout is None else t.time() + Timeout
+    with Lock:
+        Queues = [Subscriber['Queue'] for Subscriber in Subscribers.values()]
+    for Queue in Queues:
+        while Queue.unfinished_tasks:
+            if Deadline is not None and t.time() > Deadline:
+                return False
+            t.sleep(0.01)
+    return True
@@ -0,0 +1,124 @@
+# Fill history store for LN2 Fill control Server
+# Append-only binary file holding one fixed width record per line per fill.
+#
+#  - File starts with an 8 byte header (Magic), followed by records packed with RecordFormat.
+#  - New records are only ever appended, in a single write per fill followed by fsync, so
+#       a crash can at worst leave a partial record at the end of the file.  Partial
+#       records are ignored when reading and trimmed off before the next append.
+#  - Reads memory map the file and unpack records straight from the map.
+#  - ImportText() converts the old FillRecordSaveFile text format (one line of fill
+#       times per LN2 line) the first time the new store is used.
+
+import mmap
+import os
+import struct
+import time as t
+from collections import namedtuple
+
+import StatusParser
+
+Magic = b'LN2FH\x00\x00\x01'
+# Time (unix s), Line, Result, Active, FillTime (s), LedThresh (V), Min/Max/Hold fill time (s), padding
+RecordFormat = '<dHBBifHHHxx'
+RecordSize = struct.calcsize(RecordFormat)
+
+FillRecord = namedtuple('FillRecord', ['Time', 'Line', 'Result', 'Active', 'FillTime', 'LedThresh',
+                                       'MinFillTime', 'MaxFillTime', 'FillHoldTime'])
+
+# Values of FillRecord.Result
+FAIL, SUCCESS, UNDERWAY, UNKNOWN = range(4)
+ResultCodes = {b'Fail!': FAIL, b'Succ!': SUCCESS, StatusParser.Underway: UNDERWAY}
+
+
+# Build the records for every line (or only Lines, if given) of a status taken after a fill
+def RecordsFromStatus(Status, Time=None, Lines=None):
+    if Time is None:
+        Time = t.time()
+    return [FillRecord(Time, FillLine[0], ResultCodes.get(FillLine[8], UNKNOWN), int(FillLine[1] == b'Y'),
+                       FillLine[9], FillLine[3], Status.MinFillTime, Status.MaxFillTime, Status.FillHoldTime)
+            for FillLine in Status.LineStatus if Lines is None or FillLine[0] in Lines]
+
+
+# Open the store for appending, creating it if needed and trimming any partial record left by a crash
+#   - Returns an os level file descriptor
+def OpenForAppend(Path):
+    Fd = os.open(Path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    Size = os.fstat(Fd).st_size
+    if Size < len(Magic):
+        os.ftruncate(Fd, 0)
+        os.write(Fd, Magic)
+        os.fsync(Fd)
+    elif (Size - len(Magic)) % RecordSize:
+        os.ftruncate(Fd, Size - (Size - len(Magic)) % RecordSize)
+    return Fd
+
+
+# Append a list of FillRecords to the store as a single write
+def Append(Path, Records):
+    Data = b''.join(struct.pack(RecordFormat, *Record) for Record in Records)
+    Fd = OpenForAppend(Path)
+    try:
+        os.write(Fd, Data)
+        os.fsync(Fd)
+    finally:
+        os.close(Fd)
+
+
+# Read every complete record in the store, returns a list of FillRecords
+def ReadAll(Path):
+    if not os.path.isfile(Path) or os.path.getsize(Path) <= len(Magic):
+        return []
+    with open(Path, 'rb') as File:
+        with mmap.mmap(File.fileno(), 0, access=mmap.ACCESS_READ) as Map:
+            if Map[0:len(Magic)] != Magic:
+                raise ValueError('{} is not a fill history file'.format(Path))
+            End = len(Map) - (len(Map) - len(Magic)) % RecordSize
+            return [FillRecord._make(Values) for Values in struct.iter_unpack(RecordFormat, Map[len(Magic):End])]
+
+
+# Number of complete records in the store and the last of them (None if there are none), without reading the rest
+def Last(Path):
+    if not os.path.isfile(Path):
+        return 0, None
+    with open(Path, 'rb') as File:
+        Count = max(0, (os.fstat(File.fileno()).st_size - len(Magic)) // RecordSize)
+        if Count == 0:
+            return 0, None
+        File.seek(len(Magic) + (Count - 1) * RecordSize)
+        return Count, FillRecord._make(struct.unpack(RecordFormat, File.read(RecordSize)))
+
+
+# Fill times for each line in fill order, the layout used by CheckFillSuccess.TotalFillTimeRecord
+def FillTimeRecord(Path, NumberOfFillLines):
+    Record = [[] for Line in range(NumberOfFillLines)]
+    for Fill in ReadAll(Path):
+        while len(Record) < Fill.Line:
+            Record.append([])
+        Record[Fill.Line - 1].append(Fill.FillTime)
+    return Record
+
+
+# Time of the last fill of each line, {Line: unix time}, imported fills (no time) are left out
+def LastFillTimes(Path):
+    return {Fill.Line: Fill.Time for Fill in ReadAll(Path) if Fill.Time > 0}
+
+
+# One time import of the old text fill record into a new store
+#   - The text format has no timestamps or thresholds, these are stored as 0.
+#   - Written to Path + '.tmp' then renamed over Path, so a crash part way leaves no store and the
+#       import is tried again on the next start.
+#   - Returns the number of records imported.
+def ImportText(TextPath, Path):
+    Records = []
+    with open(TextPath, 'r') as File:
+        for Index, Line in enumerate(File.readlines()):
+            for FillNumber, FillTime in enumerate(map(int, Line.split())):
+                Records.append((FillNumber, FillRecord(0.0, Index + 1, SUCCESS if FillTime > 0 else FAIL,
+                                                       int(FillTime != 0), FillTime, 0.0, 0, 0, 0)))
+    # Order by fill rather than by line, so records of one fill are grouped as they are when appended live
+    Records.sort(key=lambda Item: (Item[0], Item[1].Line))
+    if os.path.exists(Path + '.tmp'):
+        os.remove(Path + '.tmp')
+    Append(Path + '.tmp', [Record for FillNumber, Record in Records])
+    os.replace(Path + '.tmp', Path)
+    return len(Records)
@@ -0,0 +1,56 @@
+# Fill result classification for LN2 Fill control Server
+# Shared by the single controller script (LN2Fill_Control.py) and the fleet poller (LN2Fill_Poller.py)
+
+import StatusParser
+
+
+# Describe the result of the last fill on a single LN2 line, returns (Message, Failed)
+#   - FillLine is one row of Status.LineStatus for an active line
+def LineFillResult(FillLine, Status):
+    if FillLine[8][0:5] == b'Fail!':  # If fill has failed, t->-t
+        # If 0 > t > -1*MinFillTime = Too Short!
+        if FillLine[9] >= (-1 * Status.MinFillTime):
+            return "!!!!!!!!! FILL FAILED ({}s) TOO SHORT !!!!!!!!!!\n".format(FillLine[9]), True
+        # If -1*MinFillTime > t >= -1*MAxFillTime = Timout
+        elif FillLine[9] <= (-1 * Status.MaxFillTime):
+            return "!!!!!!!!! FILL FAILED ({}s) TIMEOUT !!!!!!!!!!\n".format(FillLine[9]), True
+        # Should not reach this condition, t=0
+        elif FillLine[9] == 0:
+            return "!!!!! FILL FAILED ({}s) t=0 (erm, I'm not expecting this to happen...) !!!!!!!!!!\n".format(FillLine[9]), True
+        # All other, i.e. t < -1* MaxFillTime (shouldn't happen ever), or t>0 (shouldn't happen at same time as "Fail")
+        else:
+            return "!!!!!!!!! FILL FAILED ({}s) UNKNOWN CONDITION !!!!!!!!!!\n".format(FillLine[9]), True
+    elif FillLine[8][0:5] == b'Succ!':
+        return "Fill Success!!! ({}s)\n".format(FillLine[9]), False
+    elif FillLine[8] == StatusParser.Underway:
+        return "Fill still underway!\n", False
+    else:
+        return "Unrecognised fill status ({})\n".format(FillLine[8].decode('ascii', 'replace')), False
+
+
+# Build the fill summary message for a status taken after a fill of all active lines
+#   - If Lines is given only those lines were filled, other active lines are listed as not filled this time.
+#   - Returns (Message, FailCount, ActiveCount)
+def SummariseFill(Status, Lines=None):
+    # Variables to count lines and failures
+    FailCount = 0
+    ActiveCount = 0
+    # Add min/max/hold times to top of status message
+    Message = "Current Min/Max/Hold time = {}/{}/{} s\n".format(Status.MinFillTime, Status.MaxFillTime, Status.FillHoldTime)
+    # Loop LN2lines, check if active, and add success/failure to the message.
+    for FillLine in Status.LineStatus:
+        if FillLine[1] == b'Y' and Lines is not None and FillLine[0] not in Lines:
+            Message += "Line {} active, not filled this time.\n".format(FillLine[0])
+        elif FillLine[1] == b'Y':
+            Message += "Line {} active. ".format(FillLine[0])
+            ActiveCount += 1
+            LineMessage, Failed = LineFillResult(FillLine, Status)
+            Message += LineMessage
+            FailCount += Failed
+        else:
+            Message += "Line {} inactive.\n".format(FillLine[0])
+    if FailCount > 0:
+        Message = "ATTENTION - {} failure(s) out of {} active lines!!\n".format(FailCount, ActiveCount) + Message
+    else:
+        Message = "Looks good!\n" + Message
+    return Message, FailCount, ActiveCount
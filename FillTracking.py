@@ -0,0 +1,134 @@
+# Fill completion tracking for LN2 Fill control Server
+# Follows a fill of all active lines (fillall), or a sequence of single line fills (fillline),
+#   by polling status instead of sleeping for the worst case.
+#
+#  - updatefill() on the controller closes each line as soon as it has been cold for
+#       FILLHOLDTIME, and readstatus reports "Fill underway!!" until then.
+#  - The tracker polls on a short interval which grows while nothing changes and drops
+#       back to the minimum each time a line finishes, so results arrive within
+#       FillPollMin..FillPollMax seconds of the line closing.
+#  - Tracking ends when no tracked line is still filling, or when MaxFillTime has passed
+#       (the controller will have timed the lines out by then).
+# Usage (ignoring errors):
+#   Tracker = FillTracking.NewTracker(S, Status)          # Status read just before the fill
+#   while not FillTracking.Done(Tracker):
+#       t.sleep(FillTracking.NextInterval(Tracker))
+#       for FillLine in FillTracking.Update(Tracker, ParseStatus(...)): report FillLine
+#
+#  - A sequence (NewSequence()) starts with the lines queued rather than filling.  NextLines()
+#       gives the lines to start now, at most FillConcurrency filling at once (0 = no limit),
+#       so the next line starts as soon as the status shows one has finished.  Start() adds
+#       each line to the tracker once its fillline command has been sent.
+#  - Retry() queues a failed line again, up to FillRetryMax times.  Lines failed as too
+#       short are not retried, they were cold straight away so the dewar was already full.
+# Usage for a sequence:
+#   Tracker = FillTracking.NewSequence(S, Status, Lines)
+#   while not FillTracking.Done(Tracker):
+#       for Line in FillTracking.NextLines(Tracker): send fillline/Line, FillTracking.Start(Tracker, Line)
+#       t.sleep(FillTracking.NextInterval(Tracker))
+#       for FillLine in FillTracking.Update(Tracker, ParseStatus(...)): report FillLine, FillTracking.Retry(Tracker, FillLine)
+
+import time as t
+
+import StatusParser
+
+
+# Create a tracker for a fill of all active lines
+#   - Status is the last status read before the fill was started
+def NewTracker(S, Status, Lines=None):
+    if Lines is None:
+        Lines = [FillLine[0] for FillLine in Status.LineStatus if FillLine[1] == b'Y']
+    return {
+        'StartTime': t.time(),
+        'Deadline': t.time() + Status.MaxFillTime + 1,
+        'Interval': S['FillPollMin'],
+        'MinInterval': S['FillPollMin'],
+        'MaxInterval': S['FillPollMax'],
+        'Growth': S['FillPollGrowth'],
+        'Pending': set(Lines),   # Lines still expected to finish
+        'Finished': {},          # Line number -> (time finished, status row)
+        'Status': Status,
+        'Queue': [],             # Lines waiting to start (sequence only)
+        'Concurrency': 0,
+        'RetriesLeft': {},
+    }
+
+
+# Create a tracker for a sequence of single line fills of Lines
+def NewSequence(S, Status, Lines):
+    Tracker = NewTracker(S, Status, [])
+    Tracker['Deadline'] = t.time()
+    Tracker['Queue'] = list(Lines)
+    Tracker['Concurrency'] = S['FillConcurrency']
+    Tracker['RetriesLeft'] = {Line: S['FillRetryMax'] for Line in Lines}
+    return Tracker
+
+
+# Take the lines which should be started now off the queue
+def NextLines(Tracker):
+    Lines = []
+    while Tracker['Queue'] and (Tracker['Concurrency'] == 0 or len(Tracker['Pending']) + len(Lines) < Tracker['Concurrency']):
+        Lines.append(Tracker['Queue'].pop(0))
+    return Lines
+
+
+# Record that a line has been started, extending the deadline to cover its fill
+def Start(Tracker, Line):
+    Tracker['Pending'].add(Line)
+    Tracker['Finished'].pop(Line, None)
+    Tracker['Deadline'] = max(Tracker['Deadline'], t.time() + Tracker['Status'].MaxFillTime + 1)
+    Tracker['Interval'] = Tracker['MinInterval']
+
+
+# Queue a finished line again if it failed (other than too short) and has retries left, returns True if queued
+def Retry(Tracker, FillLine):
+    Line = FillLine[0]
+    if FillLine[8][0:5] != b'Fail!' or FillLine[9] >= -Tracker['Status'].MinFillTime:
+        return False
+    if Tracker['RetriesLeft'].get(Line, 0) < 1:
+        return False
+    Tracker['RetriesLeft'][Line] -= 1
+    Tracker['Queue'].append(Line)
+    return True
+
+
+# Seconds to wait before the next status poll, never past the fill deadline
+def NextInterval(Tracker):
+    Remaining = Tracker['Deadline'] - t.time()
+    return max(0, min(Tracker['Interval'], Remaining))
+
+
+# True once every tracked (and queued) line has finished or the fill deadline has passed
+def Done(Tracker):
+    if not Tracker['Pending']:
+        return not Tracker['Queue']
+    return t.time() >= Tracker['Deadline']
+
+
+# Update the tracker with a freshly parsed status
+#   - Returns the status rows of lines which finished since the last update
+def Update(Tracker, Status):
+    Tracker['Status'] = Status
+    NewlyFinished = []
+    for FillLine in Status.LineStatus:
+        if FillLine[0] in Tracker['Pending'] and FillLine[8] != StatusParser.Underway:
+            Tracker['Pending'].discard(FillLine[0])
+            Tracker['Finished'][FillLine[0]] = (t.time(), FillLine)
+            NewlyFinished.append(FillLine)
+    if NewlyFinished:
+        Tracker['Interval'] = Tracker['MinInterval']
+    else:
+        Tracker['Interval'] = min(Tracker['Interval'] * Tracker['Growth'], Tracker['MaxInterval'])
+    return NewlyFinished
+
+
+# Lines of Lines (all active lines if None) which Status shows filling, e.g. to tell whether a fill
+#   command which got no answer has started a fill
+def Filling(Status, Lines=None):
+    return [FillLine[0] for FillLine in Status.LineStatus if FillLine[8] == StatusParser.Underway
+            and (FillLine[0] in Lines if Lines is not None else FillLine[1] == b'Y')]
+
+
+# Seconds since the start of the fill
+def Elapsed(Tracker):
+    return t.time() - Tracker['StartTime']
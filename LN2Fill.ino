@@ -73,6 +73,10 @@ int LineFillData[NUMFILLLINES][FILLLOGLENGTH];  // Stores the LED value log for
 byte LineFillDataMarker[NUMFILLLINES] = {        // Stores current log position for last fill on each line
   0, 0, 0, 0
 };
+unsigned long FillGeneration = 1;  // Incremented whenever any line's fill data changes
+unsigned long LineFillGeneration[NUMFILLLINES] = {  // Value of FillGeneration when each line's fill data last changed
+  1, 1, 1, 1
+};
 
 // Globals for managing ongoing fill
 byte NumFilling = 0;  // Number of lines currently being filled
@@ -163,6 +167,9 @@ void process(BridgeClient Client) {
   if (Command == "readstatus") {
     readstatus(Client);
   }
+  if (Command == "readstatuscsv") { // Compact status for the control script
+    readstatuscsv(Client);
+  }
   if (Command == "readled") { // Read specific LED value
     readled(Client);
   }
@@ -437,6 +444,76 @@ void readstatus(BridgeClient Client) {
   return;
 }
 
+// Compact, machine readable version of readstatus, one comma separated record per line:
+//    S,<time>,<min fill time>,<max fill time>,<hold time>,<tank valve open>,<num lines>,<log interval>,<log length>,<fill generation>
+//    L,<line>,<active>,<led pin>,<led thresh>,<adc val>,<led V>,<valve pin>,<valve open>,<filling>,<last fill status>
+//    T,<line>,<line fill generation>,<led value>,<led value>...
+// Number after the command is the fill generation the client already has, fill data (T records)
+//  is only sent for lines which have changed since then.  0 gets the fill data of every line.
+// WARNING: If this is updated, ParseStatusCsv() in StatusParser.py should be updated to match.
+void readstatuscsv(BridgeClient Client) {
+
+  int i,j;
+  int AdcVal;
+  unsigned long Since = Client.parseInt();
+
+  Client.print("S,");
+  Client.print(now());
+  Client.print(",");
+  Client.print(FILLMINTIME);
+  Client.print(",");
+  Client.print(FILLTIMEOUT);
+  Client.print(",");
+  Client.print(FILLHOLDTIME);
+  Client.print(",");
+  Client.print(digitalRead(SUPPLYTANKPIN) == VALVEOPEN ? 1 : 0);
+  Client.print(",");
+  Client.print(NUMFILLLINES);
+  Client.print(",");
+  Client.print(FILLLOGINTERVAL);
+  Client.print(",");
+  Client.print(FILLLOGLENGTH);
+  Client.print(",");
+  Client.print(FillGeneration);
+  Client.print("\n");
+
+  for (i = 0; i < NUMFILLLINES; i++) {
+    AdcVal = analogRead(LineLedPins[i]);
+    Client.print("L,");
+    Client.print(i+1);
+    Client.print(LineActive[i] == 1 ? ",1," : ",0,");
+    Client.print(LineLedPins[i]);
+    Client.print(",");
+    Client.print(LineLedThresh[i]);
+    Client.print(",");
+    Client.print(AdcVal);
+    Client.print(",");
+    Client.print(Adc2Volts(AdcVal));
+    Client.print(",");
+    Client.print(LineValvePins[i]);
+    Client.print(digitalRead(LineValvePins[i]) == VALVEOPEN ? ",1," : ",0,");
+    Client.print(Filling[i]);
+    Client.print(",");
+    Client.print(LineFillStatus[i]);
+    Client.print("\n");
+  }
+
+  for (i = 0; i < NUMFILLLINES; i++) {
+    if (LineFillGeneration[i] > Since) {
+      Client.print("T,");
+      Client.print(i+1);
+      Client.print(",");
+      Client.print(LineFillGeneration[i]);
+      for (j = 0; j<=LineFillDataMarker[i]; j++) {
+        Client.print(",");
+        Client.print(LineFillData[i][j]);
+      }
+      Client.print("\n");
+    }
+  }
+  return;
+}
+
 void testprint(BridgeClient Client) {
   int i, N;
   N = Client.parseInt();
@@ -487,6 +564,7 @@ void fillline(BridgeClient Client) {
   ColdStartTime[LineNumber-1] = 0;
   // First entry in fill data record
   LineFillData[LineNumber-1][LineFillDataMarker[LineNumber-1]] = analogRead(LineLedPins[LineNumber-1]);
+  filldatachanged(LineNumber);
   // Print message
   Client.print(F("Opening line "));
   Client.print(LineNumber);
@@ -601,6 +679,7 @@ void fillall(BridgeClient Client) {
       ColdStartTime[i] = 0;
       // First entry in fill data record
       LineFillData[i][LineFillDataMarker[i]] = analogRead(LineLedPins[i]);
+      filldatachanged(i+1);
       // Print message
       Client.print("Opening line ");
       Client.print(i+1);
@@ -626,6 +705,7 @@ void updatefill() {
       if ((FillTime/FILLLOGINTERVAL) > LineFillDataMarker[i] && LineFillDataMarker[i] < FILLLOGLENGTH) {
         LineFillDataMarker[i] += 1;
         LineFillData[i][LineFillDataMarker[i]] = analogRead(LedPin);
+        filldatachanged(i+1);
       }
       // Check if cold already
       if (ColdStartTime[i] > 0) {
@@ -747,6 +827,14 @@ void deactivateline(BridgeClient Client) {
 void clearfilldata(int LineNum) {
   memset(LineFillData[LineNum-1],0,sizeof(int)*FILLLOGLENGTH);
   LineFillDataMarker[LineNum-1] = 0;
+  filldatachanged(LineNum);
+  return;
+}
+
+// Record that the fill data of a line has changed, so readstatuscsv sends it again
+void filldatachanged(int LineNum) {
+  FillGeneration += 1;
+  LineFillGeneration[LineNum-1] = FillGeneration;
   return;
 }
 
@@ -20,564 +20,536 @@
 #       * Total fill time for all fills.
 #   * Auto-update files relating to a web status page.
 
-# Plotting...
-import matplotlib
-matplotlib.use('pdf')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-
 # Basics...
-import urllib3
 import time as t
-import parse
 import os
-
-# Email...
-import smtplib
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import threading
 
 # Configuration Function
 import Config as Conf
-
-# Call configuration functions
-S = Conf.Configure()  # Settings dict, called "S" to avoid long lines later in script
+import StatusParser
+import FillResults
+import FillTracking
+import FillHistory
+import Notify
+import Logger
+import Scheduler
+import Dashboard
+import StatusCache
+import Transport
+import Metrics
+import Checkpoint
+import EventBus
+
+# Settings dict and other state, all set up by Setup() so that importing
+#   this module (e.g. from a test or another script) does not touch any files or the network.
+#   Logging goes through Logger, which is set up there too, requests to the controller through Transport.
+#   Each stage of the loop is timed in a Metrics span, see Metrics.py.
+#   Runtime state is checkpointed so a restart carries on where it left off, see Checkpoint.py.
+#   Fill results, status reads and contact problems are published on the event bus, the analytics,
+#     plots, mail and dashboard are updated by its subscribers (see Subscribers below and EventBus.py).
+#   urllib3 (by Transport), TraceArchive/Telemetry/Analytics (numpy) and Plotting (matplotlib) are only imported when needed, email by Notify.
+S = None  # Settings dict, called "S" to avoid long lines later in script
+TraceArchive = None
+Telemetry = None
+Analytics = None
+Plotting = None
+Schedule = None  # Fill schedule, see Scheduler.py
+Cache = None  # Shared status snapshot, see StatusCache.py
 
 # Functions
 # -------------------------------
 
-# Function to update logfile with timestamp + message
-def Log(LogFile,Message):
-    if S['LogActive']:
-        #print("Writing to log file:\n---")
-        if LogFile.closed:
-            print("Error - Log file not open!")
-            return 1
-        else:
-            Message = t.ctime(t.time()) + ": " + Message + "\n"
-            LogFile.write(Message)
-            LogFile.flush()
-        print(Message)
+# Send email messages to subscribed addresses (and post to ELog)
+#   - Only queues the message, Notify sends it from a background thread.
+def SendMail(Message,*args):
+    Notify.Send(Message,*args)
 
 
-# Send email messages to subscribed addresses
-def SendMail(Message,*args):
-    if S['MailNotificationActive']:
-        print("Sending Email to subscribers ({}):\n---".format(", ".join(S['MailAddressList'])))
-
-        # Create MIME object and add header info
-        msg = MIMEMultipart()
-        msg['Subject'] = 'Message from LN2 Fill Server'
-        msg['From'] = S['SenderEmail']
-        msg['To'] = ", ".join(S['MailAddressList'])
-
-        # Create body as MIMEText object
-        BodyText= MIMEText(Message, 'plain')
-        print(BodyText)
-        # Attach body to message
-        msg.attach(BodyText)
-
-        # Assume we know that the image files are all in PDF format
-        for arg in args:
-            # Open the files in binary mode.  Let the MIMEImage class automatically
-            # guess the specific image type.
-            FilePath=str(arg)
-            # OPen file for attachment
-            File = open(FilePath, 'rb')
-            # Create empty MIME encoded file
-            MIMEFile = MIMEBase('application','pdf')
-            # Add contents of file to MIMEFile
-            MIMEFile.set_payload(File.read())
-            File.close()
-            # Encode in base64, bit unsure what's going on here but it was  needed to get this working
-            encoders.encode_base64(MIMEFile)
-            # Add header to MIMEFile and attach to message
-            MIMEFile.add_header('Content-Disposition','attachment;filename={}'.format(FilePath))
-            # Attach file to the message
-            msg.attach(MIMEFile)
-
-        # Send the email via our own SMTP server.
-        Smtp = smtplib.SMTP('localhost')
-        Smtp.sendmail(S['SenderEmail'], S['MailAddressList'], msg.as_string())
-        Smtp.quit()
-
-        # Also post message to ELog
-        ELogCommand = "/usr/local/bin64/elog  -h npa -p 8080 -l \"Ln2 Autofill\""
-        ELogCommand = ELogCommand + " -u ln2_user ln2_user -a Author=ln2_user"
-        ELogCommand = ELogCommand + " -a Type=\"Fill Record\" -f {}".format(FilePath)
-        ELogCommand = ELogCommand + " -a Subject=\"AUTO: Fill status\" \"{}\"".format(Message)
-
-        os.system(ELogCommand)
+# URL to read status from
+#   - With the compact status the fill generation of the cached traces is sent, so the
+#       controller only sends traces which have changed since.
+def StatusUrl():
+    if S['CompactStatus']:
+        return S['StatusCsvUrl'] + str(ParseStatus.TraceCache['Generation'])
+    return S['StatusUrl']
+
+
+# Read and parse the status from the controller, the Fetch function of the status cache
+#   - Raises ValueError(Message, raw status text) if the status cannot be parsed
+def FetchStatus():
+    with Metrics.Span('fetch'):
+        StatusMessage = Transport.Request(S, StatusUrl())
+    if S['DEBUG'] > 1:
+        Logger.Debug("Raw status message from Arduino: {}",StatusMessage)
+    try:
+        with Metrics.Span('parse'):
+            return ParseStatus(StatusMessage)
+    except Exception as Error:
+        Metrics.Count('parse_failures')
+        Logger.Error("=== Cannot parse status ===\nBad status as follows:\n{}",StatusMessage.decode('ascii','replace'))
+        raise ValueError("Cannot parse status ({})".format(repr(Error)), StatusMessage.decode('ascii','replace'))
+
+
+# Get the status through the cache, at most MaxAge seconds old (see StatusCache.Get())
+#   - Transport does the retries, returns None if the status could not be read or parsed.
+#   - Once RetryStatusMax reads in a row have failed contact is reported lost (mailed once), then
+#       restored at the next good read.  The control loop keeps polling meanwhile.
+#   - Requires GetStatus.Failures be initialised (done in Setup())
+def GetStatus(MaxAge=None):
+    try:
+        Status = StatusCache.Get(Cache, MaxAge)
+    except ValueError as Error:
+        GetStatus.Failures += 1
+        if GetStatus.Failures == 1:
+            SendMail("Error parsing status message: \n\n" + Error.args[1])
+        return None
+    except OSError as Error:
+        GetStatus.Failures += 1
+        Metrics.Count('status_failures')
+        Logger.Warning("=== Exception Raised Fetching Status Message! ({}) ===",repr(Error))
+        if GetStatus.Failures == S['RetryStatusMax'] + 1:
+            Logger.Event('ContactLost',"=== Maximum retries reached! ===")
+            Metrics.Count('contact_lost')
+            EventBus.Publish('ContactLost', Message="Cannot communicate with Arduino - Max Retires Reached!")
+        return None
+    if GetStatus.Failures > S['RetryStatusMax']:
+        Logger.Event('ContactRestored',"Contact restored after {} failed reads.",GetStatus.Failures)
+        EventBus.Publish('ContactRestored', Message="Contact with Arduino restored after {} failed reads.".format(GetStatus.Failures))
+    GetStatus.Failures = 0
+    return Status
 
 
 # Function to parse StatusMessage returned by microcontroller and populate dict with results
-#   - need to be careful with string types, default python3 strings are utf-8 unicode
-#       but the data from the microcontroller output is in ascii bytes.  String comparison
-#       fails if the types are different.
-#  - "line" can mean a physical LN2 fill line or a line of text in the status message, ugly
-#       but I couldn't think of better names at the time of writing.
+#   - Parsing itself is done in a single pass by StatusParser (either format), this just logs a summary.
+#   - Traces not sent by the controller are filled in from ParseStatus.TraceCache (initialised in Setup())
+#   - This may run on the status cache refresh thread while SaveCheckpoint() copies the trace cache on the
+#       main thread, hence ParseStatus.TraceLock around both
+#   - Raises ValueError if the message cannot be parsed.
 def ParseStatus(StatusMessage):
-    if S['DEBUG'] > 0:
-        Log(LogFile,"Parsing status message...")
-    # Populate dummy data for now, real function later
-    Status = dict()
-    Status['MinFillTime'] = 10
-    Status['MaxFillTime'] = 30
-    Status['FillHoldTime'] = 2
-    Status['MainTankStatus'] = "Closed"
-    Status['LineStatus'] = []
-    Status['NumLines'] = 0
-    Status['FillTimeScale'] = [];
-    Status['LineFillStatus'] = []
-
-    # Record of which fields have been freshly populated
-    StatusCheck = dict()
-    StatusCheck['MinFillTime'] = 0
-    StatusCheck['MaxFillTime'] = 0
-    StatusCheck['FillHoldTime'] = 0
-    StatusCheck['MainTankStatus'] = 0
-    StatusCheck['LineStatus'] = 0
-    StatusCheck['NumLines'] = 0
-    StatusCheck['FillTimeScale'] = 0;
-    StatusCheck['LineFillStatus'] = 0
-
-    # Loop the actual status message and extract info,
-    #    log changes and record StatusCheck of this item
-    StatusLines = 0 # Count of lines containing data
-    Lines = StatusMessage.splitlines() # Split status into indiv lines
-    StatusLineNum = 0 # Count of all lines
-    while StatusLineNum < len(Lines):
-        Line = Lines[StatusLineNum]
-        StatusLineNum = StatusLineNum + 1
-        # Skip empty lines
-        if len(Line) == 0:
-            continue # ..to next line of status message
-        # So this should be a line containing some text
-        StatusLines += 1
-        if S['DEBUG'] > 1:  # If debugging, print line before parsing
-            Log(LogFile,("Line: "+Line.decode('utf-8')))
-        # Check for min fill time
-        Flag = b"Minimum fill time:"
-        if Line[0:len(Flag)] == Flag:
-            Pattern = "Minimum fill time: {} s"
-            Values = parse.parse(Pattern,Line.decode('utf-8'))
-            Status['MinFillTime'] = int(Values[0])
-            StatusCheck['MinFillTime'] = 1
-            if S['DEBUG'] > 0:
-                Log(LogFile,"MinFillTime = {}".format(Status['MinFillTime']))
-            continue # ..to next line of status message
-        # Check for max fill time
-        Flag = b"Maximum fill time:"
-        if Line[0:len(Flag)] == Flag:
-            Pattern = "Maximum fill time: {} s"
-            Values = parse.parse(Pattern,Line.decode('utf-8'))
-            Status['MaxFillTime'] = int(Values[0])
-            StatusCheck['MaxFillTime'] = 1
-            if S['DEBUG'] > 0:
-                Log(LogFile,"MaxFillTime = {}".format(Status['MaxFillTime']))
-            continue # ..to next line of status message
-        # Check for fill hold time
-        Flag = b"Fill hold time:"
-        if Line[0:len(Flag)] == Flag:
-            Pattern = "Fill hold time: {} s"
-            Values = parse.parse(Pattern,Line.decode('utf-8'))
-            Status['FillHoldTime'] = int(Values[0])
-            StatusCheck['FillHoldTime'] = 1
-            if S['DEBUG'] > 0:
-                Log(LogFile,'FillHoldTime = {}'.format(Status['FillHoldTime']))
-            continue # ..to next line of status message
-        # Check for main tank status
-        Flag = b"Main tank valve is"
-        if Line[0:len(Flag)] == Flag:
-            Pattern = "Main tank valve is {}"
-            Values = parse.parse(Pattern,Line.decode('utf-8'))
-            Status['MainTankStatus'] = Values[0]
-            StatusCheck['MainTankStatus'] = 1
-            if S['DEBUG'] > 0:
-                Log(LogFile,'MainTankStatus = {}'.format(Status['MainTankStatus']))
-            continue # ..to next line of status message
-        # Check for fill line data table
-        Flag = b"| LineNum |"
-        if Line[0:len(Flag)] == Flag:
-            # Launch loop to get line status info
-            if S['DEBUG'] > 0:
-                Log(LogFile,"Starting line status loop...")
-            Line = Lines[StatusLineNum]
-            while len(Line) == 0: # Skip empty lines between column headings and real data
-                StatusLineNum = StatusLineNum + 1
-                Line = Lines[StatusLineNum]
-            while StatusLineNum < len(Lines): # Now expecting one statusline for each fill line, all starting with "|"
-                if len(Line) > 0 and Line.decode('utf-8')[0] == "|":
-                    Items = Line.split(b'|')
-                    if len(Items) == 10:
-                        LineData = []
-                        LineData.append(int(Items[1].strip())) # Line number
-                        LineData.append(Items[2].strip())      # Active?
-                        LineData.append(int(Items[3].strip())) # LED pin #
-                        LineData.append(float(Items[4].strip())) # LED threshold
-                        LineData.append(int(Items[5].strip())) # ADC value
-                        LineData.append(float(Items[6].strip())) # LED Volts
-                        LineData.append(int(Items[7].strip())) # Valve pin #
-                        LineData.append(Items[8].strip())      # Valve Status
-                        FillInfo = Items[9].strip().split() # Fill status string
-                        LineData.append(FillInfo[0])        # Succ!/Fail! string
-                        LineData.append(int(FillInfo[1].strip(b"()"))) # Fill time
-                        Status['LineStatus'].append(LineData)
-                        Status['NumLines'] += 1
-                        StatusCheck['LineStatus'] = 1
-                        StatusCheck['NumLines'] = 1
-                        if S['DEBUG'] > 0:
-                            Log(LogFile,'Line {} data = {}'.format(LineData[0],str(Items)))
-                    else:
-                        Log(LogFile,'Bad line data ({} chars, {} Items)'.format(len(Line),len(Items)))
-                    StatusLineNum = StatusLineNum + 1
-                    Line = Lines[StatusLineNum]
-                else:
-                    break
-            continue # ..to next line of status message
-        # Check for last fill data
-        Flag = b"Time  :"
-        if Line[0:len(Flag)] == Flag:
-            # Grab time scale for fill status info
-            Items = Line.split()
-            FillTimeScale = list(map(int,Items[2:len(Items)]))
-            Status['FillTimeScale'] = FillTimeScale
-            StatusCheck['FillTimeScale'] = 1
-            # Launch loop to get last fill status info
-            while StatusLineNum < len(Lines):
-                Line = Lines[StatusLineNum]
-                StatusLineNum = StatusLineNum + 1
-                Items = Line.split()
-                FillLineNumber = int(Items[1].strip(b":"))
-                LineFillRecord = list(map(int,Items[2:len(Items)]))
-                Status['LineFillStatus'].append(LineFillRecord)
-                # There should be no missing lines so FillLineNumber == number of entries so far.
-                assert(FillLineNumber == len(Status['LineFillStatus']))
-                StatusCheck['LineFillStatus'] = 1
-                if S['DEBUG'] > 0:
-                    Log(LogFile,'Line {} fill data = {}'.format(FillLineNumber,LineFillRecord))
-            continue # ..to next line of status message
-        # If no match found for this line...
-        if S['DEBUG'] > 1:
-            print("No match ({} chars)".format(len(Line)))
-
-    # Check all status items have been processed
-    for Key, Value in StatusCheck.items():
-        if S['DEBUG'] > 1:
-            print('{} updated? = {}'.format(Key,Value))
-        assert(int(Value) == 1)
-    # Return Status dict to main
+    Status = StatusParser.Parse(StatusMessage)
+    with ParseStatus.TraceLock:
+        Status = StatusParser.MergeTraces(ParseStatus.TraceCache, Status)
+    Logger.Debug("Parsed status: Min/Max/Hold = {}/{}/{} s, main tank {}, {} lines",
+        Status.MinFillTime,Status.MaxFillTime,Status.FillHoldTime,Status.MainTankStatus,Status.NumLines)
+    if S['DEBUG'] > 1:
+        for LineData in Status.LineStatus:
+            Logger.Debug('Line {} data = {}',LineData[0],LineData,Line=LineData[0])
+        for Index, LineFillRecord in enumerate(Status.LineFillStatus):
+            Logger.Debug('Line {} fill data = {}',Index+1,LineFillRecord,Line=Index+1)
+    # Viewers of the dashboard get this status instead of asking the controller themselves (see ShowStatus())
+    EventBus.Publish('StatusPolled', Status=Status)
+    # Return Status to main
     return Status
 
 # Function to check if a fill was finished succesfully.
-#   - Input is a status dictionary containing data from a parsed status message
+#   - Input is a Status (StatusParser.py) containing data from a parsed status message
 #   - Assumes status message is from at least MaxFillTime seconds after a recent fill of all active lines
 #   - Should check if fill was succesful and make appropriate notifications
 #   - Also add total fill time to long term log
 #   - Requires CheckFillSuccess.LastFill be initialised e.g. CheckFillSuccess.LastFill = [[],[],[],[]]
-def CheckFillSuccess(Status):
-    if S['DEBUG'] > 0:
-        print("Checking fill success...")
-    # Variables to count lines and failures
-    FailCount = 0
-    ActiveCount = 0
-    InactiveCount = 0
-    # Add min/max/hold times to top of status message
-    FillSuccessMessage = "Current Min/Max/Hold time = {}/{}/{} s\n".format(Status['MinFillTime'],Status['MaxFillTime'],Status['FillHoldTime'])
-    # Loop LN2lines, check if active, and add success/failure to the message.
-    for Index, FillLine in enumerate(Status["LineStatus"]):
-        if FillLine[1] == b'Y':
-            FillSuccessMessage += "Line {} active. ".format(FillLine[0])
-            ActiveCount += 1
-            if FillLine[8][0:5] == b'Fail!':  # If fill has failed, t->-t
-                # If 0 > t > -1*MinFillTime = Too Short!
-                if FillLine[9] >= (-1 * Status['MinFillTime']):
-                    FillSuccessMessage += "!!!!!!!!! FILL FAILED ({}s) TOO SHORT !!!!!!!!!!\n".format(FillLine[9])
-                # If -1*MinFillTime > t >= -1*MAxFillTime = Timout
-                elif FillLine[9] <= (-1 * Status['MaxFillTime']):
-                    FillSuccessMessage += "!!!!!!!!! FILL FAILED ({}s) TIMEOUT !!!!!!!!!!\n".format(FillLine[9])
-                # Should not reach this condition, t=0
-                elif FillLine[9] == 0:
-                    FillSuccessMessage += "!!!!! FILL FAILED ({}s) t=0 (erm, I'm not expecting this to happen...) !!!!!!!!!!\n".format(FillLine[9])
-                # All other, i.e. t < -1* MaxFillTime (shouldn't happen ever), or t>0 (shouldn't happen at same time as "Fail")
-                else:
-                    FillSuccessMessage += "!!!!!!!!! FILL FAILED ({}s) UNKNOWN CONDITION !!!!!!!!!!\n".format(FillLine[9])
-                FailCount += 1
-            elif FillLine[8][0:5] == b'Succ!':
-                FillSuccessMessage += "Fill Success!!! ({}s)\n".format(FillLine[9])
-            else:
-                if S['DEBUG'] > 0:
-                    print("What?")
-                    print(FillLine[8][0:5])
-        else:
-            FillSuccessMessage += "Line {} inactive.\n".format(FillLine[0])
-            InactiveCount += 1
-        CheckFillSuccess.TotalFillTimeRecord[Index].append(int(FillLine[9]))
-    # Now generate a plot of LED Volts vs Time for fill
-    if S['PLOTS']:
-        # Create pdf to store images and get the time scale from the status message
-        Pdf = PdfPages(S['LogPath'] + 'LN2Plots.pdf')
-        TimeScale = list(map(int,Status['FillTimeScale']))
-        # Loop LN2lines and get the LED adc values from each, add to plot
-        for Index, FillStatus in enumerate(Status['LineFillStatus']):
-            plt.figure(1)
-            Ax = plt.subplot(111)
-            if Index == 0:
-                plt.cla() # Clear axis if this is first line
-            # If we have a previous fill ,plot that first
-            if len(CheckFillSuccess.LastFill[Index]) > 0:
-                PlotFormat = S['PlotColours'][Index % len(S['PlotColours'])] + "--"
-                Ax.plot(TimeScale[0:len(CheckFillSuccess.LastFill[Index])],CheckFillSuccess.LastFill[Index],PlotFormat,label="Line {} (previous)".format(Index+1))
-            # Then get the latest fill values and plot them
-            AdcValues = list(map(int,FillStatus))
-            PlotFormat = S['PlotColours'][Index % len(S['PlotColours'])] + "-"
-            Ax.plot(TimeScale[0:len(AdcValues)],AdcValues,PlotFormat,label="Line {}".format(Index+1))
-            # Finally, store the latest fill as the previous.
-            CheckFillSuccess.LastFill[Index] = AdcValues
-        # Now make the plot pretty and add to pdf
-        plt.legend(loc=2)
-        plt.suptitle("LN2 Fill: Adc Voltage Drop (ADC Units) vs Time", fontsize=14, fontweight='bold')
-        Ax.grid('on')
-        Ax.set_xlabel('Time (s)')
-        Ax.set_ylabel('Adc Value')
-        Pdf.savefig()
-
-        # Now a plot of the total fill time record
-        for Index, FTRecord in enumerate(CheckFillSuccess.TotalFillTimeRecord):
-            plt.figure(2)
-            Ax = plt.subplot(111)
-            if Index == 0:
-                plt.cla() # Clear axis if this is first line
-            PlotFormat = S['PlotColours'][Index % len(S['PlotColours'])] + "-"
-            # unpythonic hack
-            if len(FTRecord) > S['HistoryPlotPeriod']:
-                FTRecordTrunc = FTRecord[-1*S['HistoryPlotPeriod']::]
-            else:
-                FTRecordTrunc = FTRecord
-            for Index, Element in enumerate(FTRecordTrunc):
-                if int(Element) < 0:
-                    FTRecordTrunc[Index] = 0		
-            Ax.plot(range(0,len(FTRecordTrunc)),FTRecordTrunc,PlotFormat,label="Line {}".format(Index+1))
-
-        # Now make the plot pretty and add to pdf
-        #plt.legend(loc=2) # Commented as labels same as previous plot
-        plt.suptitle("LN2 Fill: Total Fill Time", fontsize=14, fontweight='bold')
-        Ax.grid('on')
-        Ax.set_xlabel('Fill Number')
-        Ax.set_ylabel('Total Time (s)')
-        Pdf.savefig()
-
-        Pdf.close()
-
-
-    if FailCount > 0:
-        FillSuccessMessage = "ATTENTION - {} failure(s) out of {} active lines!!\n".format(FailCount,ActiveCount) + FillSuccessMessage
-    else:
-        FillSuccessMessage = "Looks good!\n" + FillSuccessMessage
-    Log(LogFile,FillSuccessMessage)
-    if S['PLOTS']:
-        SendMail(FillSuccessMessage,(S['LogPath'] + 'LN2Plots.pdf'))
-    else:
-        SendMail(FillSuccessMessage)
-
-    # Finally save FillTimeRecord to file
-    with open(S['FillRecordSaveFile'], 'w') as File:
-        # Loop fill lines and for each one create a string of the times.  new line of text for each ln2 line
-        for Line in CheckFillSuccess.TotalFillTimeRecord:
-            s = '';
-            for Fill in Line:
-                s += str(Fill) + ' '
-            s += '\n'
-            File.write(s)
-
-
+#   - Lines is the list of lines filled, None for a fill of all active lines
+#   - Classifies, schedules and records the results (fill history and trace archive) here, the analytics,
+#       plots and mail are done by the subscribers to the FillResult event (AnalyseFill(), ReportFill())
+#       while the loop carries on.
+def CheckFillSuccess(Status, Lines=None):
+    Logger.Debug("Checking fill success...")
+    # Classify result of each line and build the summary message
+    FillSuccessMessage, FailCount, ActiveCount = FillResults.SummariseFill(Status, Lines)
+    # Schedule the next fill of each active line from its result
+    FailedLines = []
+    for FillLine in Status.LineStatus:
+        if FillLine[1] == b'Y' and (Lines is None or FillLine[0] in Lines):
+            Failed = FillResults.LineFillResult(FillLine, Status)[1]
+            Metrics.Count('fills', Result='fail' if Failed else 'success', Line=FillLine[0])
+            Scheduler.Record(Schedule, S, S['ControllerIP'], FillLine[0], FillLine[9], Failed)
+            if Failed:
+                FailedLines.append(FillLine[0])
+    # Add the fill times to the long term record, and the fill to the history and trace archive on disk
+    for Index, FillLine in enumerate(Status.LineStatus):
+        if Lines is None or FillLine[0] in Lines:
+            CheckFillSuccess.TotalFillTimeRecord[Index].append(int(FillLine[9]))
+    Now = t.time()
+    with Metrics.Span('history'):
+        FillHistory.Append(S['FillHistoryFile'], FillHistory.RecordsFromStatus(Status, Time=Now, Lines=Lines))
+        TraceArchive.Append(S['TraceArchivePath'], Status, Time=Now, Lines=Lines)
+    Logger.Event('FillResult',FillSuccessMessage,Failed=FailCount,Active=ActiveCount,
+                 FillTimes=[int(FillLine[9]) for FillLine in Status.LineStatus])
+    # Subscribers get their own copy of the fill time record, this one is added to by the next fill
+    EventBus.Publish('FillResult', Status=Status, Lines=Lines, Message=FillSuccessMessage, LastFill=CheckFillSuccess.LastFill,
+                     FillTimeRecord=[list(FillTimes) for FillTimes in CheckFillSuccess.TotalFillTimeRecord])
+    if FailedLines:
+        EventBus.Publish('FillFailed', Status=Status, Lines=FailedLines, Message=FillSuccessMessage)
+    # Finally, store the latest fill as the previous.
+    CheckFillSuccess.LastFill = [list(FillStatus) for FillStatus in Status.LineFillStatus]
 
 
 # Function to record long term logs of status items (e.g. LED volts) and alert if contact is lost with microcontroller
 #   - Main job is to provide early warning (i.e. before an actual fill is initiated) if contact with the microcontroller is localhost
 #   - May also log long term LED volts to check for slow trends
 #   - Possibly in future will also be used to sync clocks between server and microcontroller.
+#   - Readings are kept in the rolling Telemetry buffers, saved every TelemetrySaveInterval seconds.
+#   - Requires CheckStatus.Telemetry and CheckStatus.LastSave be initialised (done in Setup())
 def CheckStatus(Status):
-    if S['DEBUG'] > 0:
-        print("Checking status...")
+    Logger.Debug("Checking status...")
+    Now = t.time()
+    with Metrics.Span('telemetry'):
+        Telemetry.Record(CheckStatus.Telemetry, Now, Status)
+        Drifts = Telemetry.CheckDrift(CheckStatus.Telemetry, Status)
+    for Line, Message in Drifts:
+        Logger.Warning("=== " + Message + " ===")
+        SendMail("Warning: " + Message)
+        Scheduler.Drift(Schedule, S, S['ControllerIP'], Line)
+    if Now - CheckStatus.LastSave > S['TelemetrySaveInterval']:
+        with Metrics.Span('telemetry_save'):
+            Telemetry.Save(CheckStatus.Telemetry, S['TelemetryFile'])
+        CheckStatus.LastSave = Now
+        for Link in list(Transport.Links.values()):
+            Logger.Info("Transport " + Transport.Summary(Link))
+
+# Save the runtime state to CheckpointFile (if set), at most every CheckpointInterval seconds unless Force
+#   - Status is the latest status read, Fill the fill underway ({'Lines': lines or None for all active, 'Started'})
+#   - Requires SaveCheckpoint.LastSave be initialised (done in Setup())
+def SaveCheckpoint(Status, Fill=None, Force=False):
+    if not S['CheckpointFile'] or (not Force and t.time() - SaveCheckpoint.LastSave < S['CheckpointInterval']):
+        return
+    with Metrics.Span('checkpoint'):
+        with CheckFillSuccess.WarnedLock:
+            Warned = set(CheckFillSuccess.Warned)
+        # MergeTraces() replaces the traces in the cache rather than changing them, copying the dicts is enough
+        with ParseStatus.TraceLock:
+            TraceCache = dict(ParseStatus.TraceCache, Traces=dict(ParseStatus.TraceCache['Traces']))
+        Checkpoint.Save(S, {'TotalFillTimeRecord': CheckFillSuccess.TotalFillTimeRecord, 'LastFill': CheckFillSuccess.LastFill,
+                            'Warned': Warned, 'Failures': GetStatus.Failures, 'TraceCache': TraceCache,
+                            'LineResults': Checkpoint.LineResults(Status), 'Fill': Fill})
+    SaveCheckpoint.LastSave = t.time()
 
 # Function to check response from microcontroller following intitiation of a fill
 def CheckFillInitiated(Response):
-    if S['DEBUG'] > 0:
-        print("Checking fill initiated...")
-
-# Setup
+    Logger.Debug("Checking fill initiated...")
+
+# Send a fill command once, returns True if the fill has started
+#   - Never retried, a command which timed out may still have opened the valves.  If it fails the status
+#       is read back instead, the fill has started if any of Lines (all active lines if None) is filling.
+def SendFill(Url, Lines=None):
+    try:
+        Response = Transport.Request(S, Url, Retries=0)
+    except OSError as Error:
+        Logger.Warning("=== Exception Raised Initiating Fill ({}), checking status ===",repr(Error))
+        try:
+            Status = StatusCache.Get(Cache, 0)
+        except Exception as Error:
+            Logger.Warning("=== Cannot read status after fill command ({}) ===",repr(Error))
+            return False
+        Started = FillTracking.Filling(Status, Lines)
+        if Started:
+            Logger.Info("Lines {} are filling, the command was carried out",Started)
+        return bool(Started)
+    if S['DEBUG'] > 1:
+        Logger.Debug("Fill acknowledgement message from Arduino: {}",Response)
+    CheckFillInitiated(Response)
+    return True
+
+# Function to follow a fill until every active line has finished or MaxFillTime has passed
+#   - Polls status on the adaptive interval from FillTracking and logs each line's result as soon as it closes.
+#   - A failed status read is logged and skipped, the full status check after the fill does the retries.
+#   - Lines (default all active lines) are followed without logging a new fill if Resumed, for a fill started before a restart.
+def TrackFill(Status, Lines=None, Resumed=False):
+    Tracker = FillTracking.NewTracker(S, Status, Lines)
+    if Resumed:
+        Logger.Info("Following fill of lines {} started before the restart...",sorted(Tracker['Pending']))
+    else:
+        Logger.Event('FillStarted',"Tracking fill of lines {} (timeout {} seconds)...",sorted(Tracker['Pending']),Status.MaxFillTime,
+                     Lines=sorted(Tracker['Pending']))
+        EventBus.Publish('FillStarted', Lines=sorted(Tracker['Pending']))
+    while not FillTracking.Done(Tracker):
+        t.sleep(FillTracking.NextInterval(Tracker))
+        try:
+            FillStatus = StatusCache.Get(Cache, 0)
+        except Exception as Error:
+            Logger.Warning("=== Cannot read status during fill ({}) ===",repr(Error))
+            continue
+        CheckStatus(FillStatus)
+        for FillLine in FillTracking.Update(Tracker, FillStatus):
+            LineMessage, Failed = FillResults.LineFillResult(FillLine, FillStatus)
+            Logger.Event('LineFinished',"Line {} finished after {:.0f}s: {}",FillLine[0],FillTracking.Elapsed(Tracker),LineMessage.strip(),
+                         Line=FillLine[0],Failed=Failed)
+            EventBus.Publish('LineFinished', Status=FillStatus, Line=FillLine[0], Failed=Failed)
+    if Tracker['Pending']:
+        Logger.Warning("Fill timeout reached, lines {} still not finished",sorted(Tracker['Pending']))
+    return Tracker
+
+# Function to fill Lines with one fillline command each (see FillTracking.NewSequence())
+#   - Up to FillConcurrency lines fill at once, the next starts as soon as status shows one has finished.
+#   - Failed lines are filled again up to FillRetryMax times.
+#   - A line whose fillline command cannot be sent is skipped, it stays due so the next cycle tries again.
+def FillLines(Status, Lines):
+    Tracker = FillTracking.NewSequence(S, Status, Lines)
+    while not FillTracking.Done(Tracker):
+        for Line in FillTracking.NextLines(Tracker):
+            if not SendFill(S['FillLineUrl'] + str(Line), [Line]):
+                continue
+            FillTracking.Start(Tracker, Line)
+            Logger.Event('FillStarted',"Filling line {} (timeout {} seconds)...",Line,Status.MaxFillTime,Lines=[Line])
+            EventBus.Publish('FillStarted', Lines=[Line])
+        if not Tracker['Pending']:
+            continue
+        t.sleep(FillTracking.NextInterval(Tracker))
+        try:
+            FillStatus = StatusCache.Get(Cache, 0)
+        except Exception as Error:
+            Logger.Warning("=== Cannot read status during fill ({}) ===",repr(Error))
+            continue
+        CheckStatus(FillStatus)
+        for FillLine in FillTracking.Update(Tracker, FillStatus):
+            LineMessage, Failed = FillResults.LineFillResult(FillLine, FillStatus)
+            Logger.Event('LineFinished',"Line {} finished after {:.0f}s: {}",FillLine[0],FillTracking.Elapsed(Tracker),LineMessage.strip(),
+                         Line=FillLine[0],Failed=Failed)
+            EventBus.Publish('LineFinished', Status=FillStatus, Line=FillLine[0], Failed=Failed)
+            if FillTracking.Retry(Tracker, FillLine):
+                Logger.Info("Line {} will be filled again ({} retries left)",FillLine[0],Tracker['RetriesLeft'][FillLine[0]])
+    if Tracker['Pending']:
+        Logger.Warning("Fill timeout reached, lines {} still not finished",sorted(Tracker['Pending']))
+    return Tracker
+
+# Subscribers
 # -------------------------------
+# Each runs on its own thread for the events it is subscribed to in Setup(), see EventBus.py
+
+# Look for lines whose fills are getting slower, across the whole history (FillResult events)
+#   - CheckFillSuccess.Warned is also read by SaveCheckpoint() on the main thread, hence the lock
+def AnalyseFill(Event):
+    with Metrics.Span('analytics'):
+        Analysis = Analytics.Analyse(S, S['FillHistoryFile'], S['TraceArchivePath'])
+    with CheckFillSuccess.WarnedLock:
+        Messages = Analytics.Alerts(Analysis, CheckFillSuccess.Warned)
+    for Message in Messages:
+        Logger.Warning("=== " + Message + " ===")
+        SendMail("Warning: " + Message)
+
+
+# Queue the plots of a fill, the mail goes out with them attached once they are rendered (FillResult events)
+def ReportFill(Event):
+    Status, Message = Event.Fields['Status'], Event.Fields['Message']
+    if not S['PLOTS']:
+        SendMail(Message)
+        return
+    def MailWithPlots(Files):
+        if 'pdf' in Files:
+            SendMail(Message, Files['pdf'])
+        else:
+            SendMail(Message)
+    Plotting.Submit(Status.FillTimeScale, Status.LineFillStatus, Event.Fields['LastFill'],
+                    Event.Fields['FillTimeRecord'], OnDone=MailWithPlots)
 
-# Open LogFile
-LogFile = open(S['LogFilePath'],'a+')
-Log(LogFile,"------ Starting LN2 Autofill control script ------")
-Log(LogFile,"--------------------------------------------------")
-# Setup PoolManager to handle http requests
-Http = urllib3.PoolManager()
-
-# Check for saved fill data
-if os.path.isfile(S['FillRecordSaveFile']):
-    Log(LogFile,('Loading fill record from: ' + S['FillRecordSaveFile']))
-    CheckFillSuccess.TotalFillTimeRecord = []
-    # If saved data exists, open file and loop lines
-    with open(S['FillRecordSaveFile'], 'r') as File:
-        Lines = File.readlines()
-        for Line in Lines:
-            # Map numbers in the line to a list of ints and append to fill time record
-            CheckFillSuccess.TotalFillTimeRecord.append(list(map(int,Line.split())))
-    Log(LogFile,('Loaded.'))
-# If no saved data then create a new fill record...
-else:
-    Log(LogFile,'Starting new fill time record.')
-    CheckFillSuccess.TotalFillTimeRecord = []
-    for Line in range(S['NumberOfFillLines']):
-        CheckFillSuccess.TotalFillTimeRecord.append([])
-
-
-# Initialise last fill record in CheckFillStatus()
-CheckFillSuccess.LastFill = []
-for Line in range(S['NumberOfFillLines']):
-    CheckFillSuccess.LastFill.append([])
-
-RetryCount = 0
 
-# Main loop
-# -------------------------------
-while 1:
-    if S['DEBUG'] > 1:
-        print("--------------- DEBUG MODE: New Cycle ------------------------")
-    # Check Status
-    #try :
-    #    StatusMessage = Http.request('GET', S['StatusUrl'])
-    #except:
-    #    Log(LogFile,"=== Exception Raised Fetching Status Message! ===")
-    #    RetryCount += 1
-    #    if RetryCount > S['RetryStatusMax']:
-    #        StatusMessage = ""
-    #        Log(LogFile,"=== Maximum retries reached! ===")
-    #        SendMail("Cannot communicate with Arduino - Max Retires Reached!")
-    #        break
-    #    t.sleep(S['RetryStatusTimeout'])
-    #    continue
+# Mail loss and return of contact with the controller (ContactLost and ContactRestored events)
+def MailContact(Event):
+    SendMail(Event.Fields['Message'])
 
 
-    if S['DEBUG'] > 1:
-        print("----- DEBUG MODE - Raw status message from Arduino ------- ")
-        print(StatusMessage.data)
-
-    #try:
-    #    Status = ParseStatus(StatusMessage.data)
-    #except:
-    #    Log(LogFile,"=== Cannot parse status ===")
-    #    Log(LogFile,"Bad status as follows: ")
-    #    Log(LogFile,StatusMessage.data)
-    #    SendMail("Error parsing status message: \n\n" + StatusMessage.data)
-    #    break
-
-    #CheckStatus(Status)
-
-    # Check time since fill
-    TimeSinceFill = t.time() - S['LastFillTime']
-    if TimeSinceFill > S['FillFrequency'] or S['LastFillTime'] == 0:
-
-
-       # 
- 
-        # Check Status
-        try :
-            StatusMessage = Http.request('GET', S['StatusUrl'], timeout=60.0)
-        except:
-            Log(LogFile,"=== Exception Raised Fetching Status Message! ===")
-            RetryCount += 1
-            if RetryCount > S['RetryStatusMax']:
-                StatusMessage = ""
-                Log(LogFile,"=== Maximum retries reached! ===")
-                SendMail("Cannot communicate with Arduino - Max Retires Reached!")
-                break
-            t.sleep(S['RetryStatusTimeout'])
-            continue
+# Show the latest status on the dashboard (StatusPolled events)
+def ShowStatus(Event):
+    Dashboard.Publish(S['ControllerIP'], Event.Fields['Status'])
 
 
-        if S['DEBUG'] > 1:
-            print("----- DEBUG MODE - Raw status message from Arduino ------- ")
-            print(StatusMessage.data)
+# Setup
+# -------------------------------
 
-        try:
-            Status = ParseStatus(StatusMessage.data)
-        except:
-            Log(LogFile,"=== Cannot parse status ===")
-            Log(LogFile,"Bad status as follows: ")
-            Log(LogFile,StatusMessage.data)
-            SendMail("Error parsing status message: \n\n" + StatusMessage.data)
-            break
+# Load settings, open the log file and restore the fill records
+#   - Settings defaults to Config.Configure()
+#   - State the last run saved is restored from its checkpoint if there is a usable one, which is
+#       returned to be checked against the controller by WarmStart(), otherwise None.
+def Setup(Settings=None):
+    global S, TraceArchive, Telemetry, Analytics, Plotting, Schedule, Cache
+    import TraceArchive
+    import Telemetry
+    import Analytics
+    # Load settings and open the log
+    S = Settings if Settings is not None else Conf.Configure()
+    Logger.Setup(S)
+    Logger.Event('Startup',"------ Starting LN2 Autofill control script ------")
+    # Start the mail/ELog workers and the metrics endpoint
+    Notify.Start(S)
+    Metrics.Start(S)
+
+    # Plotting is only loaded when needed, it pulls in matplotlib
+    if S['PLOTS']:
+        import Plotting
+        Plotting.Start(S)
+
+    # Check for saved fill data, converting the old text fill record on first use
+    if not os.path.isfile(S['FillHistoryFile']) and os.path.isfile(S['FillRecordSaveFile']):
+        Logger.Info('Importing old fill record from: ' + S['FillRecordSaveFile'])
+        Count = FillHistory.ImportText(S['FillRecordSaveFile'], S['FillHistoryFile'])
+        Logger.Info('Imported {} fills into {}',Count,S['FillHistoryFile'])
+    # Runtime state of the last run, see Checkpoint.py
+    State = Checkpoint.Load(S)
+    if State is not None:
+        Logger.Info("Warm start from checkpoint saved {:.0f} s ago",t.time() - State['Time'])
+    if State is not None and Checkpoint.HistoryMatches(S, State):
+        CheckFillSuccess.TotalFillTimeRecord = State['TotalFillTimeRecord']
+    elif os.path.isfile(S['FillHistoryFile']):
+        Logger.Info('Loading fill record from: ' + S['FillHistoryFile'])
+        CheckFillSuccess.TotalFillTimeRecord = FillHistory.FillTimeRecord(S['FillHistoryFile'], S['NumberOfFillLines'])
+        Logger.Info('Loaded.')
+    # If no saved data then create a new fill record...
+    else:
+        Logger.Info('Starting new fill time record.')
+        CheckFillSuccess.TotalFillTimeRecord = []
+        for Line in range(S['NumberOfFillLines']):
+            CheckFillSuccess.TotalFillTimeRecord.append([])
 
-        CheckStatus(Status)
 
-        Log(LogFile,"Initiating fill...")
-        if S['DEBUG'] > 1:
-            SendMail("Initiating LN2 Fill...")
-
-        # Send command to fill all lines
-        try :
-            Response = Http.request('GET',S['FillAllUrl'],timeout=60.0)
-        except:
-            Log(LogFile,"=== Exception Raised Initiating Fill! ===")
-            StatusMessage = ""
-            RetryCount += 1
-            if RetryCount > S['RetryStatusMax']:
-                Log(LogFile,"=== Maximum retries reached! ===")
-                SendMail("Cannot communicate with Arduino - Max Retires Reached!")
-                break
+    # Initialise last fill record in CheckFillStatus()
+    #   - Taken from the trace archive so the first plot after a restart still shows the previous fill
+    if State is not None:
+        CheckFillSuccess.LastFill = State['LastFill']
+    else:
+        CheckFillSuccess.LastFill = TraceArchive.LastTraces(S['TraceArchivePath'], S['NumberOfFillLines'])
+    # Analytics warnings already sent, see Analytics.Alerts()
+    CheckFillSuccess.Warned = State['Warned'] if State is not None else set()
+    CheckFillSuccess.WarnedLock = threading.Lock()
+
+    # Fill schedule, lines not in it yet start from their last fill in the history
+    Schedule = Scheduler.Load(S)
+    Scheduler.Seed(Schedule, S, S['ControllerIP'], FillHistory.LastFillTimes(S['FillHistoryFile']))
+
+    # Live dashboard, served from the status read here
+    Dashboard.Start(S, Schedule)
+    Dashboard.Register(S['ControllerIP'], S['ControllerIP'], S['FillHistoryFile'], lambda: StatusCache.GetStale(Cache))
+
+    # Work done with fill results and status reads, off the fill path
+    #   - Every fill result is mailed ('block'), the analytics read the whole history so only the latest
+    #       fill matters to them, as the latest status does to the dashboard
+    EventBus.Start(S)
+    EventBus.Subscribe('analytics', AnalyseFill, ['FillResult'], Policy='oldest', QueueSize=1)
+    EventBus.Subscribe('report', ReportFill, ['FillResult'], Policy='block')
+    EventBus.Subscribe('contact', MailContact, ['ContactLost', 'ContactRestored'], Policy='oldest')
+    EventBus.Subscribe('dashboard', ShowStatus, ['StatusPolled'], Policy='oldest', QueueSize=1)
+
+    # Last fill traces read from the controller, and the shared status snapshot
+    ParseStatus.TraceCache = State['TraceCache'] if State is not None else StatusParser.NewTraceCache()
+    ParseStatus.TraceLock = threading.Lock()
+    Cache = StatusCache.NewCache(S, S['ControllerIP'], FetchStatus)
+    GetStatus.Failures = State['Failures'] if State is not None else 0
+    SaveCheckpoint.LastSave = t.time()
+
+    # Rolling telemetry from status polls, reloaded from the last save
+    CheckStatus.Telemetry = Telemetry.NewTelemetry(S, S['NumberOfFillLines'])
+    Telemetry.Load(CheckStatus.Telemetry, S['TelemetryFile'])
+    CheckStatus.LastSave = t.time()
+    return State
+
+
+# Check a restored checkpoint against a fresh status, so a restart neither repeats nor loses a fill
+#   - A fill underway when the checkpoint was saved is followed to the end if any of its lines are still
+#       filling, then every line of it which has filled since is checked and recorded as usual, so the
+#       schedule has them filled.  Lines of it which never started stay due and are filled next cycle.
+#   - Lines filled since the checkpoint otherwise (by hand or from the dashboard) are only logged.
+def WarmStart(State):
+    Status = GetStatus()
+    while Status is None:
+        t.sleep(S['RetryStatusTimeout'])
+        Status = GetStatus()
+    if Status.NumLines != len(State['LineResults']):
+        Logger.Warning("=== Controller has {} lines, checkpoint {}, fill underway at the restart not checked ===",Status.NumLines,len(State['LineResults']))
+        return
+    Changed = Checkpoint.Changed(State, Status)
+    Fill = State['Fill']
+    if Fill is None:
+        if Changed:
+            Logger.Info("Lines {} have filled since the checkpoint, not by this script",Changed)
+        return
+    Lines = Fill['Lines'] or [FillLine[0] for FillLine in Status.LineStatus if FillLine[1] == b'Y']
+    Underway = [Line for Line in Lines if Status.LineStatus[Line - 1][8] == StatusParser.Underway]
+    Filled = sorted(set(Lines) & (set(Changed) | set(Underway)))
+    Logger.Info("Fill of lines {} (started {:.0f} s ago) was underway at the restart, lines {} of it have filled since",Lines,t.time() - Fill['Started'],Filled)
+    if Underway:
+        with Metrics.Span('fill'):
+            TrackFill(Status, Underway, Resumed=True)
+        Status = GetStatus(S['FillPollMax'])
+        while Status is None:
             t.sleep(S['RetryStatusTimeout'])
-            continue
+            Status = GetStatus(0)
+    if Filled and not Checkpoint.HistoryMatches(S, State):
+        Logger.Info("Fill results were recorded before the restart")
+    elif Filled:
+        with Metrics.Span('checkfill'):
+            CheckFillSuccess(Status, Filled)
+    SaveCheckpoint(Status, Force=True)
+
+
+# Main loop
+# -------------------------------
 
-        if S['DEBUG'] > 1:
-            print("----- DEBUG MODE - FillAll acknowledgement message from Arduino ------- ")
-            print(Response.data)
-        CheckFillInitiated(Response)
-
-        # Wait for fill timeout then check status
-        Log(LogFile,"Waiting for fill timeout ({} seconds)...".format(Status['MaxFillTime']))
-        t.sleep(Status['MaxFillTime']+1)
-        Log(LogFile,"MaxFillTime expired, checking fill status...")
-
-        try :
-            StatusMessage = Http.request('GET', S['StatusUrl'],timeout=60.0)
-        except:
-            Log(LogFile,"=== Exception Raised Fetching Status Message After Fill! ===")
-            StatusMessage = ""
-            RetryCount += 1
-            if RetryCount > S['RetryStatusMax']:
-                Log(LogFile,"=== Maximum retries reached! ===")
-                SendMail("Cannot communicate with Arduino - Max Retires Reached!")
-                break
+# Entry point, runs the control loop until contact with the controller is lost for good
+def Main(Settings=None):
+    State = Setup(Settings)
+    if State is not None:
+        WarmStart(State)
+
+    while 1:
+        Logger.Debug("--------------- New Cycle ------------------------")
+        CycleStart = t.perf_counter()
+        Filled = False
+        # Check Status every cycle, fills or not, so telemetry and loss of contact are picked up early
+        Status = GetStatus()
+        if Status is None:
             t.sleep(S['RetryStatusTimeout'])
             continue
 
-        if S['DEBUG'] > 1:
-            print("----- DEBUG MODE - Raw status message from Arduino ------- ")
-            print(StatusMessage.data)
+        CheckStatus(Status)
+        SaveCheckpoint(Status)
+
+        # Check whether any active line is due a fill
+        ActiveLines = [FillLine[0] for FillLine in Status.LineStatus if FillLine[1] == b'Y']
+        DueLines = Scheduler.DueLines(Schedule, S, S['ControllerIP'], ActiveLines)
+        if DueLines and Scheduler.TryStart(Schedule, S):
+            Logger.Info("Initiating fill (lines {} due)...",DueLines)
+            SaveCheckpoint(Status, {'Lines': None if S['FillMode'] == 'all' else DueLines, 'Started': t.time()}, Force=True)
+            Filled = True
+            if S['DEBUG'] > 1:
+                SendMail("Initiating LN2 Fill...")
+
+            if S['FillMode'] == 'all':
+                # Send command to fill all lines
+                FilledLines = None
+                if not SendFill(S['FillAllUrl']):
+                    t.sleep(S['RetryStatusTimeout'])
+                    continue
+
+                # Follow the fill until all lines are done (or timed out) then check status
+                with Metrics.Span('fill'):
+                    TrackFill(Status)
+            else:
+                # Fill only the lines which are due
+                with Metrics.Span('fill'):
+                    Tracker = FillLines(Status, DueLines)
+                FilledLines = sorted(Tracker['Finished'].keys() | Tracker['Pending'])
+                if not FilledLines:
+                    t.sleep(S['RetryStatusTimeout'])
+                    continue
+            Logger.Info("Fill finished, checking fill status...")
+
+            # Status read after the last line finished is recent enough, otherwise read again until it works
+            Status = GetStatus(S['FillPollMax'])
+            while Status is None:
+                t.sleep(S['RetryStatusTimeout'])
+                Status = GetStatus(0)
+
+            with Metrics.Span('checkfill'):
+                CheckFillSuccess(Status, FilledLines)
+            SaveCheckpoint(Status, Force=True)
+
+            #SendMail(StatusMessage.data)
+        else:
+            Logger.Debug("No fill this time...")
 
-        try:
-            Status = ParseStatus(StatusMessage.data)
-        except:
-            Log(LogFile,"=== Cannot parse status ===")
-            Log(LogFile,"Bad status as follows: ")
-            Log(LogFile,StatusMessage.data)
-            SendMail("Error parsing status message after fill: \n\n" + StatusMessage.data)
-            break
-
-        CheckFillSuccess(Status)
-        S['LastFillTime'] = t.time()
-
-        #SendMail(StatusMessage.data)
-    else:
-        if S['DEBUG'] > 1:
-            Log(LogFile,"No fill this time...")
+        Metrics.Observe('cycle', t.perf_counter() - CycleStart, Fill='yes' if Filled else 'no')
+        Metrics.Tick()
+        t.sleep(S['PollFrequency'])
 
 
-    t.sleep(S['PollFrequency'])
+if __name__ == '__main__':
+    Main()
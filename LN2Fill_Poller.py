@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+
+# Fleet Poller for Liverpool Nuclear Physics LN2 Fill System
+# ---------------------------------------------------------------
+
+# asyncio based supervisor which keeps in contact with every controller listed in
+#  Settings['Controllers'] at the same time.
+#   * Each controller has its own task, request timeout and retry counter.
+#   * Waiting for a fill to finish on one dewar never holds up polling the others.
+#   * A controller which stops responding is logged and retried, it does not stop the poller.
+# For testing, start several fake controllers with "python TestServer.py <port>" and
+#  list them in Settings['Controllers'] as "localhost:<port>".
+# Add --simulate (see Simulator.py) for controllers which fill, faster than real time with --speed.
+# For large fleets Supervisor.py runs this poller in several worker processes, each with a shard of the controllers.
+
+import asyncio
+import time as t
+
+# Configuration Function
+import Config as Conf
+import StatusParser
+import FillResults
+import FillTracking
+import FillHistory
+import TraceArchive
+import Analytics
+import Scheduler
+import Notify
+import Logger
+import Dashboard
+import Transport
+import Metrics
+
+StatusPath = '/arduino/readstatus/0'
+StatusCsvPath = '/arduino/readstatuscsv/'  # Compact status, fill generation of the cached traces is added
+FillAllPath = '/arduino/fillall/0'
+FillLinePath = '/arduino/fillline/'  # Line number is added
+
+# Settings dict and fill schedule (shared by all controllers, see Scheduler.py), set up in Main()
+S = None
+Schedule = None
+Tasks = {}  # Controller name -> task polling it
+
+# Functions
+# -------------------------------
+
+# Log a message prefixed with the controller name, which also goes in the record's Controller field
+#   - Level is a Logger level, Logger.EVENT logs an event of type EventType
+def Log(Level,Controller,Message,*Args,EventType=None,**Fields):
+    if Level == Logger.EVENT:
+        Fields['Event'] = EventType
+    Logger.Log(Level, "[" + Controller['Name'] + "] " + Message, *Args, Controller=Controller['Name'], **Fields)
+
+
+# Create the runtime state for one entry of Settings['Controllers']
+#   - Lines not yet in the fill schedule start from their last fill in the controller's fill history
+def NewController(Controller):
+    Dashboard.Register(Controller.get('Name', Controller['IP']), Controller['IP'], Controller.get('FillHistoryFile'))
+    if Controller.get('FillHistoryFile'):
+        Scheduler.Seed(Schedule, S, Controller.get('Name', Controller['IP']),
+                       FillHistory.LastFillTimes(Controller['FillHistoryFile']), Controller)
+    return {
+        'Name': Controller.get('Name', Controller['IP']),
+        'IP': Controller['IP'],
+        'Timeout': Controller.get('Timeout', S['ControllerTimeout']),
+        'RetryCount': 0,
+        'Link': Transport.GetLink(S, Controller['IP']),  # Circuit breaker and latency histogram
+        'Connection': None,  # (Reader, Writer) kept open between requests, see HttpGet()
+        'ConnectionLock': asyncio.Lock(),
+        'Settings': Controller,
+        'Status': None,
+        'FillHistoryFile': Controller.get('FillHistoryFile'),
+        'TraceArchivePath': Controller.get('TraceArchivePath'),
+        'CompactStatus': Controller.get('CompactStatus', S['CompactStatus']),
+        'FillMode': Controller.get('FillMode', S['FillMode']),
+        'TraceCache': StatusParser.NewTraceCache(),
+        'Warned': set(),  # Analytics warnings already sent
+    }
+
+
+# Send a GET request to a controller and return the body as bytes
+#   - Sent over the controller's HTTP/1.1 connection, opened on first use (within TransportConnectTimeout)
+#       and kept open for the next request for as long as the Bridge allows.  A kept connection the
+#       Bridge has closed meanwhile is reopened once before the request counts as failed.
+#   - Raises OSError on connection problems or a non-200 response, asyncio.TimeoutError after the
+#       controller's Timeout.
+async def HttpGet(Controller,Path):
+    async with Controller['ConnectionLock']:
+        for Attempt in range(2):
+            Reused = Controller['Connection'] is not None
+            try:
+                Code, Head, Body = await asyncio.wait_for(Exchange(Controller, Path), Controller['Timeout'])
+                break
+            except (OSError, EOFError, ValueError, asyncio.LimitOverrunError) as Error:
+                Close(Controller)
+                if Reused and Attempt == 0 and isinstance(Error, (ConnectionError, asyncio.IncompleteReadError)):
+                    continue
+                if isinstance(Error, OSError):
+                    raise
+                raise OSError('Bad response from {} ({})'.format(Controller['IP'], repr(Error)))
+            except BaseException:
+                # Timed out or cancelled part way, what is left of the response cannot be told from the next one
+                Close(Controller)
+                raise
+    if Code != b'200':
+        raise OSError('Bad response from {}: {}'.format(Controller['IP'], Head[:80]))
+    return Body
+
+
+# One request and response on the controller's connection, returns (status code, head, body)
+async def Exchange(Controller,Path):
+    if Controller['Connection'] is None:
+        Host, _, Port = Controller['IP'].partition(':')
+        Controller['Connection'] = await asyncio.wait_for(asyncio.open_connection(Host, int(Port or 80)), S['TransportConnectTimeout'])
+    Reader, Writer = Controller['Connection']
+    Writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(Path, Controller['IP']).encode('ascii'))
+    await Writer.drain()
+    Head = await Reader.readuntil(b'\r\n\r\n')
+    Lines = Head.split(b'\r\n')
+    StatusLine = Lines[0].split()
+    Headers = {}
+    for Line in Lines[1:]:
+        Name, _, Value = Line.partition(b':')
+        Headers[Name.strip().lower()] = Value.strip().lower()
+    KeepAlive = Headers.get(b'connection') == b'keep-alive' if StatusLine[0] == b'HTTP/1.0' else Headers.get(b'connection') != b'close'
+    if b'content-length' in Headers:
+        Body = await Reader.readexactly(int(Headers[b'content-length']))
+    elif Headers.get(b'transfer-encoding') == b'chunked':
+        Body = await ReadChunked(Reader)
+    else:
+        # No length given, the body ends when the Bridge closes the connection
+        Body, KeepAlive = await Reader.read(), False
+    if not KeepAlive:
+        Close(Controller)
+    return StatusLine[1] if len(StatusLine) > 1 else b'', Head, Body
+
+
+async def ReadChunked(Reader):
+    Chunks = []
+    while True:
+        Size = int((await Reader.readuntil(b'\r\n')).split(b';')[0], 16)
+        if Size == 0:
+            break
+        Chunks.append((await Reader.readexactly(Size + 2))[:-2])
+    # Skip any trailers up to the blank line
+    while await Reader.readuntil(b'\r\n') != b'\r\n':
+        pass
+    return b''.join(Chunks)
+
+
+# Close a controller's connection, the next request opens a new one
+def Close(Controller):
+    if Controller['Connection'] is not None:
+        Controller['Connection'][1].close()
+        Controller['Connection'] = None
+
+
+# One request to a controller already let through by its circuit breaker, recording the result on the breaker
+#   - Cancelled (e.g. by Remove()) or any other error, the request is released so the breaker does not
+#       wait for the result of a half open trial for ever.
+async def Attempt(Controller,Path):
+    Start = asyncio.get_running_loop().time()
+    try:
+        Data = await HttpGet(Controller, Path)
+    except (OSError, asyncio.TimeoutError):
+        Transport.Failed(Controller['Link'])
+        raise
+    except BaseException:
+        Transport.Release(Controller['Link'])
+        raise
+    Transport.Succeeded(Controller['Link'], asyncio.get_running_loop().time() - Start)
+    return Data
+
+
+# Request Path from a controller, retrying until it answers, for reads only (see Command())
+#   - Retries wait with exponential backoff and jitter, and not at all while the controller's circuit
+#       breaker is open (see Transport.py), other controllers are unaffected either way.
+#   - Retry count is per controller, a warning is logged once RetryStatusMax is exceeded.
+async def Request(Controller,Path):
+    while True:
+        if not Transport.Allow(Controller['Link']):
+            await asyncio.sleep(Transport.OpenRemaining(Controller['Link']) or 1)
+            continue
+        try:
+            Data = await Attempt(Controller, Path)
+        except (OSError, asyncio.TimeoutError) as Error:
+            Metrics.Count('retries', Controller=Controller['Name'])
+            Controller['RetryCount'] += 1
+            Log(Logger.WARNING,Controller,"=== Exception raised requesting {} ({}) ===",Path,repr(Error))
+            if Controller['RetryCount'] == S['RetryStatusMax'] + 1:
+                Log(Logger.EVENT,Controller,"=== Maximum retries reached! ===",EventType='ContactLost')
+                Metrics.Count('contact_lost', Controller=Controller['Name'])
+                Notify.Send("[{}] Cannot communicate with Arduino - Max Retires Reached!".format(Controller['Name']))
+            await asyncio.sleep(Transport.Backoff(Controller['Link'], Controller['RetryCount'] - 1))
+            continue
+        if Controller['RetryCount'] > 0:
+            Log(Logger.EVENT,Controller,"Contact restored after {} retries.",Controller['RetryCount'],EventType='ContactRestored')
+            Controller['RetryCount'] = 0
+        return Data
+
+
+# Send a command which changes the controller (e.g. a fill) once, it is never retried as a command
+#   which timed out may still have been carried out
+#   - Raises OSError (Transport.CircuitOpen while the breaker is open) or asyncio.TimeoutError if it fails
+async def Command(Controller,Path):
+    if not Transport.Allow(Controller['Link']):
+        raise Transport.CircuitOpen("Circuit to {} open for {:.0f} more s".format(Controller['IP'], Transport.OpenRemaining(Controller['Link'])))
+    return await Attempt(Controller, Path)
+
+
+# Send a fill command, returns True if the fill has started
+#   - If the command fails the status is read back instead of sending it again, the fill has started
+#       if any of Lines (all active lines if None) is filling
+async def SendFill(Controller,Path,Lines=None):
+    try:
+        Response = await Command(Controller, Path)
+    except (OSError, asyncio.TimeoutError) as Error:
+        Log(Logger.WARNING,Controller,"=== Exception raised sending {} ({}), checking status ===",Path,repr(Error))
+        Status = await ReadStatus(Controller)
+        Started = FillTracking.Filling(Status, Lines) if Status is not None else []
+        if Started:
+            Log(Logger.INFO,Controller,"Lines {} are filling, the command was carried out",Started)
+        return bool(Started)
+    if S['DEBUG'] > 1:
+        Log(Logger.DEBUG,Controller,"{} acknowledgement:\n{}",Path,Response.decode('ascii', 'replace'))
+    return True
+
+
+# Fetch and parse the status of a controller, returns None if the message cannot be parsed
+#   - With the compact status only traces changed since the cached ones are sent, the rest come from the cache
+async def ReadStatus(Controller):
+    Start = t.perf_counter()
+    if Controller['CompactStatus']:
+        StatusMessage = await Request(Controller, StatusCsvPath + str(Controller['TraceCache']['Generation']))
+    else:
+        StatusMessage = await Request(Controller, StatusPath)
+    Metrics.Observe('fetch', t.perf_counter() - Start, Controller=Controller['Name'])
+    if S['DEBUG'] > 1:
+        Log(Logger.DEBUG,Controller,"Raw status message:\n{}",StatusMessage.decode('ascii', 'replace'))
+    try:
+        with Metrics.Span('parse', Controller=Controller['Name']):
+            Status = StatusParser.MergeTraces(Controller['TraceCache'], StatusParser.Parse(StatusMessage))
+    except ValueError as Error:
+        Metrics.Count('parse_failures', Controller=Controller['Name'])
+        Log(Logger.ERROR,Controller,"=== Cannot parse status ({}) ===",Error)
+        return None
+    Controller['Status'] = Status
+    Dashboard.Publish(Controller['Name'], Status)
+    return Status
+
+
+# Start a fill on a controller, returns the tracker to follow it with (None if fillall could not be sent)
+#   - Lines None fills all active lines with fillall, otherwise a sequence of fillline commands (see FillTracking.py)
+async def StartFill(Controller,Status,Lines):
+    if Lines is None:
+        if not await SendFill(Controller, FillAllPath):
+            return None
+        Tracker = FillTracking.NewTracker(S, Status)
+        Log(Logger.EVENT,Controller,"Tracking fill of lines {} (timeout {} seconds)...",sorted(Tracker['Pending']),Status.MaxFillTime,
+            EventType='FillStarted',Lines=sorted(Tracker['Pending']))
+        return Tracker
+    return FillTracking.NewSequence(S, Status, Lines)
+
+
+# Send fillline for each line of a sequence which should start now
+#   - A line whose fillline could not be sent is skipped, it stays due so the next cycle tries again
+async def StartLines(Controller,Tracker):
+    for Line in FillTracking.NextLines(Tracker):
+        if not await SendFill(Controller, FillLinePath + str(Line), [Line]):
+            continue
+        FillTracking.Start(Tracker, Line)
+        Log(Logger.EVENT,Controller,"Filling line {} (timeout {} seconds)...",Line,Tracker['Status'].MaxFillTime,
+            EventType='FillStarted',Lines=[Line])
+
+
+# Fill lines on a controller and report the result
+#   - Lines None fills all active lines (fillall), otherwise only Lines, one fillline command each
+async def FillController(Controller,Status,Lines=None):
+    Log(Logger.INFO,Controller,"Initiating fill...")
+    Tracker = await StartFill(Controller, Status, Lines)
+    if Tracker is None:
+        return
+
+    # Follow the fill until all lines are done, other controllers carry on polling meanwhile
+    while not FillTracking.Done(Tracker):
+        await StartLines(Controller, Tracker)
+        if not Tracker['Pending']:
+            continue
+        await asyncio.sleep(FillTracking.NextInterval(Tracker))
+        FillStatus = await ReadStatus(Controller)
+        if FillStatus is None:
+            continue
+        for FillLine in FillTracking.Update(Tracker, FillStatus):
+            LineMessage, Failed = FillResults.LineFillResult(FillLine, FillStatus)
+            Log(Logger.EVENT,Controller,"Line {} finished after {:.0f}s: {}",FillLine[0],FillTracking.Elapsed(Tracker),LineMessage.strip(),
+                EventType='LineFinished',Line=FillLine[0],Failed=Failed)
+            if FillTracking.Retry(Tracker, FillLine):
+                Log(Logger.INFO,Controller,"Line {} will be filled again ({} retries left)",FillLine[0],Tracker['RetriesLeft'][FillLine[0]])
+    if Tracker['Pending']:
+        Log(Logger.WARNING,Controller,"Fill timeout reached, lines {} still not finished",sorted(Tracker['Pending']))
+
+    if Lines is not None:
+        Lines = sorted(Tracker['Finished'].keys() | Tracker['Pending'])
+        if not Lines:
+            return
+
+    # Last tracked status is already final if every line finished, otherwise read again
+    Status = Tracker['Status'] if not Tracker['Pending'] else await ReadStatus(Controller)
+    while Status is None:
+        await asyncio.sleep(S['RetryStatusTimeout'])
+        Status = await ReadStatus(Controller)
+
+    FillSuccessMessage, FailCount, ActiveCount = FillResults.SummariseFill(Status, Lines)
+    for FillLine in Status.LineStatus:
+        if FillLine[1] == b'Y' and (Lines is None or FillLine[0] in Lines):
+            Failed = FillResults.LineFillResult(FillLine, Status)[1]
+            Metrics.Count('fills', Controller=Controller['Name'], Result='fail' if Failed else 'success', Line=FillLine[0])
+            Scheduler.Record(Schedule, S, Controller['Name'], FillLine[0], FillLine[9], Failed, Controller=Controller['Settings'])
+    Log(Logger.EVENT,Controller,FillSuccessMessage,EventType='FillResult',Failed=FailCount,Active=ActiveCount,
+        FillTimes=[int(FillLine[9]) for FillLine in Status.LineStatus],Lines=Lines)
+    Notify.Send("[{}] ".format(Controller['Name']) + FillSuccessMessage)
+    # Appends are fsync'd, run them in a thread so other controllers carry on meanwhile
+    with Metrics.Span('history', Controller=Controller['Name']):
+        await asyncio.to_thread(RecordFill, Controller, Status, Lines)
+    if Controller['FillHistoryFile']:
+        # Analysis reads the whole history, run it in a thread so other controllers carry on meanwhile
+        with Metrics.Span('analytics', Controller=Controller['Name']):
+            Analysis = await asyncio.to_thread(Analytics.Analyse, S, Controller['FillHistoryFile'], Controller['TraceArchivePath'])
+        for Message in Analytics.Alerts(Analysis, Controller['Warned']):
+            Log(Logger.WARNING,Controller,"=== " + Message + " ===")
+            Notify.Send("[{}] Warning: ".format(Controller['Name']) + Message)
+
+
+# Append a fill to the controller's history and trace archive (if it has them)
+def RecordFill(Controller, Status, Lines):
+    if Controller['FillHistoryFile']:
+        FillHistory.Append(Controller['FillHistoryFile'], FillHistory.RecordsFromStatus(Status, Lines=Lines))
+    if Controller['TraceArchivePath']:
+        TraceArchive.Append(Controller['TraceArchivePath'], Status, Lines=Lines)
+
+
+# Poll a single controller forever, filling whenever any active line is due a fill
+#   - Fills wait while another controller has started one within ScheduleStagger seconds
+async def RunController(Controller):
+    Log(Logger.INFO,Controller,"Polling controller at {}",Controller['IP'])
+    while True:
+        try:
+            Status = await ReadStatus(Controller)
+            if Status is not None:
+                ActiveLines = [FillLine[0] for FillLine in Status.LineStatus if FillLine[1] == b'Y']
+                DueLines = Scheduler.DueLines(Schedule, S, Controller['Name'], ActiveLines, Controller=Controller['Settings'])
+                if DueLines and Scheduler.TryStart(Schedule, S):
+                    Log(Logger.INFO,Controller,"Lines {} due a fill",DueLines)
+                    with Metrics.Span('fill', Controller=Controller['Name']):
+                        await FillController(Controller, Status, None if Controller['FillMode'] == 'all' else DueLines)
+                elif DueLines:
+                    Log(Logger.DEBUG,Controller,"Lines {} due a fill, waiting for fills on other controllers",DueLines)
+                else:
+                    Log(Logger.DEBUG,Controller,"No fill this time...")
+        except Exception as Error:
+            # Keep this controller's task alive whatever happens, others are unaffected anyway
+            Log(Logger.ERROR,Controller,"=== Unexpected error ({}) ===",repr(Error))
+        Metrics.Tick()
+        await asyncio.sleep(S['PollFrequency'])
+
+
+# Start polling a controller (runtime state from NewController()), replacing any task with the same name
+def Add(Controller):
+    Remove(Controller['Name'])
+    Tasks[Controller['Name']] = asyncio.get_running_loop().create_task(RunController(Controller))
+    Tasks[Controller['Name']].add_done_callback(lambda Task: Close(Controller))
+
+
+# Stop polling a controller, also stops a fill it is following (the controller finishes the fill itself)
+def Remove(Name):
+    Task = Tasks.pop(Name, None)
+    if Task is not None:
+        Task.cancel()
+        Log(Logger.INFO,{'Name': Name},"Stopped polling")
+
+
+# Run one task per controller until interrupted, controllers can be added and removed meanwhile
+async def Supervise(Controllers):
+    for Controller in Controllers:
+        Add(Controller)
+    await asyncio.Event().wait()
+
+
+def Main():
+    global S, Schedule
+    S = Conf.Configure()
+    Logger.Setup(S)
+    Notify.Start(S)
+    Metrics.Start(S)
+    Schedule = Scheduler.Load(S)
+    Dashboard.Start(S, Schedule)
+    Controllers = [NewController(Controller) for Controller in S['Controllers']]
+    Logger.Event('Startup',"------ Starting LN2 Autofill poller for {} controller(s) ------",len(Controllers))
+    try:
+        asyncio.run(Supervise(Controllers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    Main()
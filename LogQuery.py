@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+
+# Log query tool for LN2 Fill control Server
+# ---------------------------------------------------------------
+# Answers questions like "when did line 3 last fail" from LogFilePath (and its rotated backups)
+#  without reading the whole log, using a sidecar index of every log entry.
+#   * Works on both log formats: JSON records from Logger.py and the older free text lines
+#       ("<ctime>: message", a message may run on over several lines).  Old entries get their
+#       event type from the message text (e.g. "Looks good!" is a FillResult).
+#   * Index is one fixed size record per entry (IndexDtype): offset, length, time, level, event,
+#       controller, lines mentioned and lines failed as bit masks.  Queries are numpy masks over
+#       the memory mapped index, only the matching entries are read from the memory mapped log.
+#   * Index files live in <LogFilePath>.index/, named by the inode of the log file they cover, so
+#       they stay valid when Logger rotates the log (LN2AutofillLog.txt -> .1 -> .2 ...).  Update()
+#       only scans what has been appended since the last update (the last entry is scanned again as it
+#       may not have been complete), and rebuilds an index whose log was truncated or replaced.
+#   * Every query updates the index first, so it is always up to date.
+#
+# Usage:
+#   python LogQuery.py --line 3 --failed --last 1
+#   python LogQuery.py --event ContactLost --since 2026-01-01 --until "2026-02-01 12:00"
+#   Entries = LogQuery.Query(S['LogFilePath'], Event='FillResult', Start=t.time() - 86400)
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import time as t
+
+import numpy as np
+
+import Config as Conf
+import Logger
+
+IndexVersion = 1
+IndexDtype = np.dtype([('Offset', '<u8'), ('Length', '<u4'), ('Time', '<f8'), ('Level', 'u1'), ('Event', 'u1'),
+                       ('Controller', '<u2'), ('Lines', '<u4'), ('Failed', '<u4')])
+HeadSize = 4096  # Bytes at the start of a log used to tell it has been replaced
+
+# Start of an entry: a JSON record or the ctime prefix of the old format
+EntryStart = re.compile(rb'^(?:\{"Time": |[A-Z][a-z]{2} [A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d \d{4}: )', re.M)
+CTimePattern = re.compile(rb'[A-Z][a-z]{2} ([A-Z][a-z]{2}) ([ \d]\d) (\d\d):(\d\d):(\d\d) (\d{4}): ')
+MonthNumbers = {Name.encode(): Number for Number, Name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+# Fields of a JSON record (values in the message are escaped, so cannot match these)
+JsonFields = {Name: re.compile(Pattern) for Name, Pattern in (
+    ('Time', rb'^\{"Time": ([\d.]+)'), ('Level', rb'"Level": "(\w+)"'), ('Event', rb', "Event": "(\w+)"'),
+    ('Line', rb', "Line": (\d+)'), ('Controller', rb', "Controller": "([^"\\]*)"'))}
+
+# Lines named in fill results, FillResults.SummariseFill() and LineFinished messages
+LinePattern = re.compile(rb'Line (\d+) (?:active\.|finished after)')
+FailedPattern = re.compile(rb'Line (\d+) (?:active\.|finished after \d+s:) !+ FILL FAILED')
+
+# Event types of old free text entries, from the start of their message
+TextEvents = ((b'------ Starting', 'Startup'), (b'Initiating fill', 'FillStarted'), (b'Looks good!', 'FillResult'),
+              (b'ATTENTION - ', 'FillResult'), (b'=== Maximum retries reached', 'ContactLost'),
+              (b'Contact restored', 'ContactRestored'))
+
+
+# Log files oldest first: rotated backups (.N ... .1) then the current log
+def LogFiles(Path):
+    Backups = []
+    Number = 1
+    while os.path.isfile('{}.{}'.format(Path, Number)):
+        Backups.append('{}.{}'.format(Path, Number))
+        Number += 1
+    return Backups[::-1] + ([Path] if os.path.isfile(Path) else [])
+
+
+def IndexPaths(Path, Inode):
+    Directory = Path + '.index'
+    return os.path.join(Directory, '{}.bin'.format(Inode)), os.path.join(Directory, '{}.json'.format(Inode))
+
+
+# Unix time of an old format ctime prefix (local time, as written by t.ctime())
+def CTime(Prefix):
+    Match = CTimePattern.match(Prefix)
+    if Match is None:
+        return 0.0
+    Month, Day, Hour, Minute, Second, Year = Match.groups()
+    return t.mktime((int(Year), MonthNumbers[Month], int(Day), int(Hour), int(Minute), int(Second), 0, 0, -1))
+
+
+# Code of Name in a list of names, added if new (0 = none)
+def Code(Names, Name):
+    if not Name:
+        return 0
+    if Name not in Names:
+        Names.append(Name)
+    return Names.index(Name) + 1
+
+
+def LineMask(Numbers):
+    Mask = 0
+    for Number in Numbers:
+        if 0 < int(Number) <= 32:
+            Mask |= 1 << (int(Number) - 1)
+    return Mask
+
+
+# Index record fields of one entry
+def IndexEntry(Meta, Entry):
+    if Entry.startswith(b'{'):
+        Fields = {Name: Pattern.search(Entry) for Name, Pattern in JsonFields.items()}
+        Fields = {Name: Match.group(1).decode('utf-8', 'replace') if Match else None for Name, Match in Fields.items()}
+        Time = float(Fields['Time'] or 0)
+        Level = Logger.Levels.get(Fields['Level'], Logger.INFO)
+        Event, Controller = Fields['Event'], Fields['Controller']
+        Lines = LinePattern.findall(Entry) + ([Fields['Line']] if Fields['Line'] else [])
+        Failed = FailedPattern.findall(Entry)
+        if Event == 'LineFinished' and b'"Failed": true' in Entry and Fields['Line']:
+            Failed.append(Fields['Line'])
+    else:
+        Time = CTime(Entry[0:26])
+        Message = Entry[26:]
+        Level = Logger.WARNING if Message.startswith(b'===') else Logger.INFO
+        Event = next((Name for Start, Name in TextEvents if Message.startswith(Start)), None)
+        Controller = None
+        Lines = LinePattern.findall(Entry)
+        Failed = FailedPattern.findall(Entry)
+    return Time, Level, Code(Meta['Events'], Event), Code(Meta['Controllers'], Controller), LineMask(Lines), LineMask(Failed)
+
+
+# Bring the index of one log file up to date, returns (Meta, index array)
+def UpdateFile(LogPath, IndexBase):
+    Stat = os.stat(LogPath)
+    BinPath, MetaPath = IndexPaths(IndexBase, Stat.st_ino)
+    with open(LogPath, 'rb') as File:
+        Head = File.read(HeadSize)
+    try:
+        with open(MetaPath) as File:
+            Meta = json.load(File)
+        Count = min(Meta['Count'], os.path.getsize(BinPath) // IndexDtype.itemsize)
+        if Meta['Version'] != IndexVersion or Meta['Size'] > Stat.st_size or \
+                Meta['Head'] != hashlib.sha1(Head[0:Meta['HeadLength']]).hexdigest():
+            raise ValueError("Log replaced")
+    except (OSError, ValueError, KeyError):
+        Meta, Count = {'Version': IndexVersion, 'Size': 0, 'Count': 0, 'Events': [], 'Controllers': []}, 0
+    if Meta['Size'] == Stat.st_size and Count == Meta['Count']:
+        return Meta, Load(BinPath, Count)
+
+    # Scan from the start of the last entry indexed, it may have had more lines added since
+    From = 0
+    if Count:
+        Last = np.fromfile(BinPath, dtype=IndexDtype, count=1, offset=(Count - 1) * IndexDtype.itemsize)[0]
+        From, Count = int(Last['Offset']), Count - 1
+    Records = []
+    if Stat.st_size > From:
+        with open(LogPath, 'rb') as File, mmap.mmap(File.fileno(), 0, access=mmap.ACCESS_READ) as Map:
+            End = Map.rfind(b'\n', From, Stat.st_size) + 1
+            Starts = [Match.start() for Match in EntryStart.finditer(Map, From, End)]
+            if End > From and (not Starts or Starts[0] != From):
+                Starts.insert(0, From)  # Text before the first recognised entry
+            for Start, Stop in zip(Starts, Starts[1:] + [End]):
+                Records.append((Start, Stop - Start) + IndexEntry(Meta, Map[Start:Stop]))
+        Size = End if End > From else From
+    else:
+        Size = From
+    os.makedirs(os.path.dirname(BinPath), exist_ok=True)
+    with open(BinPath, 'ab') as File:
+        File.truncate(Count * IndexDtype.itemsize)
+        File.write(np.array(Records, dtype=IndexDtype).tobytes())
+    Meta.update(Size=Size, Count=Count + len(Records), HeadLength=min(len(Head), Size),
+                Head=hashlib.sha1(Head[0:min(len(Head), Size)]).hexdigest())
+    with open(MetaPath + '.tmp', 'w') as File:
+        json.dump(Meta, File)
+    os.replace(MetaPath + '.tmp', MetaPath)
+    return Meta, Load(BinPath, Meta['Count'])
+
+
+def Load(BinPath, Count):
+    if Count == 0:
+        return np.zeros(0, dtype=IndexDtype)
+    return np.memmap(BinPath, dtype=IndexDtype, mode='r', shape=(Count,))
+
+
+# Bring the indexes of a log and its backups up to date, removing those of logs rotated away
+#   - Returns a list of (log file, Meta, index array), oldest file first
+def Update(Path):
+    Indexes = [(LogPath,) + UpdateFile(LogPath, Path) for LogPath in LogFiles(Path)]
+    Keep = {'{}.{}'.format(os.stat(LogPath).st_ino, Extension) for LogPath in LogFiles(Path) for Extension in ('bin', 'json')}
+    if os.path.isdir(Path + '.index'):
+        for Name in os.listdir(Path + '.index'):
+            if Name not in Keep:
+                os.remove(os.path.join(Path + '.index', Name))
+    return Indexes
+
+
+# Entries of the log at Path (and its backups) matching every condition given, oldest first
+#   - Start/End are unix times, Event an event type (e.g. 'FillResult'), Level the lowest level name,
+#       Line a line number mentioned by the entry, Failed only entries reporting a failed fill (of Line,
+#       if given), Last only the latest Last matches.
+#   - Each entry is a dict: Time, Level, Event, Controller and Text (the raw entry).
+def Query(Path, Start=None, End=None, Event=None, Level=None, Line=None, Failed=False, Controller=None, Last=None):
+    Found = []
+    for LogPath, Meta, Index in Update(Path):
+        Mask = np.ones(len(Index), dtype=bool)
+        if Start is not None:
+            Mask &= Index['Time'] >= Start
+        if End is not None:
+            Mask &= Index['Time'] < End
+        if Event is not None:
+            Mask &= Index['Event'] == Meta['Events'].index(Event) + 1 if Event in Meta['Events'] else False
+        if Controller is not None:
+            Mask &= Index['Controller'] == Meta['Controllers'].index(Controller) + 1 if Controller in Meta['Controllers'] else False
+        if Level is not None:
+            Mask &= Index['Level'] >= Logger.Levels[Level]
+        Bits = (1 << (Line - 1)) if Line else 0xFFFFFFFF
+        if Line:
+            Mask &= (Index['Lines'] & Bits) != 0
+        if Failed:
+            Mask &= (Index['Failed'] & Bits) != 0
+        Found.append((LogPath, Meta, Index, np.flatnonzero(Mask)))
+    if Last is not None:
+        Keep = Last
+        for Number in range(len(Found) - 1, -1, -1):
+            Rows = Found[Number][3][max(0, len(Found[Number][3]) - Keep):]
+            Keep -= len(Rows)
+            Found[Number] = Found[Number][0:3] + (Rows,)
+    Entries = []
+    for LogPath, Meta, Index, Rows in Found:
+        if not len(Rows):
+            continue
+        with open(LogPath, 'rb') as File, mmap.mmap(File.fileno(), 0, access=mmap.ACCESS_READ) as Map:
+            for Row in Rows:
+                Record = Index[Row]
+                Entries.append({'Time': float(Record['Time']), 'Level': Logger.LevelNames.get(int(Record['Level']), 'INFO'),
+                                'Event': Meta['Events'][Record['Event'] - 1] if Record['Event'] else None,
+                                'Controller': Meta['Controllers'][Record['Controller'] - 1] if Record['Controller'] else None,
+                                'Text': Map[int(Record['Offset']):int(Record['Offset']) + int(Record['Length'])].decode('utf-8', 'replace')})
+    return Entries
+
+
+# Entry text for printing, JSON records as "<ctime>: message"
+def Describe(Entry):
+    if Entry['Text'].startswith('{'):
+        try:
+            Record = json.loads(Entry['Text'])
+            return "{}: {}".format(Record.get('CTime', t.ctime(Entry['Time'])), Record.get('Message', ''))
+        except ValueError:
+            pass
+    return Entry['Text'].rstrip('\n')
+
+
+# Unix time of "YYYY-MM-DD" or "YYYY-MM-DD HH:MM" (local time)
+def ParseTime(Text):
+    for Format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return t.mktime(t.strptime(Text, Format))
+        except ValueError:
+            pass
+    raise ValueError("Time should be YYYY-MM-DD or 'YYYY-MM-DD HH:MM', not " + Text)
+
+
+if __name__ == '__main__':
+    import argparse
+    Parser = argparse.ArgumentParser(description='Query the LN2 Autofill log')
+    Parser.add_argument('--log', help='Log file (default LogFilePath)')
+    Parser.add_argument('--since', type=ParseTime, help='YYYY-MM-DD or "YYYY-MM-DD HH:MM"')
+    Parser.add_argument('--until', type=ParseTime, help='YYYY-MM-DD or "YYYY-MM-DD HH:MM"')
+    Parser.add_argument('--event', help='Event type, e.g. FillResult, LineFinished, ContactLost')
+    Parser.add_argument('--level', choices=sorted(Logger.Levels), help='Lowest level')
+    Parser.add_argument('--line', type=int, help='Entries about this line')
+    Parser.add_argument('--failed', action='store_true', help='Only failed fills')
+    Parser.add_argument('--controller', help='Entries of this controller (poller logs)')
+    Parser.add_argument('--last', type=int, help='Only the latest N entries')
+    Parser.add_argument('--count', action='store_true', help='Print the number of entries only')
+    Args = Parser.parse_args()
+    Entries = Query(Args.log or Conf.Configure()['LogFilePath'], Args.since, Args.until, Args.event, Args.level, Args.line,
+                    Args.failed, Args.controller, Args.last)
+    if Args.count:
+        print(len(Entries))
+    else:
+        for Entry in Entries:
+            print(Describe(Entry))
@@ -0,0 +1,153 @@
+# Logging for LN2 Fill control Server
+# Structured, buffered replacement for writing and flushing the log file on every message.
+#
+#  - Each record is one line of JSON: {"Time": unix s, "CTime": text time, "Level": ..., "Message": ...}
+#       plus any keyword fields given, e.g. Controller or Line.
+#  - Debug()/Info()/Warning()/Error() take a format string and arguments which are only
+#       formatted if the level is enabled, so disabled debug calls cost one comparison:
+#           Logger.Debug("Line {} data = {}", LineData[0], LineData)
+#  - Records are buffered and written every LogFlushInterval seconds (by a background thread),
+#       or sooner if LogBufferSize records are waiting.
+#  - Event() is the fast path for the important things (fills, results, loss of contact):
+#       always logged whatever the level, tagged with "Event", and written and flushed at once.
+#  - The file is rotated when it passes LogMaxBytes or is older than LogRotateInterval
+#       seconds, keeping LogBackupCount old files (LN2AutofillLog.txt.1, .2, ...).
+#  - Records at or above LogTerminalLevel are also printed as plain text, as before.
+#  - If Forward is set (worker processes of Supervisor.py) records are passed to it instead of
+#       being written or printed, the process it sends them to does that with Write().
+
+import atexit
+import json
+import os
+import threading
+import time as t
+
+DEBUG, INFO, WARNING, ERROR, EVENT = 10, 20, 30, 40, 50
+LevelNames = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR', EVENT: 'EVENT'}
+Levels = {Name: Level for Level, Name in LevelNames.items()}
+
+# Module state, set up by Setup()
+S = None
+Level = INFO            # Lowest level written to the file
+TerminalLevel = INFO    # Lowest level printed
+File = None
+OpenedTime = 0
+Buffer = []
+LastFlush = 0
+Lock = threading.RLock()
+FlushThread = None
+Forward = None          # Called with each record instead of writing it, if set
+
+
+# Open the log file and start the flush thread
+def Setup(Settings):
+    global S, Level, TerminalLevel, FlushThread
+    S = Settings
+    Level = Levels[S['LogLevel']] if S.get('LogLevel') else (DEBUG if S['DEBUG'] > 0 else INFO)
+    TerminalLevel = Levels[S['LogTerminalLevel']] if S.get('LogTerminalLevel') else Level
+    if S['LogActive'] and Forward is None:
+        Open()
+    if FlushThread is None:
+        FlushThread = threading.Thread(target=FlushLoop, name='LogFlush', daemon=True)
+        FlushThread.start()
+        atexit.register(Flush)
+
+
+def Open():
+    global File, OpenedTime
+    File = open(S['LogFilePath'], 'a')
+    OpenedTime = os.path.getctime(S['LogFilePath']) if File.tell() else t.time()
+
+
+# True if messages at Level would be written or printed, for guarding expensive arguments
+def Enabled(MessageLevel):
+    return S is not None and S['LogActive'] and (MessageLevel >= Level or MessageLevel >= TerminalLevel)
+
+
+# Log a message, Message.format(*Args) is only done if the level is enabled
+#   - Nothing is written or printed before Setup() or with LogActive 0, as before
+def Log(MessageLevel, Message, *Args, **Fields):
+    if (MessageLevel < Level and MessageLevel < TerminalLevel) or S is None or not S['LogActive']:
+        return
+    if Args:
+        Message = Message.format(*Args)
+    Now = t.time()
+    if MessageLevel >= TerminalLevel and Forward is None:
+        print(t.ctime(Now) + ": " + Message)
+    if MessageLevel < Level:
+        return
+    Record = {'Time': round(Now, 3), 'CTime': t.ctime(Now), 'Level': LevelNames[MessageLevel], 'Message': Message}
+    Record.update(Fields)
+    if Forward is not None:
+        Forward(Record)
+        return
+    Write(Record)
+
+
+# Write a record made by Log(), events are flushed at once
+#   - Echo also prints it if at or above TerminalLevel, for records forwarded from another process
+def Write(Record, Echo=False):
+    if Echo and Levels[Record['Level']] >= TerminalLevel:
+        print(Record['CTime'] + ": " + Record['Message'])
+    with Lock:
+        Buffer.append(json.dumps(Record, default=str) + '\n')
+        if Record['Level'] == 'EVENT' or len(Buffer) >= S['LogBufferSize']:
+            Flush()
+
+
+def Debug(Message, *Args, **Fields):
+    Log(DEBUG, Message, *Args, **Fields)
+
+
+def Info(Message, *Args, **Fields):
+    Log(INFO, Message, *Args, **Fields)
+
+
+def Warning(Message, *Args, **Fields):
+    Log(WARNING, Message, *Args, **Fields)
+
+
+def Error(Message, *Args, **Fields):
+    Log(ERROR, Message, *Args, **Fields)
+
+
+# Log an important event (fill started, line finished, fill result, contact lost...)
+#   - Always written and flushed straight away, EventType goes in the "Event" field.
+def Event(EventType, Message, *Args, **Fields):
+    Log(EVENT, Message, *Args, Event=EventType, **Fields)
+
+
+# Write out buffered records and rotate the file if due
+def Flush():
+    global LastFlush
+    with Lock:
+        LastFlush = t.time()
+        if File is None or not Buffer:
+            return
+        File.write(''.join(Buffer))
+        File.flush()
+        del Buffer[:]
+        if File.tell() > S['LogMaxBytes'] or (S['LogRotateInterval'] and t.time() - OpenedTime > S['LogRotateInterval']):
+            Rotate()
+
+
+# Rename LogFilePath -> .1 -> .2 ... keeping LogBackupCount files, then reopen
+def Rotate():
+    global File
+    File.close()
+    Path = S['LogFilePath']
+    for Index in range(S['LogBackupCount'] - 1, 0, -1):
+        if os.path.exists('{}.{}'.format(Path, Index)):
+            os.replace('{}.{}'.format(Path, Index), '{}.{}'.format(Path, Index + 1))
+    if S['LogBackupCount'] > 0:
+        os.replace(Path, Path + '.1')
+    else:
+        os.remove(Path)
+    Open()
+
+
+def FlushLoop():
+    while True:
+        t.sleep(S['LogFlushInterval'])
+        if t.time() - LastFlush >= S['LogFlushInterval']:
+            Flush()
@@ -0,0 +1,209 @@
+# Metrics for LN2 Fill control Server
+# Timing spans around the stages of the control loop and counters of things that went wrong or
+#   right, so it can be seen where each cycle's time goes.
+#
+#  - Span(Name) times a block (with Span('parse'): ...), or Observe() records a time measured elsewhere.
+#       Each span name keeps a count, total, maximum and a histogram of times (SpanBuckets).
+#  - Count(Name, **Labels) adds to a counter, e.g. Count('fills', Result='success', Line=1).
+#  - Both are always recorded, they cost a few microseconds, and are thread safe as the mail and
+#       plot workers record spans too.
+#  - With MetricsActive the metrics are served as Prometheus text at http://localhost:MetricsPort/metrics.
+#  - With MetricsProfileFile set a table of the spans is written there every MetricsDumpInterval
+#       seconds and at exit, and with MetricsCProfile the thread calling Start() (the control loop)
+#       is also profiled with cProfile, written next to it as <MetricsProfileFile>.prof.
+#  - Worker processes (Supervisor.py) send Snapshot() to the supervisor, which Merge()s them so its
+#       endpoint and profile cover every process, labelled with the worker's shard.
+#
+# Usage:
+#   Metrics.Start(S)
+#   with Metrics.Span('fetch', Controller=Name): ...
+
+import atexit
+import bisect
+import contextlib
+import os
+import threading
+import time as t
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import Logger
+
+SpanBuckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)  # Upper edges in seconds, plus one bucket above
+Prefix = 'ln2_'
+
+# Module state, the metrics themselves are kept from import so spans before Start() are not lost
+S = None
+Server = None
+Profiler = None
+LastDump = 0
+Spans = {}      # (Name, Labels) -> {'Count', 'Sum', 'Max', 'Histogram'}
+Counters = {}   # (Name, Labels) -> value
+Remote = {}     # Shard -> (Spans, Counters) of a worker process
+Lock = threading.Lock()
+
+
+# Start the metrics endpoint and profile dumps as configured, safe to call more than once
+def Start(Settings):
+    global S, Server, Profiler, LastDump
+    S = Settings
+    LastDump = t.time()
+    if S['MetricsProfileFile'] and Profiler is None:
+        atexit.register(Dump)
+        if S['MetricsCProfile']:
+            import cProfile
+            Profiler = cProfile.Profile()
+            Profiler.enable()
+    if Server is not None or not S['MetricsActive']:
+        return
+    try:
+        Server = ThreadingHTTPServer((S['MetricsHost'], S['MetricsPort']), Handler)
+    except OSError as Error:
+        Logger.Warning("=== Cannot start metrics endpoint on port {} ({}) ===",S['MetricsPort'],repr(Error))
+        return
+    Server.daemon_threads = True
+    threading.Thread(target=Server.serve_forever, name='Metrics', daemon=True).start()
+    Logger.Info("Metrics at http://{}:{}/metrics",S['MetricsHost'] or 'localhost',Server.server_address[1])
+
+
+def Key(Name, Labels):
+    return Name, tuple(sorted(Labels.items()))
+
+
+# Record that span Name took Seconds
+def Observe(Name, Seconds, **Labels):
+    Index = bisect.bisect_left(SpanBuckets, Seconds)
+    with Lock:
+        Span = Spans.get(Key(Name, Labels))
+        if Span is None:
+            Span = Spans[Key(Name, Labels)] = {'Count': 0, 'Sum': 0.0, 'Max': 0.0, 'Histogram': [0] * (len(SpanBuckets) + 1)}
+        Span['Count'] += 1
+        Span['Sum'] += Seconds
+        Span['Max'] = max(Span['Max'], Seconds)
+        Span['Histogram'][Index] += 1
+
+
+# Time the block inside "with Span(Name):", also recorded if it raises
+@contextlib.contextmanager
+def Span(Name, **Labels):
+    Start = t.perf_counter()
+    try:
+        yield
+    finally:
+        Observe(Name, t.perf_counter() - Start, **Labels)
+
+
+# Add Amount to counter Name
+def Count(Name, Amount=1, **Labels):
+    with Lock:
+        Counters[Key(Name, Labels)] = Counters.get(Key(Name, Labels), 0) + Amount
+
+
+# Copy of the spans and counters, to send to another process
+def Snapshot():
+    with Lock:
+        return ({Key: dict(Span, Histogram=list(Span['Histogram'])) for Key, Span in Spans.items()}, dict(Counters))
+
+
+# Keep the latest Snapshot() of a worker process, it replaces the last one from the same Shard
+def Merge(Shard, Taken):
+    with Lock:
+        Remote[Shard] = Taken
+
+
+# Spans and counters of this process and the worker processes, labelled with their Shard
+def Items():
+    with Lock:
+        SpanItems = [(Key, dict(Span, Histogram=list(Span['Histogram']))) for Key, Span in Spans.items()]
+        CounterItems = list(Counters.items())
+        for Shard, (RemoteSpans, RemoteCounters) in Remote.items():
+            SpanItems += [((Name, Labels + (('Shard', Shard),)), Span) for (Name, Labels), Span in RemoteSpans.items()]
+            CounterItems += [((Name, Labels + (('Shard', Shard),)), Value) for (Name, Labels), Value in RemoteCounters.items()]
+    return SpanItems, CounterItems
+
+
+def LabelText(Labels, Extra=()):
+    Labels = tuple(Labels) + tuple(Extra)
+    if not Labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(Label.lower(), str(Value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for Label, Value in Labels) + '}'
+
+
+# All metrics in the Prometheus text exposition format
+def Text():
+    SpanItems, CounterItems = Items()
+    SpanItems = sorted(SpanItems, key=lambda Item: Item[0])
+    CounterItems = sorted(CounterItems)
+    Lines = []
+    if SpanItems:
+        Lines += ['# HELP {}span_seconds Time taken by each stage'.format(Prefix), '# TYPE {}span_seconds histogram'.format(Prefix)]
+    for (Name, Labels), Span in SpanItems:
+        Labels = (('Span', Name),) + Labels
+        Total = 0
+        for Index, Number in enumerate(Span['Histogram']):
+            Total += Number
+            Edge = SpanBuckets[Index] if Index < len(SpanBuckets) else '+Inf'
+            Lines.append('{}span_seconds_bucket{} {}'.format(Prefix, LabelText(Labels, (('Le', Edge),)), Total))
+        Lines.append('{}span_seconds_sum{} {:.6f}'.format(Prefix, LabelText(Labels), Span['Sum']))
+        Lines.append('{}span_seconds_count{} {}'.format(Prefix, LabelText(Labels), Span['Count']))
+    Typed = set()
+    for (Name, Labels), Value in CounterItems:
+        if Name not in Typed:
+            Lines.append('# TYPE {}{}_total counter'.format(Prefix, Name))
+            Typed.add(Name)
+        Lines.append('{}{}_total{} {}'.format(Prefix, Name, LabelText(Labels), Value))
+    return '\n'.join(Lines) + '\n'
+
+
+# Table of the spans, slowest total first, and the counters
+def Profile():
+    SpanItems, CounterItems = Items()
+    SpanItems = sorted(SpanItems, key=lambda Item: -Item[1]['Sum'])
+    CounterItems = sorted(CounterItems)
+    Lines = ["# LN2 Autofill metrics at {}".format(t.ctime()),
+             "{:<40} {:>8} {:>10} {:>10} {:>10}".format('Span', 'Count', 'Total s', 'Mean ms', 'Max ms')]
+    for (Name, Labels), Span in SpanItems:
+        Lines.append("{:<40} {:>8} {:>10.3f} {:>10.2f} {:>10.2f}".format(
+            Name + LabelText(Labels), Span['Count'], Span['Sum'], Span['Sum'] / Span['Count'] * 1e3, Span['Max'] * 1e3))
+    Lines.append('')
+    for (Name, Labels), Value in CounterItems:
+        Lines.append("{:<40} {:>8}".format(Name + LabelText(Labels), Value))
+    return '\n'.join(Lines) + '\n'
+
+
+# Write the profile (and cProfile stats) to MetricsProfileFile
+def Dump():
+    global LastDump
+    LastDump = t.time()
+    if S is None or not S['MetricsProfileFile']:
+        return
+    with open(S['MetricsProfileFile'] + '.tmp', 'w') as File:
+        File.write(Profile())
+    os.replace(S['MetricsProfileFile'] + '.tmp', S['MetricsProfileFile'])
+    if Profiler is not None:
+        Profiler.dump_stats(S['MetricsProfileFile'] + '.prof')  # Stops the profiler, so start it again
+        Profiler.enable()
+
+
+# Dump the profile if MetricsDumpInterval has passed since the last one, call once per cycle
+def Tick():
+    if S is not None and S['MetricsProfileFile'] and t.time() - LastDump > S['MetricsDumpInterval']:
+        Dump()
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, Format, *Args):
+        if Logger.Enabled(Logger.DEBUG):
+            Logger.Debug("Metrics {}: {}", self.address_string(), Format % Args)
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        Body = Text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(Body)))
+        self.end_headers()
+        self.wfile.write(Body)
@@ -0,0 +1,201 @@
+# Notification queue for LN2 Fill control Server
+# Sends mail and ELog posts from background threads so the control loop never waits on them.
+#
+#  - Send() only puts the message on a bounded queue and returns.  If the queue is full
+#       the oldest waiting message is dropped (and counted) rather than blocking.
+#  - The mail worker gathers any messages arriving within NotifyCoalesceTime of the first
+#       one and sends them as a single mail.  The SMTP connection is kept open between
+#       mails and reopened if the relay has dropped it.  Failed sends are retried with
+#       exponential backoff, up to NotifyRetryMax attempts.
+#  - ELog posts run in a separate worker as a subprocess with a timeout, so a hung elog
+#       binary is killed instead of holding up mail or the control loop.
+#  - smtplib/email are imported by the mail worker, not at startup.
+#  - If Forward is set (worker processes of Supervisor.py) messages are passed to it instead,
+#       so one process sends the notifications of every controller.
+#  - For testing, run "python TestSmtpServer.py <port>" and set SmtpHost/SmtpPort to match.
+
+import queue
+import subprocess
+import threading
+import time as t
+import traceback
+
+import Logger
+import Metrics
+
+# Module state, set up by Start()
+S = None
+MailQueue = None
+ELogQueue = None
+Workers = []
+Smtp = None
+Dropped = 0
+Forward = None  # Called with (Message, Attachments) instead of queueing, if set
+
+
+# Start the mail and ELog workers, safe to call more than once
+def Start(Settings):
+    global S, MailQueue, ELogQueue
+    S = Settings
+    if Workers:
+        return
+    MailQueue = queue.Queue(maxsize=S['NotifyQueueSize'])
+    ELogQueue = queue.Queue(maxsize=S['NotifyQueueSize'])
+    for Target, Name in ((MailWorker, 'NotifyMail'), (ELogWorker, 'NotifyELog')):
+        Worker = threading.Thread(target=Target, name=Name, daemon=True)
+        Worker.start()
+        Workers.append(Worker)
+
+
+# Put Item on Queue without blocking, dropping the oldest waiting item if it is full
+def Put(Queue, Item):
+    global Dropped
+    while True:
+        try:
+            Queue.put_nowait(Item)
+            return
+        except queue.Full:
+            try:
+                Queue.get_nowait()
+                Queue.task_done()
+                Dropped += 1
+                Metrics.Count('notify_dropped')
+            except queue.Empty:
+                pass
+
+
+# Queue a notification, Attachments are file paths (PDF plots)
+def Send(Message, *Attachments):
+    Attachments = [str(Attachment) for Attachment in Attachments]
+    if Forward is not None:
+        Forward(Message, Attachments)
+        return
+    if S['MailNotificationActive']:
+        Put(MailQueue, (Message, Attachments))
+    if S['ELogActive']:
+        Put(ELogQueue, (Message, Attachments))
+
+
+# Block until every queued notification has been handled, returns False on timeout
+def Flush(Timeout=None):
+    Deadline = None if Timeout is None else t.time() + Timeout
+    for Queue in (MailQueue, ELogQueue):
+        while Queue.unfinished_tasks:
+            if Deadline is not None and t.time() > Deadline:
+                return False
+            t.sleep(0.05)
+    return True
+
+
+def MailWorker():
+    while True:
+        Batch = [MailQueue.get()]
+        # Coalesce a burst of messages into one mail
+        Deadline = t.time() + S['NotifyCoalesceTime']
+        while True:
+            try:
+                Batch.append(MailQueue.get(timeout=max(0, Deadline - t.time())))
+            except queue.Empty:
+                break
+        Message = "\n-----\n".join(Message for Message, Attachments in Batch)
+        if len(Batch) > 1:
+            Message = "{} notifications:\n\n".format(len(Batch)) + Message
+        Attachments = []
+        for Item in Batch:
+            Attachments += [Attachment for Attachment in Item[1] if Attachment not in Attachments]
+        try:
+            with Metrics.Span('mail'):
+                SendWithRetry(Message, Attachments)
+        except Exception as Error:
+            Metrics.Count('mail_failures')
+            Logger.Error("=== Error sending mail, giving up ({}) ===",repr(Error),Traceback=traceback.format_exc())
+        finally:
+            for Item in Batch:
+                MailQueue.task_done()
+
+
+# Try to send a mail, backing off exponentially between attempts
+def SendWithRetry(Message, Attachments):
+    Delay = S['NotifyRetryDelay']
+    for Attempt in range(S['NotifyRetryMax']):
+        try:
+            SendMail(Message, Attachments)
+            return
+        except Exception as Error:
+            CloseSmtp()
+            if Attempt == S['NotifyRetryMax'] - 1:
+                raise
+            Logger.Warning("Mail failed ({}), retrying in {} s",repr(Error),Delay)
+            t.sleep(Delay)
+            Delay *= 2
+
+
+# Get the SMTP connection, reusing the open one if the relay still answers
+def Connection():
+    global Smtp
+    import smtplib
+    if Smtp is not None:
+        try:
+            if Smtp.noop()[0] == 250:
+                return Smtp
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+        CloseSmtp()
+    Smtp = smtplib.SMTP(S['SmtpHost'], S['SmtpPort'], timeout=S['SmtpTimeout'])
+    return Smtp
+
+
+def CloseSmtp():
+    global Smtp
+    if Smtp is not None:
+        try:
+            Smtp.close()
+        except Exception:
+            pass
+    Smtp = None
+
+
+# Build and send a mail to subscribed addresses
+def SendMail(Message, Attachments):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.base import MIMEBase
+    from email import encoders
+
+    # Create MIME object and add header info
+    Msg = MIMEMultipart()
+    Msg['Subject'] = 'Message from LN2 Fill Server'
+    Msg['From'] = S['SenderEmail']
+    Msg['To'] = ", ".join(S['MailAddressList'])
+    # Attach body as MIMEText object
+    Msg.attach(MIMEText(Message, 'plain'))
+    # Attachments are all in PDF format
+    for FilePath in Attachments:
+        with open(FilePath, 'rb') as File:
+            MIMEFile = MIMEBase('application', 'pdf')
+            MIMEFile.set_payload(File.read())
+        encoders.encode_base64(MIMEFile)
+        MIMEFile.add_header('Content-Disposition', 'attachment;filename={}'.format(FilePath))
+        Msg.attach(MIMEFile)
+
+    Connection().sendmail(S['SenderEmail'], S['MailAddressList'], Msg.as_string())
+    Logger.Debug("Mail sent to subscribers ({})",", ".join(S['MailAddressList']))
+
+
+def ELogWorker():
+    while True:
+        Message, Attachments = ELogQueue.get()
+        Command = list(S['ELogCommand'])
+        for FilePath in Attachments:
+            Command += ['-f', FilePath]
+        Command.append(Message)
+        try:
+            with Metrics.Span('elog'):
+                subprocess.run(Command, timeout=S['ELogTimeout'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.SubprocessError) as Error:
+            Metrics.Count('elog_failures')
+            Logger.Error("=== ELog post failed ({}) ===",repr(Error))
+        finally:
+            ELogQueue.task_done()
@@ -0,0 +1,163 @@
+# Plotting for LN2 Fill control Server
+# Renders the fill report (LED trace and fill time history plots) in a background thread.
+#
+#  - Only imported when Settings['PLOTS'] is set, so matplotlib is never loaded otherwise.
+#  - Figures and their line artists are created once and kept, each render only replaces
+#       the line data, rescales the axes and writes the files.
+#  - Renders run on a single worker thread.  Submit() copies the data it is given and
+#       returns straight away; if a render is already waiting, the newer data replaces
+#       it.  Only the newest callback gets the files, the callbacks of the renders it
+#       replaced are called with none, so a mail never carries the plots of a later fill.
+#  - Only the worker thread touches matplotlib, and pyplot is not used at all.
+#  - Outputs: <PlotPath>LN2Plots.pdf (both plots) and one file per plot per entry of
+#       Settings['PlotFormats'] (e.g. LN2Plots_Traces.png) for the web page.  Mails are sent
+#       a copy of the PDF of their own render (LN2Plots_Mail<N>.pdf, the last PlotMailFiles
+#       are kept), the mail and ELog workers read it after later renders have replaced LN2Plots.pdf.
+
+import shutil
+import threading
+import traceback
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+
+import Logger
+import Metrics
+
+# Module state, set up by Start()
+S = None
+Worker = None
+Condition = threading.Condition()
+Pending = None      # Next job to render, or None
+Busy = False        # True while the worker is rendering
+Renders = 0         # Number of renders started, numbers the PDF copies for mails
+Plots = {}          # Figures and artists, created on first render
+
+
+# Start the render worker, safe to call more than once
+def Start(Settings):
+    global S, Worker
+    S = Settings
+    if Worker is None:
+        Worker = threading.Thread(target=WorkerLoop, name='Plotting', daemon=True)
+        Worker.start()
+
+
+# Queue a render of the fill report
+#   - TimeScale, Traces, LastTraces are as in the parsed Status / CheckFillSuccess.LastFill
+#   - FillTimeRecord is CheckFillSuccess.TotalFillTimeRecord, it is copied and never modified
+#   - OnDone(Files) is called on the worker thread once the files are written, Files maps
+#       output (e.g. 'pdf', 'Traces.png') to its path and is empty if rendering failed or
+#       a later Submit() replaced this render before it started.
+def Submit(TimeScale, Traces, LastTraces, FillTimeRecord, OnDone=None):
+    global Pending
+    Period = S['HistoryPlotPeriod']
+    Job = {
+        'TimeScale': list(TimeScale),
+        'Traces': [list(Trace) for Trace in Traces],
+        'LastTraces': [list(Trace) for Trace in LastTraces],
+        # Last HistoryPlotPeriod fills of each line, failures (t<0) shown as 0
+        'History': [[max(0, FillTime) for FillTime in Record[-Period:]] for Record in FillTimeRecord],
+        'Callbacks': [OnDone] if OnDone is not None else [],
+        'Superseded': [],
+    }
+    with Condition:
+        if Pending is not None:
+            Job['Superseded'] = Pending['Superseded'] + Pending['Callbacks']
+        Pending = Job
+        Condition.notify()
+
+
+# Block until all submitted renders are finished, returns False on timeout
+def Wait(Timeout=None):
+    with Condition:
+        return Condition.wait_for(lambda: Pending is None and not Busy, Timeout)
+
+
+def WorkerLoop():
+    global Pending, Busy, Renders
+    while True:
+        with Condition:
+            Condition.wait_for(lambda: Pending is not None)
+            Job, Pending, Busy = Pending, None, True
+        Renders += 1
+        try:
+            with Metrics.Span('plot'):
+                Files = Render(Job, Renders)
+        except Exception as Error:
+            Logger.Error("=== Error rendering plots ({}) ===",repr(Error),Traceback=traceback.format_exc())
+            Files = {}
+        Calls = [(Callback, {}) for Callback in Job['Superseded']] + [(Callback, Files) for Callback in Job['Callbacks']]
+        for Callback, CallbackFiles in Calls:
+            try:
+                Callback(CallbackFiles)
+            except Exception as Error:
+                Logger.Error("=== Error after rendering plots ({}) ===",repr(Error),Traceback=traceback.format_exc())
+        with Condition:
+            Busy = False
+            Condition.notify_all()
+
+
+# Get the line artist for Key (e.g. ('Trace', 1)), creating it on first use
+def Artist(Ax, Key, Index, Style, Label):
+    if Key not in Plots['Artists']:
+        Colour = S['PlotColours'][Index % len(S['PlotColours'])]
+        Plots['Artists'][Key], = Ax.plot([], [], Colour + Style, label=Label)
+    return Plots['Artists'][Key]
+
+
+# Create the two figures, called once from the worker thread
+def CreatePlots():
+    Plots['Artists'] = {}
+    Plots['Traces'] = Figure()
+    Ax = Plots['Traces'].add_subplot(111)
+    Plots['Traces'].suptitle("LN2 Fill: Adc Voltage Drop (ADC Units) vs Time", fontsize=14, fontweight='bold')
+    Ax.grid(True)
+    Ax.set_xlabel('Time (s)')
+    Ax.set_ylabel('Adc Value')
+    Plots['History'] = Figure()
+    Ax = Plots['History'].add_subplot(111)
+    Plots['History'].suptitle("LN2 Fill: Total Fill Time", fontsize=14, fontweight='bold')
+    Ax.grid(True)
+    Ax.set_xlabel('Fill Number')
+    Ax.set_ylabel('Total Time (s)')
+
+
+# Update the artists with the data of Job and write all output files
+#   - Number is the render number, Files['pdf'] is the copy of the PDF for mails
+def Render(Job, Number):
+    if not Plots:
+        CreatePlots()
+    TimeScale = Job['TimeScale']
+
+    # LED traces, previous fill dashed and latest fill solid
+    Ax = Plots['Traces'].axes[0]
+    for Index, Trace in enumerate(Job['Traces']):
+        Last = Job['LastTraces'][Index] if Index < len(Job['LastTraces']) else []
+        Previous = Artist(Ax, ('Previous', Index), Index, '--', "Line {} (previous)".format(Index + 1))
+        Previous.set_data(TimeScale[0:len(Last)], Last)
+        Previous.set_visible(len(Last) > 0)
+        Artist(Ax, ('Trace', Index), Index, '-', "Line {}".format(Index + 1)).set_data(TimeScale[0:len(Trace)], Trace)
+    Ax.relim(visible_only=True)
+    Ax.autoscale_view()
+    Visible = [Line for Line in Ax.get_lines() if Line.get_visible()]
+    Ax.legend(Visible, [Line.get_label() for Line in Visible], loc=2)
+
+    # Fill time history
+    Ax = Plots['History'].axes[0]
+    for Index, Record in enumerate(Job['History']):
+        Artist(Ax, ('History', Index), Index, '-', "Line {}".format(Index + 1)).set_data(range(len(Record)), Record)
+    Ax.relim()
+    Ax.autoscale_view()
+
+    # Write the files
+    with PdfPages(S['PlotPath'] + 'LN2Plots.pdf') as Pdf:
+        Pdf.savefig(Plots['Traces'])
+        Pdf.savefig(Plots['History'])
+    Files = {'pdf': S['PlotPath'] + 'LN2Plots_Mail{}.pdf'.format(Number % S['PlotMailFiles'])}
+    shutil.copyfile(S['PlotPath'] + 'LN2Plots.pdf', Files['pdf'])
+    for Format in S['PlotFormats']:
+        for Name in ('Traces', 'History'):
+            Files[Name + '.' + Format] = S['PlotPath'] + 'LN2Plots_{}.{}'.format(Name, Format)
+            Plots[Name].savefig(Files[Name + '.' + Format], format=Format)
+    return Files
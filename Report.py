@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+
+# Offline fill report generator for LN2 Fill control Server
+# ---------------------------------------------------------------
+# Builds reports from the saved fill history (FillHistory.py), trace archive (TraceArchive.py) and
+#  log files, without a controller or the control script running:
+#   * <ReportPath><Controller>/<YYYY-MM>/ - per month: <YYYY-MM>.pdf with a page per line (LED traces
+#       of every fill that month and their fill times), Line<N>.png per line and Summary.csv.
+#   * <ReportPath><Controller>/ - per controller: Overview.pdf with a page per line (fill times over
+#       the whole history with monthly means) and Line<N>.png per line.
+#   * <ReportPath>Summary.csv - one row per controller, month and line: fills, failures, fill
+#       and time to cold statistics, and the number of times contact was lost that month (from the log).
+# Each month of each controller is one job, run in a pool of ReportJobs processes (one per core by
+#  default), so a fleet's worth of years scales with the number of cores.  A report's directory keeps
+#  a hash of the records it was made from and is only rendered again when they change, so normally
+#  only the current month and the overviews of controllers with new fills are redone.
+# Months are UTC calendar months.  Fills imported from the old text record have no time and are left out.
+# Controllers are those in Settings['Controllers'] with a 'FillHistoryFile', plus the control
+#  script's own (ControllerIP, FillHistoryFile, TraceArchivePath).
+# Usage: python Report.py [--out <dir>] [--jobs N] [--since YYYY-MM] [--force]
+
+import concurrent.futures
+import csv
+import hashlib
+import os
+import time as t
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+
+import Config as Conf
+import Analytics
+import FillHistory
+import TraceArchive
+import Logger
+import LogQuery
+
+ReportVersion = 1  # Change to render every report again, e.g. after changing the layout
+KeyFile = '.key'
+SummaryFields = ['Controller', 'Month', 'Line', 'Fills', 'Succeeded', 'Failed', 'MeanFillTime', 'MinFillTime', 'MaxFillTime',
+                 'MeanTimeToCold', 'ContactLost']
+
+
+# Controllers to report on, list of (Name, FillHistoryFile, TraceArchivePath)
+def Sources(S):
+    Found = []
+    for Controller in S['Controllers']:
+        if Controller.get('FillHistoryFile'):
+            Found.append((Controller.get('Name', Controller['IP']), Controller['FillHistoryFile'], Controller.get('TraceArchivePath')))
+    if S['FillHistoryFile'] not in [Source[1] for Source in Found] and os.path.isfile(S['FillHistoryFile']):
+        Found.append((S['ControllerIP'], S['FillHistoryFile'], S['TraceArchivePath']))
+    return Found
+
+
+# UTC month ('YYYY-MM') of each unix time
+def Months(Times):
+    return np.asarray(Times).astype('datetime64[s]').astype('datetime64[M]').astype(str)
+
+
+# Unix times of the start and end of a UTC month
+def MonthRange(Month):
+    Start = np.datetime64(Month, 'M')
+    return float(Start.astype('datetime64[s]').astype(np.int64)), float((Start + 1).astype('datetime64[s]').astype(np.int64))
+
+
+# Number of ContactLost events per (Controller, Month) in the log file and its rotated backups
+#   - Entries without a Controller come from the control script, they count for ControllerIP.
+def ContactLost(S):
+    Counts = {}
+    for Entry in LogQuery.Query(S['LogFilePath'], Event='ContactLost'):
+        Key = (Entry['Controller'] or S['ControllerIP'], str(Months([Entry['Time']])[0]))
+        Counts[Key] = Counts.get(Key, 0) + 1
+    return Counts
+
+
+# True if Directory holds a complete report made with Key
+def Cached(Directory, Key):
+    try:
+        with open(os.path.join(Directory, KeyFile)) as File:
+            return File.read() == Key
+    except OSError:
+        return False
+
+
+# Mark a report as complete, written last so an interrupted render is done again next time
+def Finish(Directory, Key):
+    with open(os.path.join(Directory, KeyFile), 'w') as File:
+        File.write(Key)
+
+
+# Save a page per line to <Directory><Name>.pdf and each figure as Line<N>.<format> for the other Formats
+def Save(Figures, Directory, Name, Formats):
+    if 'pdf' in Formats:
+        with PdfPages(os.path.join(Directory, Name + '.pdf')) as Pdf:
+            for Line, Fig in Figures:
+                Pdf.savefig(Fig)
+    for Format in Formats:
+        if Format != 'pdf':
+            for Line, Fig in Figures:
+                Fig.savefig(os.path.join(Directory, 'Line{}.{}'.format(Line, Format)), format=Format)
+
+
+def WriteSummary(Path, Rows):
+    with open(Path + '.tmp', 'w', newline='') as File:
+        Writer = csv.DictWriter(File, SummaryFields, extrasaction='ignore')
+        Writer.writeheader()
+        Writer.writerows(Rows)
+    os.replace(Path + '.tmp', Path)
+
+
+def ReadSummary(Path):
+    with open(Path, newline='') as File:
+        return list(csv.DictReader(File))
+
+
+# Render the report of one month of one controller, runs in a worker process
+#   - Returns the summary rows of the month
+def RenderMonth(Job):
+    History = Analytics.LoadHistory(Job['HistoryPath'])
+    History = History[(History['Time'] >= Job['Start']) & (History['Time'] < Job['End']) & (History['Active'] == 1)]
+    Index, Traces = TraceArchive.Map(Job['ArchivePath']) if Job['ArchivePath'] else (None, None)
+    Rows, Figures = [], []
+    for Line in np.unique(History['Line']):
+        Records = History[History['Line'] == Line]
+        Good = Records[Records['Result'] == FillHistory.SUCCESS]
+        Fails = Records[Records['Result'] == FillHistory.FAIL]
+        Fig = Figure(figsize=(8.27, 11.69))
+        Fig.suptitle("{} line {}: {}".format(Job['Name'], Line, Job['Month']), fontsize=14, fontweight='bold')
+        Ax = Fig.add_subplot(211)
+        Ax.set_xlabel('Time (s)')
+        Ax.set_ylabel('Adc Value')
+        Ax.grid(True)
+        ColdTimes = np.zeros(0)
+        if Index is not None:
+            Mask = (Index['Line'] == Line) & (Index['Time'] >= Job['Start']) & (Index['Time'] < Job['End'])
+            TraceRows = np.flatnonzero(Mask)
+            for Row in TraceRows:
+                Length, Interval = int(Index['Length'][Row]), int(Index['Interval'][Row])
+                Ax.plot(np.arange(Length) * Interval, Traces[Row, 0:Length], lw=0.5, alpha=0.5)
+            if len(TraceRows):
+                Thresh = Records['LedThresh'][-1]
+                ColdTimes = Analytics.TimeToCold(Traces[TraceRows], Index['Length'][TraceRows], Index['Interval'][TraceRows],
+                                                 Thresh / Analytics.AdcVoltsPerCount if Thresh > 0 else np.inf)
+        Ax = Fig.add_subplot(212)
+        Ax.set_xlabel('Day of month')
+        Ax.set_ylabel('Fill time (s)')
+        Ax.grid(True)
+        Ax.plot((Good['Time'] - Job['Start']) / 86400 + 1, Good['FillTime'], 'go', label='Succeeded')
+        Ax.plot((Fails['Time'] - Job['Start']) / 86400 + 1, np.abs(Fails['FillTime']), 'rx', label='Failed')
+        Ax.legend(loc=2)
+        Figures.append((int(Line), Fig))
+        Cold = ColdTimes[~np.isnan(ColdTimes)]
+        Rows.append({'Controller': Job['Name'], 'Month': Job['Month'], 'Line': int(Line), 'Fills': len(Records),
+                     'Succeeded': len(Good), 'Failed': len(Fails),
+                     'MeanFillTime': round(float(Good['FillTime'].mean()), 1) if len(Good) else '',
+                     'MinFillTime': int(Good['FillTime'].min()) if len(Good) else '',
+                     'MaxFillTime': int(Good['FillTime'].max()) if len(Good) else '',
+                     'MeanTimeToCold': round(float(Cold.mean()), 1) if len(Cold) else ''})
+    os.makedirs(Job['Directory'], exist_ok=True)
+    Save(Figures, Job['Directory'], Job['Month'], Job['Formats'])
+    WriteSummary(os.path.join(Job['Directory'], 'Summary.csv'), Rows)
+    Finish(Job['Directory'], Job['Key'])
+    return Rows
+
+
+# Render the whole history overview of one controller, runs in a worker process
+def RenderController(Job):
+    History = Analytics.LoadHistory(Job['HistoryPath'])
+    History = History[(History['Time'] > 0) & (History['Active'] == 1)]
+    Figures = []
+    for Line in np.unique(History['Line']):
+        Good = History[(History['Line'] == Line) & (History['Result'] == FillHistory.SUCCESS)]
+        Fig = Figure(figsize=(11.69, 8.27))
+        Fig.suptitle("{} line {}: fill times".format(Job['Name'], Line), fontsize=14, fontweight='bold')
+        Ax = Fig.add_subplot(111)
+        Ax.set_ylabel('Fill time (s)')
+        Ax.grid(True)
+        Dates = Good['Time'].astype('datetime64[s]')
+        Ax.plot(Dates, Good['FillTime'], 'g.', ms=2, label='Fill')
+        if len(Good):
+            GoodMonths = Months(Good['Time'])
+            Unique, Inverse = np.unique(GoodMonths, return_inverse=True)
+            Means = np.bincount(Inverse, weights=Good['FillTime']) / np.bincount(Inverse)
+            Ax.step(Unique.astype('datetime64[D]'), Means, 'k-', where='post', label='Monthly mean')
+        Ax.legend(loc=2)
+        Figures.append((int(Line), Fig))
+    os.makedirs(Job['Directory'], exist_ok=True)
+    Save(Figures, Job['Directory'], 'Overview', Job['Formats'])
+    Finish(Job['Directory'], Job['Key'])
+    return []
+
+
+# Jobs for one controller: one per month plus the overview, each with the key of the data it covers
+def ControllerJobs(S, OutPath, Name, HistoryPath, ArchivePath, Since=None):
+    History = Analytics.LoadHistory(HistoryPath)
+    Index, Traces = TraceArchive.Map(ArchivePath) if ArchivePath else (None, None)
+    HistoryMonths = Months(History['Time'])
+    IndexMonths = Months(Index['Time']) if Index is not None else None
+    Directory = os.path.join(OutPath, Name.replace(':', '_').replace('/', '_'))
+    Jobs, Keys = [], []
+    for Month in np.unique(HistoryMonths[History['Time'] > 0]):
+        Month = str(Month)
+        Key = hashlib.sha1('{} {}'.format(ReportVersion, S['ReportFormats']).encode())
+        Key.update(History[HistoryMonths == Month].tobytes())
+        if Index is not None:
+            Rows = np.flatnonzero(IndexMonths == Month)
+            Key.update(Index[Rows].tobytes())
+            Key.update(Traces[Rows].tobytes())
+        Keys.append(Key.hexdigest())
+        if Since is not None and Month < Since:
+            continue
+        Start, End = MonthRange(Month)
+        Jobs.append({'Function': RenderMonth, 'Name': Name, 'Month': Month, 'Start': Start, 'End': End, 'HistoryPath': HistoryPath,
+                     'ArchivePath': ArchivePath, 'Directory': os.path.join(Directory, Month), 'Formats': S['ReportFormats'],
+                     'Key': Keys[-1]})
+    Jobs.append({'Function': RenderController, 'Name': Name, 'HistoryPath': HistoryPath, 'Directory': Directory,
+                 'Formats': S['ReportFormats'], 'Key': hashlib.sha1(' '.join(Keys).encode()).hexdigest()})
+    return Jobs
+
+
+def RunJob(Job):
+    return Job['Function'](Job)
+
+
+# Build every report which is out of date, returns (number rendered, number cached)
+#   - Force renders everything again, Since ('YYYY-MM') leaves out earlier months
+def Generate(S, OutPath=None, Jobs=None, Since=None, Force=False):
+    OutPath = OutPath or S['ReportPath']
+    Work, Rows, Cache = [], [], 0
+    for Name, HistoryPath, ArchivePath in Sources(S):
+        for Job in ControllerJobs(S, OutPath, Name, HistoryPath, ArchivePath, Since):
+            if not Force and Cached(Job['Directory'], Job['Key']):
+                Cache += 1
+                if 'Month' in Job:
+                    Rows += ReadSummary(os.path.join(Job['Directory'], 'Summary.csv'))
+            else:
+                Work.append(Job)
+    Logger.Info("Report: {} up to date, {} to render",Cache,len(Work))
+    if Work:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=Jobs or S['ReportJobs'] or os.cpu_count()) as Pool:
+            for Job, Result in zip(Work, Pool.map(RunJob, Work)):
+                Rows += Result
+    Lost = ContactLost(S)
+    for Row in Rows:
+        Row['ContactLost'] = Lost.get((Row['Controller'], Row['Month']), 0)
+    Rows.sort(key=lambda Row: (Row['Controller'], Row['Month'], int(Row['Line'])))
+    os.makedirs(OutPath, exist_ok=True)
+    WriteSummary(os.path.join(OutPath, 'Summary.csv'), Rows)
+    return len(Work), Cache
+
+
+if __name__ == '__main__':
+    import argparse
+    Parser = argparse.ArgumentParser(description='Build fill reports from the saved fill history')
+    Parser.add_argument('--out', help='Output directory (default ReportPath)')
+    Parser.add_argument('--jobs', type=int, help='Worker processes (default ReportJobs, 0 = one per core)')
+    Parser.add_argument('--since', help='Only months from this one on (YYYY-MM)')
+    Parser.add_argument('--force', action='store_true', help='Render everything again')
+    Args = Parser.parse_args()
+    S = Conf.Configure()
+    Logger.Setup(S)
+    Start = t.time()
+    Rendered, Cache = Generate(S, Args.out, Args.jobs, Args.since, Args.force)
+    Logger.Info("Report: {} rendered, {} up to date, in {:.1f} s",Rendered,Cache,t.time() - Start)
@@ -0,0 +1,160 @@
+# Fill scheduler for LN2 Fill control Server
+# Decides when each line of each controller is due a fill, in place of a fixed FillFrequency after LastFillTime.
+#
+#  - One entry per line per controller, keyed "<controller>/<line>", holding the time of its last
+#       fill and its current interval.  The schedule is saved (JSON, written to a temporary file
+#       then renamed) after every change, so a restart carries on where it left off instead of
+#       filling straight away.  A line never seen before starts from its last fill in the fill
+#       history if known, else from Settings['LastFillTime'] (0 = fill now).
+#  - Interval and fill windows come from Settings (FillFrequency, FillWindows), which a controller
+#       dict in Settings['Controllers'] can override, and which Settings['LineSchedules'] or the
+#       controller's 'LineSchedules' can override for single lines, e.g. {3: {'FillFrequency': 12*3600}}.
+#  - FillWindows is a list of (StartHour, EndHour) of local time in which fills may start,
+#       e.g. [(7, 19)], a window may pass midnight, e.g. [(22, 6)].  [] means any time.
+#  - If ScheduleAdaptive is set, each successful fill scales the line's interval by
+#       ScheduleTargetFillTime / fill time (at most ScheduleMaxStep either way, kept within
+#       ScheduleMinInterval..ScheduleMaxInterval): dewars which take long to fill are filled more often.
+#  - Drift() brings a line's next fill forward (to ScheduleDriftDelay from now), for lines whose
+#       LED reading is drifting (see Telemetry.CheckDrift()).
+#  - Fills are staggered: TryStart() does not start one until ScheduleStagger seconds after the last fill
+#       started on any controller, so controllers do not all draw from the supply tank at once.
+#  - Schedules of the worker processes of Supervisor.py also have:
+#       'Shared'  - a multiprocessing.Value holding the last fill start of every process, for staggering
+#       'Forward' - called with the entries in place of saving, the supervisor saves them all in one file
+
+import contextlib
+import json
+import os
+import time as t
+
+
+# Create an empty schedule
+def NewSchedule(S):
+    return {'Path': S['ScheduleFile'], 'LastStart': 0, 'Entries': {}}
+
+
+# Load the schedule saved in Settings['ScheduleFile'], or an empty one if there is none
+def Load(S):
+    Schedule = NewSchedule(S)
+    if os.path.isfile(Schedule['Path']):
+        with open(Schedule['Path'], 'r') as File:
+            Saved = json.load(File)
+        Schedule['LastStart'] = Saved.get('LastStart', 0)
+        Schedule['Entries'] = Saved.get('Entries', {})
+    return Schedule
+
+
+def Save(Schedule):
+    if Schedule.get('Forward'):
+        Schedule['Forward'](Schedule['Entries'])
+        return
+    with open(Schedule['Path'] + '.tmp', 'w') as File:
+        json.dump({'LastStart': Schedule['LastStart'], 'Entries': Schedule['Entries']}, File, indent=1, sort_keys=True)
+    os.replace(Schedule['Path'] + '.tmp', Schedule['Path'])
+
+
+def Key(ControllerName, Line):
+    return '{}/{}'.format(ControllerName, Line)
+
+
+# Schedule settings of one line: FillFrequency and FillWindows, with controller and line overrides applied
+#   - Controller is an entry of Settings['Controllers'] (or None for the single controller script)
+def LineSettings(S, Controller, Line):
+    Settings = {'FillFrequency': S['FillFrequency'], 'FillWindows': S['FillWindows']}
+    for Source in (Controller or {}, S['LineSchedules'].get(Line, {}), (Controller or {}).get('LineSchedules', {}).get(Line, {})):
+        Settings.update((Name, Source[Name]) for Name in Settings if Name in Source)
+    return Settings
+
+
+# Get the entry for Key, creating it if needed with the last fill at LastFill
+def Entry(Schedule, S, Key, Settings, LastFill=None):
+    if Key not in Schedule['Entries']:
+        Schedule['Entries'][Key] = {'LastFill': LastFill if LastFill is not None else S['LastFillTime'],
+                                    'Interval': Settings['FillFrequency'], 'Early': 0}
+    return Schedule['Entries'][Key]
+
+
+# True if Now (unix s) is inside one of Windows, [] means always
+def InWindow(Windows, Now):
+    if not Windows:
+        return True
+    Local = t.localtime(Now)
+    Hour = Local.tm_hour + Local.tm_min / 60.0
+    for Start, End in Windows:
+        if (Start <= Hour < End) if Start <= End else (Hour >= Start or Hour < End):
+            return True
+    return False
+
+
+# Time (unix s) a line's next fill is due, ignoring fill windows, 0 = now
+def NextFill(Entry):
+    if Entry['LastFill'] == 0:
+        return 0
+    Next = Entry['LastFill'] + Entry['Interval']
+    return min(Next, Entry['Early']) if Entry['Early'] else Next
+
+
+# Add lines not yet in the schedule, LastFills = {Line: last fill time} e.g. from FillHistory.LastFillTimes()
+def Seed(Schedule, S, ControllerName, LastFills, Controller=None):
+    for Line, LastFill in LastFills.items():
+        Entry(Schedule, S, Key(ControllerName, Line), LineSettings(S, Controller, Line), LastFill)
+
+
+# Lines (of Lines, a list of line numbers) due a fill now
+def DueLines(Schedule, S, ControllerName, Lines, Now=None, Controller=None):
+    if Now is None:
+        Now = t.time()
+    Due = []
+    for Line in Lines:
+        Settings = LineSettings(S, Controller, Line)
+        Item = Entry(Schedule, S, Key(ControllerName, Line), Settings)
+        if NextFill(Item) <= Now and InWindow(Settings['FillWindows'], Now):
+            Due.append(Line)
+    return Due
+
+
+# Start a fill if none has started on any controller in the last ScheduleStagger seconds, True if started
+#   - The check and the new start time are done in one step under the lock of Schedule['Shared'], so
+#       two worker processes cannot both start
+def TryStart(Schedule, S, Now=None):
+    if Now is None:
+        Now = t.time()
+    Shared = Schedule.get('Shared')
+    with Shared.get_lock() if Shared is not None else contextlib.nullcontext():
+        if Shared is not None:
+            Schedule['LastStart'] = max(Schedule['LastStart'], Shared.value)
+        if Now - Schedule['LastStart'] < S['ScheduleStagger']:
+            return False
+        Schedule['LastStart'] = Now
+        if Shared is not None:
+            Shared.value = Now
+    Save(Schedule)
+    return True
+
+
+# Record the result of a fill of one line and adapt its interval
+#   - FillTime is the fill time reported by the controller (negative for a failure)
+def Record(Schedule, S, ControllerName, Line, FillTime, Failed, Now=None, Controller=None):
+    if Now is None:
+        Now = t.time()
+    Settings = LineSettings(S, Controller, Line)
+    Item = Entry(Schedule, S, Key(ControllerName, Line), Settings)
+    if S['ScheduleAdaptive'] and not Failed and FillTime > 0:
+        Step = min(max(S['ScheduleTargetFillTime'] / FillTime, 1.0 / S['ScheduleMaxStep']), S['ScheduleMaxStep'])
+        Item['Interval'] = min(max(Item['Interval'] * Step, S['ScheduleMinInterval']), S['ScheduleMaxInterval'])
+    elif not S['ScheduleAdaptive']:
+        Item['Interval'] = Settings['FillFrequency']
+    Item['LastFill'] = Now
+    Item['Early'] = 0
+    Save(Schedule)
+    return Item
+
+
+# Bring a line's next fill forward to ScheduleDriftDelay from now (if it is not due before then anyway)
+def Drift(Schedule, S, ControllerName, Line, Now=None, Controller=None):
+    if Now is None:
+        Now = t.time()
+    Item = Entry(Schedule, S, Key(ControllerName, Line), LineSettings(S, Controller, Line))
+    if NextFill(Item) > Now + S['ScheduleDriftDelay']:
+        Item['Early'] = Now + S['ScheduleDriftDelay']
+        Save(Schedule)
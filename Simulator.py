@@ -0,0 +1,208 @@
+# Controller simulator for LN2 Fill control Server
+# Models the LN2Fill.ino firmware well enough to test and load test the python code without hardware.
+#
+#  - Each line has a dewar which goes cold (LED reading above threshold) a while after its fill
+#       starts, about FillTime seconds, with some spread.  With FailRate some fills never go cold.
+#  - Fills are closed as updatefill() does: FILLHOLDTIME after the LED went cold (a failure if
+#       that was under FILLMINTIME), or failed at FILLTIMEOUT.  The LED value is logged every
+#       FILLLOGINTERVAL seconds and fill generations are counted as in filldatachanged().
+#  - Time runs Speed times faster than real time, so a 6 minute fill takes 6 s at Speed 60.
+#  - StatusText(), StatusCsv() and the fill messages are formatted as the firmware prints them,
+#       so both StatusParser decoders see exactly what a real controller would send.
+#  - Closes keeps every finished fill with the wall clock time it finished, for measuring how
+#       long the control code takes to notice.
+#  - Served over HTTP by "python TestServer.py <port> --simulate", see TestServer.py.
+#
+# Usage:
+#   Sim = Simulator.NewSimulator(Speed=60, Seed=1)
+#   Simulator.StartFill(Sim, 1); ...; Simulator.StatusText(Sim)
+
+import random
+import threading
+import time as t
+
+# Firmware constants (LN2Fill.ino)
+FILLMINTIME = 60
+FILLTIMEOUT = 720
+FILLHOLDTIME = 20
+FILLLOGINTERVAL = 10
+FILLLOGLENGTH = FILLTIMEOUT // FILLLOGINTERVAL + 1
+ValvePins = (11, 9, 10, 8, 7, 6, 5, 4)
+AdcVoltsPerCount = 0.00495  # Adc2Volts()
+
+
+# Create a simulated controller
+#   - Active is the number of active lines (the firmware starts with lines 1 and 2 active)
+#   - FillTimes are the typical seconds for each line's dewar to go cold
+def NewSimulator(Lines=4, Active=2, Speed=1.0, Seed=None, FailRate=0.0, FillTimes=(320, 360, 280, 400)):
+    Random = random.Random(Seed)
+    Sim = {
+        'Random': Random,
+        'Speed': Speed,
+        'WallStart': t.time(),
+        'Epoch': 80000 + Random.randrange(10000),  # Controller clock at WallStart, seconds since 1970 like now()
+        'FailRate': FailRate,
+        'Generation': 1,
+        'Closes': [],
+        'Requests': 0,
+        'Lock': threading.RLock(),
+    }
+    Sim['Lines'] = [{
+        'Number': Number,
+        'Active': Number <= Active,
+        'Thresh': 1.75,
+        'Filling': False,
+        'Start': 0,
+        'ColdAt': None,
+        'CloseAt': None,
+        'ColdUntil': 0,
+        'Result': 0,
+        'Data': [0],
+        'Generation': 1,
+        'FillTime': FillTimes[(Number - 1) % len(FillTimes)],
+        'WarmAdc': Random.randint(110, 150),
+    } for Number in range(1, Lines + 1)]
+    return Sim
+
+
+# Controller clock at wall clock time Wall (now if None)
+def SimTime(Sim, Wall=None):
+    return Sim['Epoch'] + ((t.time() if Wall is None else Wall) - Sim['WallStart']) * Sim['Speed']
+
+
+def WallTime(Sim, Time):
+    return Sim['WallStart'] + (Time - Sim['Epoch']) / Sim['Speed']
+
+
+def DataChanged(Sim, Line):
+    Sim['Generation'] += 1
+    Line['Generation'] = Sim['Generation']
+
+
+# LED ADC reading of a line at controller time Time
+def Adc(Sim, Line, Time):
+    if (Line['ColdAt'] is not None and Line['ColdAt'] <= Time < Line['CloseAt']) or Time < Line['ColdUntil']:
+        return Sim['Random'].randint(380, 530)
+    return Line['WarmAdc'] + Sim['Random'].randint(-8, 8)
+
+
+# Bring the simulation up to the current time: log LED values and close lines as updatefill() would
+def Update(Sim):
+    Now = SimTime(Sim)
+    for Line in Sim['Lines']:
+        if not Line['Filling']:
+            continue
+        Until = min(Now, Line['CloseAt'])
+        while len(Line['Data']) < FILLLOGLENGTH and Line['Start'] + len(Line['Data']) * FILLLOGINTERVAL <= Until:
+            Line['Data'].append(Adc(Sim, Line, Line['Start'] + len(Line['Data']) * FILLLOGINTERVAL))
+            DataChanged(Sim, Line)
+        if Now >= Line['CloseAt']:
+            FillTime = int(Line['CloseAt'] - Line['Start'])
+            Success = Line['ColdAt'] is not None and Line['CloseAt'] < Line['Start'] + FILLTIMEOUT and FillTime >= FILLMINTIME
+            Line['Result'] = FillTime if Success else -FillTime
+            Line['Filling'] = False
+            Line['ColdUntil'] = Line['CloseAt'] + 60 if Line['ColdAt'] is not None else 0
+            Line['ColdAt'] = None
+            Sim['Closes'].append({'Line': Line['Number'], 'Time': Line['CloseAt'], 'Wall': WallTime(Sim, Line['CloseAt']),
+                                  'Result': Line['Result']})
+
+
+# Start filling a line (number from 1), returns False if it is already filling
+def StartFill(Sim, Number):
+    with Sim['Lock']:
+        Update(Sim)
+        Line = Sim['Lines'][Number - 1]
+        if Line['Filling']:
+            return False
+        Now = SimTime(Sim)
+        Line['Filling'], Line['Start'], Line['ColdUntil'] = True, Now, 0
+        Line['ColdAt'] = None if Sim['Random'].random() < Sim['FailRate'] else \
+            Now + Line['FillTime'] * Sim['Random'].uniform(0.9, 1.1)
+        Line['CloseAt'] = Now + FILLTIMEOUT if Line['ColdAt'] is None else min(Line['ColdAt'] + FILLHOLDTIME, Now + FILLTIMEOUT)
+        Line['Data'] = []
+        DataChanged(Sim, Line)
+        Line['Data'].append(Adc(Sim, Line, Now))
+        DataChanged(Sim, Line)
+        return True
+
+
+def Filling(Sim):
+    return any(Line['Filling'] for Line in Sim['Lines'])
+
+
+# readtime() output
+def TimeText(Time):
+    Time = int(Time)
+    Parts = t.gmtime(Time)
+    return " Current system time is {}s ({}:{}:{} {} {}/{}/{})\n".format(
+        Time, Parts.tm_hour, Parts.tm_min, Parts.tm_sec, (Parts.tm_wday + 1) % 7 + 1, Parts.tm_mday, Parts.tm_mon, Parts.tm_year)
+
+
+def FillAllMessage(Sim):
+    with Sim['Lock']:
+        Update(Sim)
+        if Filling(Sim):
+            return "Fill already underway.  Try reading status."
+        Message = "Filling all active lines...\n\nOpening supply tank valve...\n"
+        for Line in Sim['Lines']:
+            if Line['Active']:
+                StartFill(Sim, Line['Number'])
+                Message += "Opening line {} - ".format(Line['Number']) + TimeText(SimTime(Sim))
+        return Message
+
+
+def FillLineMessage(Sim, Number):
+    with Sim['Lock']:
+        if Number < 1 or Number > len(Sim['Lines']):
+            return "Line number should be between 1 and {}.\n\n".format(len(Sim['Lines']))
+        if not StartFill(Sim, Number):
+            return "Fill already underway.  Try reading status."
+        return "Filling line {0}\n\nOpening supply tank valve...\nOpening line {0}\n".format(Number) + TimeText(SimTime(Sim))
+
+
+# readstatus() output
+def StatusText(Sim):
+    with Sim['Lock']:
+        Update(Sim)
+        Now = SimTime(Sim)
+        Text = ["# University of Liverpool - Nuclear Physics - LN2 Fill System\n\n# Status Report:\n", TimeText(Now),
+                "Minimum fill time: {} s\nMaximum fill time: {} s\nFill hold time: {} s\nMain tank valve is {}".format(
+                    FILLMINTIME, FILLTIMEOUT, FILLHOLDTIME, "Open\n" if Filling(Sim) else "Closed\n"),
+                "| LineNum |\tActive? |\tLED Pin |\tLED Thresh |\tADC val |\tLED V |\tValve Pin\t|Valve Status\t|\tLast Fill Status\n\n"]
+        for Line in Sim['Lines']:
+            Value = Adc(Sim, Line, Now)
+            Text.append("| {}\t |\t{}\t |\t{}\t |\t{:.2f}\t |\t{}\t |\t{:.2f}\t|\t{}\t |\t{}\t|\t{}\n".format(
+                Line['Number'], 'Y' if Line['Active'] else 'N', Line['Number'] - 1, Line['Thresh'], Value,
+                Value * AdcVoltsPerCount, ValvePins[Line['Number'] - 1], 'Op' if Line['Filling'] else 'Cl',
+                "Fill underway!!" if Line['Filling'] else "{} ({})".format("Succ!" if Line['Result'] > 0 else "Fail!", Line['Result'])))
+        Text.append("\n\nLed values for last fill in {}s intervals:\n\nTime  : ".format(FILLLOGINTERVAL))
+        Text.append(''.join(str(i * FILLLOGINTERVAL) + ('   ' if i < 1 else '  ' if i < 10 else ' ') for i in range(FILLLOGLENGTH)))
+        for Line in Sim['Lines']:
+            Text.append("\nLine {}: ".format(Line['Number']) + ''.join(str(Value) + ' ' for Value in Line['Data']))
+        return ''.join(Text)
+
+
+# readstatuscsv() output, fill data only for lines changed since fill generation Since
+def StatusCsv(Sim, Since):
+    with Sim['Lock']:
+        Update(Sim)
+        Now = SimTime(Sim)
+        Text = ["S,{},{},{},{},{},{},{},{},{}\n".format(int(Now), FILLMINTIME, FILLTIMEOUT, FILLHOLDTIME, int(Filling(Sim)),
+                                                       len(Sim['Lines']), FILLLOGINTERVAL, FILLLOGLENGTH, Sim['Generation'])]
+        for Line in Sim['Lines']:
+            Value = Adc(Sim, Line, Now)
+            Text.append("L,{},{},{},{:.2f},{},{:.2f},{},{},{},{}\n".format(
+                Line['Number'], int(Line['Active']), Line['Number'] - 1, Line['Thresh'], Value, Value * AdcVoltsPerCount,
+                ValvePins[Line['Number'] - 1], int(Line['Filling']), int(Line['Filling']), Line['Result']))
+        for Line in Sim['Lines']:
+            if Line['Generation'] > Since:
+                Text.append("T,{},{},".format(Line['Number'], Line['Generation']) + ','.join(map(str, Line['Data'])) + "\n")
+        return ''.join(Text)
+
+
+# Summary of the simulation for the /sim/state route
+def State(Sim):
+    with Sim['Lock']:
+        Update(Sim)
+        return {'Time': SimTime(Sim), 'Speed': Sim['Speed'], 'Generation': Sim['Generation'], 'Requests': Sim['Requests'],
+                'Filling': [Line['Number'] for Line in Sim['Lines'] if Line['Filling']], 'Closes': list(Sim['Closes'])}
@@ -0,0 +1,93 @@
+# Status cache for LN2 Fill control Server
+# One shared snapshot of a controller's status, so everything which wants the status (control loop,
+#   fill tracking, dashboard) reads it from here instead of each sending its own readstatus.
+#
+#  - Get() returns the cached status if it is at most MaxAge seconds old (StatusCacheTTL by
+#       default, 0 = read now), otherwise reads a new one with the cache's Fetch function.
+#  - Only one read per controller is ever in flight: callers arriving while one is running wait
+#       for it and share its result (or its exception) if it started recently enough for them.
+#  - GetStale() is for viewers: it returns the cached status straight away, even if older than
+#       the TTL (up to StatusCacheMaxStale), and starts a background read to bring it up to date
+#       (stale-while-revalidate).  So viewers cost at most one read per TTL between them.
+#  - Thread safe, the control loop and the dashboard threads share one cache per controller.
+#
+# Usage:
+#   Cache = StatusCache.NewCache(S, Name, Fetch)     (Fetch() returns a parsed status or raises)
+#   Status = StatusCache.Get(Cache)
+
+import threading
+import time as t
+
+
+# Create the cache of one controller's status
+def NewCache(S, Name, Fetch):
+    return {
+        'Name': Name,
+        'Fetch': Fetch,
+        'TTL': S['StatusCacheTTL'],
+        'MaxStale': S['StatusCacheMaxStale'],
+        'Status': None,
+        'Time': 0,             # Time the read of Status was started
+        'Fetching': False,
+        'FetchStart': 0,
+        'Result': (None, None),  # (Status, exception) of the last read
+        'Reads': 0,
+        'Hits': 0,
+        'Lock': threading.Condition(),
+    }
+
+
+# Run the Fetch function, for the caller which set Cache['Fetching'], and wake any waiting callers
+#   - Returns (Status, exception)
+def Refresh(Cache):
+    try:
+        Result = Cache['Fetch'](), None
+    except Exception as Error:
+        Result = None, Error
+    with Cache['Lock']:
+        if Result[1] is None:
+            Cache['Status'], Cache['Time'] = Result[0], Cache['FetchStart']
+        Cache['Result'] = Result
+        Cache['Fetching'] = False
+        Cache['Reads'] += 1
+        Cache['Lock'].notify_all()
+    return Result
+
+
+# Status at most MaxAge seconds old (StatusCacheTTL if None), reads one if needed, raises if the read fails
+def Get(Cache, MaxAge=None):
+    if MaxAge is None:
+        MaxAge = Cache['TTL']
+    Asked = t.time()
+    with Cache['Lock']:
+        while True:
+            if Cache['Status'] is not None and Cache['Time'] >= Asked - MaxAge:
+                Cache['Hits'] += 1
+                return Cache['Status']
+            if not Cache['Fetching']:
+                break
+            # Wait for the read in flight, its result will do if it started recently enough
+            Joined = Cache['FetchStart'] >= Asked - MaxAge
+            Reads = Cache['Reads']
+            Cache['Lock'].wait_for(lambda: Cache['Reads'] != Reads)
+            if Joined and Cache['Result'][1] is not None:
+                raise Cache['Result'][1]
+        Cache['Fetching'], Cache['FetchStart'] = True, t.time()
+    Status, Error = Refresh(Cache)
+    if Error is not None:
+        raise Error
+    return Status
+
+
+# Cached status straight away (if no older than StatusCacheMaxStale), refreshing it in the background
+#   once older than StatusCacheTTL.  Falls back to Get() when there is nothing usable cached.
+def GetStale(Cache):
+    with Cache['Lock']:
+        Age = t.time() - Cache['Time']
+        if Cache['Status'] is not None and Age <= Cache['MaxStale']:
+            if Age > Cache['TTL'] and not Cache['Fetching']:
+                Cache['Fetching'], Cache['FetchStart'] = True, t.time()
+                threading.Thread(target=Refresh, args=(Cache,), name='StatusRefresh', daemon=True).start()
+            Cache['Hits'] += 1
+            return Cache['Status']
+    return Get(Cache)
@@ -0,0 +1,210 @@
+# Status message parser for LN2 Fill control Server
+# Turns the "readstatus" payload returned by the microcontroller into a Status namedtuple.
+#
+#  - Works directly on the raw bytes from the controller, only the few fields that
+#       are kept as text (e.g. main tank status) are ever decoded.
+#  - All patterns are compiled once at import, the payload is walked exactly once
+#       with a small state machine (header -> line table -> fill traces).
+#  - Nothing in here writes to the log, callers can log a summary of the result.
+#  - ParseStatusCsv() decodes the compact "readstatuscsv" payload into the same Status, Parse()
+#       picks the right decoder for whichever payload it is given.
+#  - The compact payload only carries fill traces which changed since the fill generation
+#       given in the request.  MergeTraces() fills in the rest from a per controller TraceCache,
+#       whose 'Generation' is the number to send with the next request.
+#  - WARNING: If readstatus()/readstatuscsv() in LN2Fill.ino are updated this should be updated to match.
+
+import re
+from collections import namedtuple
+
+# One row of the line status table.  Field order matches the columns of the table
+#   so rows can still be indexed like the lists used before (e.g. FillLine[9]).
+LineStatus = namedtuple('LineStatus', ['LineNum', 'Active', 'LedPin', 'LedThresh', 'AdcVal',
+                                       'LedVolts', 'ValvePin', 'ValveStatus', 'FillResult', 'FillTime'])
+
+# Keys which must be found in every status message
+StatusKeys = ('MinFillTime', 'MaxFillTime', 'FillHoldTime', 'MainTankStatus',
+              'LineStatus', 'NumLines', 'FillTimeScale', 'LineFillStatus')
+
+# A parsed status message, the StatusKeys plus three only given by the compact payload:
+#   ControllerTime (controller clock, s), FillGeneration and TraceGenerations (line -> generation
+#   of each trace sent), all None for a status from ParseStatusMessage().
+Status = namedtuple('Status', StatusKeys + ('ControllerTime', 'FillGeneration', 'TraceGenerations'),
+                    defaults=(None, None, None))
+
+# Precompiled patterns for the header section, each maps to a field of Status
+HeaderPatterns = (
+    (re.compile(rb'Minimum fill time: *(-?\d+) s'), 'MinFillTime'),
+    (re.compile(rb'Maximum fill time: *(-?\d+) s'), 'MaxFillTime'),
+    (re.compile(rb'Fill hold time: *(-?\d+) s'), 'FillHoldTime'),
+)
+TankPattern = re.compile(rb'Main tank valve is (\S+)')
+FillInfoPattern = re.compile(rb'(\S+)\s*\((-?\d+)\)')
+
+UnderwayFlag = b'Fill underway'
+Underway = b'Underway'  # FillResult for a line which is filling right now
+
+TableFlag = b'| LineNum |'
+TimeFlag = b'Time  :'
+
+# States of the parser
+HEADER, TABLE, TRACES = range(3)
+
+# Record types of the compact (readstatuscsv) payload
+CsvStatus, CsvLine, CsvTrace = b'S', b'L', b'T'
+ActiveFlags = (b'N', b'Y')
+ValveFlags = (b'Cl', b'Op')
+
+
+# Parse a single row of the line status table, raise ValueError if malformed
+def ParseTableRow(Line):
+    Items = Line.split(b'|')
+    if len(Items) != 10:
+        raise ValueError('Bad line data ({} chars, {} Items)'.format(len(Line), len(Items)))
+    FillInfo = Items[9].strip()
+    if FillInfo.startswith(UnderwayFlag):
+        FillResult, FillTime = Underway, 0
+    else:
+        Match = FillInfoPattern.match(FillInfo)
+        if Match is None:
+            raise ValueError('Bad fill status: {}'.format(FillInfo))
+        FillResult, FillTime = Match.group(1), int(Match.group(2))
+    return LineStatus(int(Items[1]),            # Line number
+                      Items[2].strip(),         # Active?
+                      int(Items[3]),            # LED pin #
+                      float(Items[4]),          # LED threshold
+                      int(Items[5]),            # ADC value
+                      float(Items[6]),          # LED Volts
+                      int(Items[7]),            # Valve pin #
+                      Items[8].strip(),         # Valve Status
+                      FillResult,               # Succ!/Fail!/Underway string
+                      FillTime)                 # Fill time (0 while underway)
+
+
+# Parse a full status message (bytes) and return its Status
+#   - Raises ValueError if the message is malformed or any field is missing.
+def ParseStatusMessage(StatusMessage):
+    Fields = dict()
+    Fields['LineStatus'] = []
+    Fields['NumLines'] = 0
+    Fields['FillTimeScale'] = []
+    Fields['LineFillStatus'] = []
+    State = HEADER
+
+    for Line in StatusMessage.splitlines():
+        if State == TRACES:
+            Items = Line.split()
+            if not Items:
+                continue
+            FillLineNumber = int(Items[1].rstrip(b':'))
+            Fields['LineFillStatus'].append(list(map(int, Items[2:])))
+            # There should be no missing lines so FillLineNumber == number of entries so far.
+            if FillLineNumber != len(Fields['LineFillStatus']):
+                raise ValueError('Fill data for line {} out of order'.format(FillLineNumber))
+            continue
+        if not Line:
+            continue
+        if State == TABLE:
+            if Line[0:1] == b'|':
+                Fields['LineStatus'].append(ParseTableRow(Line))
+                continue
+            State = HEADER  # End of table, fall through to check the line against the header patterns
+        if Line.startswith(TimeFlag):
+            Fields['FillTimeScale'] = list(map(int, Line.split()[2:]))
+            State = TRACES
+        elif Line.startswith(TableFlag):
+            State = TABLE
+        else:
+            for Pattern, Key in HeaderPatterns:
+                Match = Pattern.match(Line)
+                if Match is not None:
+                    Fields[Key] = int(Match.group(1))
+                    break
+            else:
+                Match = TankPattern.match(Line)
+                if Match is not None:
+                    Fields['MainTankStatus'] = Match.group(1).decode('ascii')
+
+    # Check all status items have been found
+    Fields['NumLines'] = len(Fields['LineStatus'])
+    Missing = [Key for Key in StatusKeys if Key not in Fields]
+    if Missing or not Fields['LineStatus'] or State != TRACES or not Fields['LineFillStatus']:
+        raise ValueError('Incomplete status message, missing: {}'.format(', '.join(Missing) or 'line data'))
+    return Status(**Fields)
+
+
+# Parse a compact status message (bytes, from readstatuscsv) and return its Status
+#   - Lines whose trace was not sent have an empty list in LineFillStatus, use MergeTraces()
+#       to fill them in.  TraceGenerations maps the lines which were sent to their generation.
+#   - Raises ValueError if the message is malformed or any field is missing.
+def ParseStatusCsv(StatusMessage):
+    Fields = dict()
+    Fields['LineStatus'] = []
+    Traces = {}
+
+    for Line in StatusMessage.splitlines():
+        Items = Line.split(b',')
+        if Items[0] == CsvLine:
+            if len(Items) != 11:
+                raise ValueError('Bad line data ({} chars, {} Items)'.format(len(Line), len(Items)))
+            FillTime = int(Items[10])
+            if Items[9] == b'1':
+                FillResult, FillTime = Underway, 0
+            else:
+                FillResult = b'Succ!' if FillTime > 0 else b'Fail!'
+            Fields['LineStatus'].append(LineStatus(int(Items[1]), ActiveFlags[Items[2] == b'1'], int(Items[3]), float(Items[4]),
+                                                   int(Items[5]), float(Items[6]), int(Items[7]), ValveFlags[Items[8] == b'1'],
+                                                   FillResult, FillTime))
+        elif Items[0] == CsvTrace:
+            if len(Items) < 4:
+                raise ValueError('Bad fill data: {}'.format(Line[:80]))
+            Traces[int(Items[1])] = (int(Items[2]), list(map(int, Items[3:])))
+        elif Items[0] == CsvStatus:
+            if len(Items) != 10:
+                raise ValueError('Bad status record: {}'.format(Line[:80]))
+            (Fields['ControllerTime'], Fields['MinFillTime'], Fields['MaxFillTime'], Fields['FillHoldTime'],
+             TankOpen, NumLines, Interval, Length, Fields['FillGeneration']) = map(int, Items[1:])
+            Fields['MainTankStatus'] = 'Open' if TankOpen else 'Closed'
+            Fields['FillTimeScale'] = [Index * Interval for Index in range(Length)]
+        elif Line.strip():
+            raise ValueError('Unknown record: {}'.format(Line[:80]))
+
+    if 'MinFillTime' not in Fields or not Fields['LineStatus']:
+        raise ValueError('Incomplete status message, missing: {}'.format('header' if Fields['LineStatus'] else 'line data'))
+    Fields['NumLines'] = len(Fields['LineStatus'])
+    if Fields['NumLines'] != NumLines:
+        raise ValueError('Expected {} lines, got {}'.format(NumLines, Fields['NumLines']))
+    if any(Line < 1 or Line > NumLines for Line in Traces):
+        raise ValueError('Fill data for unknown line')
+    Fields['TraceGenerations'] = {Line: Generation for Line, (Generation, Trace) in Traces.items()}
+    Fields['LineFillStatus'] = [Traces[Line][1] if Line in Traces else [] for Line in range(1, NumLines + 1)]
+    return Status(**Fields)
+
+
+# Cache of the last fill traces of one controller, for MergeTraces()
+def NewTraceCache():
+    return {'Generation': 0, 'ControllerTime': 0, 'Traces': {}}
+
+
+# Merge the traces sent in a compact status into Cache, return Status with the rest of LineFillStatus filled in from it
+#   - Does nothing for a status from ParseStatusMessage(), which always has every trace.
+#   - If the controller has restarted (clock or generation gone backwards) the cache is emptied,
+#       the next request then gets every trace again.
+def MergeTraces(Cache, Status):
+    if Status.FillGeneration is None:
+        return Status
+    if Status.FillGeneration < Cache['Generation'] or Status.ControllerTime < Cache['ControllerTime']:
+        Cache.update(NewTraceCache())
+        if len(Status.TraceGenerations) < Status.NumLines:
+            return Status
+    for Line in Status.TraceGenerations:
+        Cache['Traces'][Line] = Status.LineFillStatus[Line - 1]
+    Cache['Generation'] = Status.FillGeneration
+    Cache['ControllerTime'] = Status.ControllerTime
+    return Status._replace(LineFillStatus=[Cache['Traces'].get(Line, []) for Line in range(1, Status.NumLines + 1)])
+
+
+# Parse either form of status message
+def Parse(StatusMessage):
+    if StatusMessage.startswith(CsvStatus + b','):
+        return ParseStatusCsv(StatusMessage)
+    return ParseStatusMessage(StatusMessage)
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+
+# Multi-process Supervisor for Liverpool Nuclear Physics LN2 Fill System
+# ---------------------------------------------------------------
+
+# Runs the fleet poller (LN2Fill_Poller.py) in SupervisorWorkers worker processes, each polling a
+#  shard of Settings['Controllers'], for fleets too big for one process: status parsing and fill
+#  analysis use a core each, and a stall in one process holds up every controller in it.
+#   * A new controller goes to the shard with fewest controllers, and stays there.
+#   * Workers send everything shared back to the supervisor on their own pipe: log records,
+#       notifications, statuses, schedule entries, and a heartbeat with their metrics.  The supervisor
+#       alone writes the log and schedule files, sends mail and ELog posts, and runs the dashboard
+#       and metrics endpoint, so these look the same as with a single poller.
+#   * Fills are staggered across workers through a shared last fill start time (see Scheduler.py).
+#   * A worker which exits, or sends no heartbeat for SupervisorStallTimeout seconds, is killed and
+#       started again with the same controllers after SupervisorRestartDelay seconds (doubled each time
+#       it fails again within SupervisorRestartMax seconds, up to SupervisorRestartMax).  The other
+#       workers carry on meanwhile.
+#   * Controllers can be added and removed while running: edit Config.py and send SIGHUP, or call Add()/Remove().
+# Usage: python Supervisor.py [--workers N]
+
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time as t
+
+# Configuration Function
+import Config as Conf
+import LN2Fill_Poller as Poller
+import Scheduler
+import Notify
+import Logger
+import Dashboard
+import Metrics
+
+# Workers are started fresh rather than forked, the supervisor has log, mail and dashboard threads running
+Context = multiprocessing.get_context('spawn')
+
+# Module state, set up by Run()
+S = None
+Schedule = None
+LastStart = None    # Last fill start on any worker, shared with them
+Shards = []         # {'Number', 'Controllers' (name -> settings), 'Process', 'Results', 'Commands', 'LastSeen', 'Started', 'Failures', 'RestartAt'}
+Reload = False      # Set by SIGHUP
+
+
+# Functions run by the supervisor
+# -------------------------------
+
+# Start the worker process of a shard, with new pipes so a killed worker cannot leave a half written message
+def StartWorker(Shard):
+    Results, WorkerResults = Context.Pipe(duplex=False)
+    WorkerCommands, Commands = Context.Pipe(duplex=False)
+    Shard['Process'] = Context.Process(target=Worker, name='Shard{}'.format(Shard['Number']), daemon=True,
+                                       args=(Shard['Number'], S, list(Shard['Controllers'].values()), WorkerCommands, WorkerResults, LastStart))
+    Shard['Process'].start()
+    WorkerResults.close()
+    WorkerCommands.close()
+    Shard.update(Results=Results, Commands=Commands, Started=t.time(), LastSeen=t.time(), RestartAt=None)
+    Logger.Info("Started worker {} (pid {}) for {} controller(s)",Shard['Number'],Shard['Process'].pid,len(Shard['Controllers']))
+
+
+# Send a command to a worker, it gets its controllers when restarted if it is not running
+def SendCommand(Shard, *Command):
+    if Shard['RestartAt'] is not None:
+        return
+    try:
+        Shard['Commands'].send(Command)
+    except OSError as Error:
+        Logger.Warning("=== Cannot send {} to worker {} ({}) ===",Command[0],Shard['Number'],repr(Error))
+
+
+# Shard polling the controller called Name, None if none is
+def Find(Name):
+    return next((Shard for Shard in Shards if Name in Shard['Controllers']), None)
+
+
+# Start polling a controller (an entry of Settings['Controllers']), or update its settings if already polled
+def Add(Controller):
+    Name = Controller.get('Name', Controller['IP'])
+    Shard = Find(Name)
+    if Shard is None:
+        Shard = min(Shards, key=lambda Shard: len(Shard['Controllers']))
+        Logger.Info("Adding controller {} to worker {}",Name,Shard['Number'])
+    Shard['Controllers'][Name] = Controller
+    Dashboard.Register(Name, Controller['IP'], Controller.get('FillHistoryFile'))
+    SendCommand(Shard, 'Add', Controller)
+
+
+# Stop polling a controller
+def Remove(Name):
+    for Shard in Shards:
+        if Shard['Controllers'].pop(Name, None) is not None:
+            Logger.Info("Removing controller {} from worker {}",Name,Shard['Number'])
+            SendCommand(Shard, 'Remove', Name)
+
+
+# Read Settings['Controllers'] from Config.py again, adding, removing and updating controllers to match
+def ReloadControllers():
+    Controllers = {Controller.get('Name', Controller['IP']): Controller for Controller in Conf.Configure()['Controllers']}
+    for Shard in Shards:
+        for Name in list(Shard['Controllers']):
+            if Name not in Controllers:
+                Remove(Name)
+    for Name, Controller in Controllers.items():
+        Shard = Find(Name)
+        if Shard is None or Shard['Controllers'][Name] != Controller:
+            Add(Controller)
+
+
+def Hangup(Signal, Frame):
+    global Reload
+    Reload = True
+
+
+# Act on a message from the worker of Shard
+def Handle(Shard, Message):
+    Kind = Message[0]
+    if Kind == 'Log':
+        Logger.Write(Message[1], Echo=True)
+    elif Kind == 'Notify':
+        Notify.Send(Message[1], *Message[2])
+    elif Kind == 'Status':
+        Dashboard.Publish(Message[1], Message[2])
+    elif Kind == 'Schedule':
+        # Entries of other controllers are as the worker loaded them, only its own are up to date
+        for Key, Entry in Message[1].items():
+            if Key.rpartition('/')[0] in Shard['Controllers']:
+                Schedule['Entries'][Key] = Entry
+        Schedule['LastStart'] = LastStart.value
+        Scheduler.Save(Schedule)
+    elif Kind == 'Heartbeat':
+        Metrics.Merge(Shard['Number'], Message[1])
+        Shard['LastSeen'] = t.time()
+
+
+# Kill the worker of a shard which has exited or stalled, and set when to start it again
+def Failed(Shard, Reason):
+    Process = Shard['Process']
+    if Process.is_alive():
+        Process.kill()
+    Process.join()
+    Shard['Results'].close()
+    Shard['Commands'].close()
+    if t.time() - Shard['Started'] > S['SupervisorRestartMax']:
+        Shard['Failures'] = 0
+    Shard['Failures'] += 1
+    Delay = min(S['SupervisorRestartDelay'] * 2 ** (Shard['Failures'] - 1), S['SupervisorRestartMax'])
+    Shard['RestartAt'] = t.time() + Delay
+    Metrics.Count('worker_restarts', Shard=Shard['Number'])
+    Logger.Warning("=== Worker {} {} (exit code {}), restarting in {:.0f} s. Controllers {} ===",
+                   Shard['Number'],Reason,Process.exitcode,Delay,sorted(Shard['Controllers']))
+    if Shard['Failures'] == 1:
+        Notify.Send("Supervisor: worker {} {}, polling of {} is held up until it restarts.".format(
+            Shard['Number'], Reason, ', '.join(sorted(Shard['Controllers']))))
+
+
+# Restart workers which are due, and check the running ones are alive and sending heartbeats
+def CheckWorkers():
+    for Shard in Shards:
+        if Shard['RestartAt'] is not None:
+            if t.time() >= Shard['RestartAt']:
+                StartWorker(Shard)
+        elif not Shard['Process'].is_alive():
+            Failed(Shard, 'exited')
+        elif t.time() - Shard['LastSeen'] > S['SupervisorStallTimeout']:
+            Failed(Shard, 'stalled for {:.0f} s'.format(t.time() - Shard['LastSeen']))
+
+
+# Read every waiting message from the workers, waiting up to Timeout seconds for the first
+def Receive(Timeout):
+    Running = {Shard['Results']: Shard for Shard in Shards if Shard['RestartAt'] is None}
+    for Results in multiprocessing.connection.wait(list(Running), Timeout):
+        Shard = Running[Results]
+        try:
+            while Results.poll():
+                Handle(Shard, Results.recv())
+        except (EOFError, OSError):
+            pass  # Worker has exited, CheckWorkers() restarts it
+
+
+# Stop every worker, handling what they send until they have gone
+def StopWorkers():
+    for Shard in Shards:
+        SendCommand(Shard, 'Stop')
+    Deadline = t.time() + S['SupervisorStopTimeout']
+    Started = [Shard for Shard in Shards if Shard['Process'] is not None]
+    while any(Shard['Process'].is_alive() for Shard in Started) and t.time() < Deadline:
+        Receive(0.1)
+    Receive(0)
+    for Shard in Started:
+        if Shard['Process'].is_alive():
+            Shard['Process'].kill()
+        Shard['Process'].join()
+
+
+# Start the workers and supervise them for Seconds (None = until interrupted)
+#   - Logger, Notify, Metrics and Dashboard should already be started, as by Main()
+def Run(Settings, Seconds=None):
+    global S, Schedule, LastStart, Reload
+    S = Settings
+    Schedule = Scheduler.Load(S)
+    Dashboard.Start(S, Schedule)
+    LastStart = Context.Value('d', Schedule['LastStart'])
+    Workers = S['SupervisorWorkers'] or os.cpu_count()
+    del Shards[:]
+    Shards.extend({'Number': Number, 'Controllers': {}, 'Process': None, 'Failures': 0, 'RestartAt': 0} for Number in range(Workers))
+    for Controller in S['Controllers']:
+        Add(Controller)
+    Logger.Event('Startup',"------ Starting LN2 Autofill supervisor, {} controller(s) on {} worker(s) ------",len(S['Controllers']),Workers)
+    End = None if Seconds is None else t.time() + Seconds
+    try:
+        while End is None or t.time() < End:
+            CheckWorkers()
+            Receive(1)
+            if Reload:
+                Reload = False
+                Logger.Info("Reloading controllers from Config.py")
+                ReloadControllers()
+            Metrics.Tick()
+    finally:
+        StopWorkers()
+        Logger.Flush()
+
+
+def Main():
+    import argparse
+    Parser = argparse.ArgumentParser(description='Poll a fleet of LN2 fill controllers from several worker processes')
+    Parser.add_argument('--workers', type=int, help='Worker processes (default SupervisorWorkers, 0 = one per core)')
+    Args = Parser.parse_args()
+    Settings = Conf.Configure()
+    if Args.workers is not None:
+        Settings['SupervisorWorkers'] = Args.workers
+    Logger.Setup(Settings)
+    Notify.Start(Settings)
+    Metrics.Start(Settings)
+    signal.signal(signal.SIGHUP, Hangup)
+    try:
+        Run(Settings)
+    except KeyboardInterrupt:
+        pass
+
+
+# Functions run by the workers
+# -------------------------------
+
+# Worker process: poll Controllers, sending log records, notifications, statuses and schedule changes on Results
+#   - The dashboard, metrics endpoint and profile dumps are left to the supervisor.
+def Worker(Number, Settings, Controllers, Commands, Results, SharedStart):
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # Meant for the supervisor
+    Lock = threading.Lock()  # Log records may come from other threads
+
+    def Send(*Message):
+        with Lock:
+            Results.send(Message)
+
+    Settings = dict(Settings, DashboardActive=0, MetricsActive=0, MetricsProfileFile='')
+    Logger.Forward = lambda Record: Send('Log', Record)
+    Notify.Forward = lambda Message, Attachments: Send('Notify', Message, Attachments)
+    Dashboard.Forward = lambda Name, Status: Send('Status', Name, Status)
+    Logger.Setup(Settings)
+    Poller.S = Settings
+    Poller.Schedule = Scheduler.Load(Settings)
+    Poller.Schedule.update(Shared=SharedStart, Forward=lambda Entries: Send('Schedule', Entries))
+    try:
+        asyncio.run(RunWorker(Settings, Controllers, Commands, Send))
+    except KeyboardInterrupt:
+        pass
+
+
+# Poll the controllers until told to stop, sending a heartbeat every SupervisorHeartbeat seconds
+#   - The heartbeat is sent from the event loop, so it stops if anything holds the loop up.
+async def RunWorker(Settings, Controllers, Commands, Send):
+    Loop = asyncio.get_running_loop()
+    Stop = asyncio.Event()
+    for Controller in Controllers:
+        Poller.Add(Poller.NewController(Controller))
+    threading.Thread(target=ReadCommands, args=(Loop, Commands, Stop), name='Commands', daemon=True).start()
+    while not Stop.is_set():
+        Send('Heartbeat', Metrics.Snapshot())
+        try:
+            await asyncio.wait_for(Stop.wait(), Settings['SupervisorHeartbeat'])
+        except asyncio.TimeoutError:
+            pass
+
+
+# Pass commands from the supervisor to the event loop, stops the worker if the supervisor has gone
+def ReadCommands(Loop, Commands, Stop):
+    while True:
+        try:
+            Command = Commands.recv()
+        except (EOFError, OSError):
+            Command = ('Stop',)
+        if Command[0] == 'Add':
+            Loop.call_soon_threadsafe(lambda Controller=Command[1]: Poller.Add(Poller.NewController(Controller)))
+        elif Command[0] == 'Remove':
+            Loop.call_soon_threadsafe(Poller.Remove, Command[1])
+        elif Command[0] == 'Stop':
+            Loop.call_soon_threadsafe(Stop.set)
+            return
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,158 @@
+# Rolling telemetry for LN2 Fill control Server
+# Keeps the per-line ADC value and valve state, and the main tank state, from every routine
+#   status poll in fixed size numpy ring buffers.
+#
+#  - Data is kept in tiers, Settings['TelemetryTiers'] = [(Interval, Length), ...].  A tier with
+#       Interval 0 stores every sample, others store one bucket (mean/min/max of the samples
+#       in it) per Interval seconds.  Each tier holds its last Length entries, so memory use is
+#       fixed however long the script runs (raw 1 week, 5 min 30 days, hourly 10 years by default).
+#  - CheckDrift() compares the latest hour of LED readings on each idle active line to the day
+#       before it and returns a warning when it has moved by more than TelemetryDriftLimit,
+#       e.g. from a failing LED or a dewar warming up.
+#  - Save()/Load() keep the buffers in a .npz file across restarts.
+
+import os
+
+import numpy as np
+
+# Per tier arrays, the ADC ones are (Length, NumLines)
+Fields = ('Time', 'AdcMean', 'AdcMin', 'AdcMax', 'ValveOpen', 'TankOpen')
+
+
+# Create empty telemetry buffers
+def NewTelemetry(S, NumLines):
+    Telemetry = {'NumLines': NumLines, 'DriftLimit': S['TelemetryDriftLimit'], 'Tiers': [], 'Warned': set()}
+    for Interval, Length in S['TelemetryTiers']:
+        Tier = {'Interval': Interval, 'Length': Length, 'Next': 0, 'Count': 0, 'Bucket': None}
+        Tier['Time'] = np.zeros(Length)
+        for Field in Fields[1:5]:
+            Tier[Field] = np.zeros((Length, NumLines), dtype=np.float32)
+        Tier['TankOpen'] = np.zeros(Length, dtype=np.float32)
+        Telemetry['Tiers'].append(Tier)
+    return Telemetry
+
+
+# Append one entry to a tier's ring buffer
+def Push(Tier, Time, AdcMean, AdcMin, AdcMax, ValveOpen, TankOpen):
+    Index = Tier['Next']
+    Tier['Time'][Index] = Time
+    Tier['AdcMean'][Index] = AdcMean
+    Tier['AdcMin'][Index] = AdcMin
+    Tier['AdcMax'][Index] = AdcMax
+    Tier['ValveOpen'][Index] = ValveOpen
+    Tier['TankOpen'][Index] = TankOpen
+    Tier['Next'] = (Index + 1) % Tier['Length']
+    Tier['Count'] = min(Tier['Count'] + 1, Tier['Length'])
+
+
+# Write a finished bucket to its tier
+def FlushBucket(Tier):
+    Bucket = Tier['Bucket']
+    Push(Tier, Bucket['Start'], Bucket['Sum'] / Bucket['N'], Bucket['Min'], Bucket['Max'],
+         Bucket['Valve'] / Bucket['N'], Bucket['Tank'] / Bucket['N'])
+    Tier['Bucket'] = None
+
+
+# Record the readings from a parsed status
+def Record(Telemetry, Time, Status):
+    NumLines = Telemetry['NumLines']
+    Adc = np.zeros(NumLines, dtype=np.float32)
+    Valve = np.zeros(NumLines, dtype=np.float32)
+    for FillLine in Status.LineStatus[0:NumLines]:
+        Adc[FillLine[0] - 1] = FillLine[4]
+        Valve[FillLine[0] - 1] = FillLine[7] == b'Op'
+    Tank = float(Status.MainTankStatus == 'Open')
+
+    for Tier in Telemetry['Tiers']:
+        if Tier['Interval'] == 0:
+            Push(Tier, Time, Adc, Adc, Adc, Valve, Tank)
+            continue
+        Start = Time - Time % Tier['Interval']
+        if Tier['Bucket'] is not None and Tier['Bucket']['Start'] != Start:
+            FlushBucket(Tier)
+        if Tier['Bucket'] is None:
+            Tier['Bucket'] = {'Start': Start, 'N': 0, 'Sum': np.zeros(NumLines), 'Min': Adc.copy(), 'Max': Adc.copy(),
+                              'Valve': np.zeros(NumLines), 'Tank': 0.0}
+        Bucket = Tier['Bucket']
+        Bucket['N'] += 1
+        Bucket['Sum'] += Adc
+        np.minimum(Bucket['Min'], Adc, out=Bucket['Min'])
+        np.maximum(Bucket['Max'], Adc, out=Bucket['Max'])
+        Bucket['Valve'] += Valve
+        Bucket['Tank'] += Tank
+
+
+# Get the entries of a tier in time order, optionally only those with Start <= Time < End
+#   - Returns a dict of numpy arrays keyed by Fields
+def Series(Telemetry, TierIndex, Start=None, End=None):
+    Tier = Telemetry['Tiers'][TierIndex]
+    Order = (np.arange(Tier['Count']) + Tier['Next'] - Tier['Count']) % Tier['Length']
+    Mask = np.ones(len(Order), dtype=bool)
+    if Start is not None:
+        Mask &= Tier['Time'][Order] >= Start
+    if End is not None:
+        Mask &= Tier['Time'][Order] < End
+    Order = Order[Mask]
+    return {Field: Tier[Field][Order] for Field in Fields}
+
+
+# Look for LED drift on idle active lines, returns a list of (Line, warning message)
+#   - Uses the hourly tier: latest complete hour compared to the mean of the 24 hours before it.
+#   - Hours in which the line valve was open at all (i.e. filling) are ignored.
+#   - Each line is only reported once until it comes back within the limit.
+def CheckDrift(Telemetry, Status):
+    Hourly = [Index for Index, Tier in enumerate(Telemetry['Tiers']) if Tier['Interval'] == 3600]
+    if not Hourly:
+        return []
+    Data = Series(Telemetry, Hourly[0])
+    if len(Data['Time']) < 25:
+        return []
+    Messages = []
+    for FillLine in Status.LineStatus[0:Telemetry['NumLines']]:
+        Line = FillLine[0] - 1
+        if FillLine[1] != b'Y':
+            continue
+        Idle = Data['ValveOpen'][:, Line] == 0
+        Latest = Data['AdcMean'][-1, Line]
+        Baseline = Data['AdcMean'][-25:-1, Line][Idle[-25:-1]]
+        if not Idle[-1] or len(Baseline) == 0 or Baseline.mean() == 0:
+            continue
+        Change = (Latest - Baseline.mean()) / Baseline.mean()
+        if abs(Change) > Telemetry['DriftLimit']:
+            if Line not in Telemetry['Warned']:
+                Telemetry['Warned'].add(Line)
+                Messages.append((Line + 1, "Line {} LED reading has drifted {:+.0f}% in the last hour ({:.0f} -> {:.0f} ADC)".format(
+                    Line + 1, Change * 100, Baseline.mean(), Latest)))
+        else:
+            Telemetry['Warned'].discard(Line)
+    return Messages
+
+
+# Save buffers to a .npz file (written to a temporary file first, then renamed)
+#   - Buckets still being filled are not saved.
+def Save(Telemetry, Path):
+    Arrays = {}
+    for Index, Tier in enumerate(Telemetry['Tiers']):
+        for Field in Fields:
+            Arrays['{}_{}'.format(Index, Field)] = Tier[Field]
+        Arrays['{}_State'.format(Index)] = np.array([Tier['Interval'], Tier['Length'], Tier['Next'], Tier['Count']])
+    with open(Path + '.tmp', 'wb') as File:
+        np.savez(File, **Arrays)
+    os.replace(Path + '.tmp', Path)
+
+
+# Load buffers saved by Save(), tiers whose interval or length has changed since are left empty
+def Load(Telemetry, Path):
+    if not os.path.isfile(Path):
+        return
+    with np.load(Path) as Arrays:
+        for Index, Tier in enumerate(Telemetry['Tiers']):
+            Key = '{}_State'.format(Index)
+            if Key not in Arrays:
+                continue
+            Interval, Length, Next, Count = Arrays[Key]
+            if Interval != Tier['Interval'] or Length != Tier['Length'] or Arrays['{}_AdcMean'.format(Index)].shape != Tier['AdcMean'].shape:
+                continue
+            for Field in Fields:
+                Tier[Field][:] = Arrays['{}_{}'.format(Index, Field)]
+            Tier['Next'], Tier['Count'] = int(Next), int(Count)
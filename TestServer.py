@@ -1,6 +1,16 @@
-from flask import Flask, request
+from flask import Flask, request, abort, jsonify
+import random
+import time as t
+
+import Simulator
+
 app = Flask(__name__)
 
+# Simulated controller (see Simulator.py), None to serve the fixed messages below
+Sim = None
+Latency = 0      # Extra seconds added to every answer, with up to as much again of random jitter
+ErrorRate = 0    # Fraction of requests answered with an HTTP 500
+
 StatusMessage = """# University of Liverpool - Nuclear Physics - LN2 Fill System
 
 # Status Report:
@@ -25,12 +35,35 @@ Line 2: 114 108 107 108 110 111 113 115 117 119 121 122 123 124 124 125 126 126
 Line 3: 0
 Line 4: 0 """
 
+# Same status in the compact format of readstatuscsv
+#   - Fill data (T records) are (line fill generation, record), only sent if newer than the generation asked for
+StatusCsv = """S,83046,10,20,5,0,4,10,61,72
+L,1,1,0,1.90,144,0.71,11,0,0,320
+L,2,1,1,1.90,140,0.69,9,0,0,358
+L,3,0,2,1.90,836,4.14,10,0,0,0
+L,4,0,3,1.90,838,4.15,8,0,0,0
+"""
+
+StatusCsvTraces = [
+    (36, "T,1,36,140,124,122,127,124,126,127,129,131,134,136,137,143,139,140,140,141,141,142,467,150,151,150,150,150,353,378,374,380,379,389,528,522"),
+    (72, "T,2,72,114,108,107,108,110,111,113,115,117,119,121,122,123,124,124,125,126,126,126,127,127,126,127,127,127,128,127,127,128,128,128,129,140,144,384,390"),
+    (1, "T,3,1,0"),
+    (1, "T,4,1,0"),
+]
+
 FillMessage="""Filling all active lines...
 
 Opening supply tank valve...Opening line 1 -  Current system time is 534236s (4:23:56 4 7/1/1970)
 Opening line 2 -  Current system time is 534237s (4:23:57 4 7/1/1970)
 """
 
+FillLineMessage="""Filling line {0}
+
+Opening supply tank valve...
+Opening line {0}
+ Current system time is 534236s (4:23:56 4 7/1/1970)
+"""
+
 @app.route('/')
 def hello_world():
     return 'Hello, this is a fake arduino for testing the control script!!!!'
@@ -40,10 +73,62 @@ def arduino_root():
     Out = 'You are accessing the arduino!'
     return Out
 
+@app.before_request
+def inject_faults():
+    if Sim is None or request.path.startswith('/sim/'):
+        return
+    with Sim['Lock']:
+        Sim['Requests'] += 1
+    if Latency:
+        t.sleep(Latency * (1 + random.random()))
+    if random.random() < ErrorRate:
+        abort(500)
+
 @app.route('/arduino/readstatus/0')
 def readstatus():
-    return StatusMessage
+    return StatusMessage if Sim is None else Simulator.StatusText(Sim)
+
+@app.route('/arduino/readstatuscsv/<int:Since>')
+def readstatuscsv(Since):
+    if Sim is not None:
+        return Simulator.StatusCsv(Sim, Since)
+    return StatusCsv + ''.join(Record + '\n' for Generation, Record in StatusCsvTraces if Generation > Since)
 
 @app.route('/arduino/fillall/0')
 def fillall():
-    return FillMessage
+    return FillMessage if Sim is None else Simulator.FillAllMessage(Sim)
+
+@app.route('/arduino/fillline/<int:Line>')
+def fillline(Line):
+    return FillLineMessage.format(Line) if Sim is None else Simulator.FillLineMessage(Sim, Line)
+
+# State of the simulation (time, fills in progress, finished fills with their wall clock times), for benchmarks
+@app.route('/sim/state')
+def simstate():
+    if Sim is None:
+        abort(404)
+    return jsonify(Simulator.State(Sim))
+
+# Run directly to serve on a given port, e.g. several fake controllers for LN2Fill_Poller.py:
+#   python TestServer.py 5001 & python TestServer.py 5002 &
+# With --simulate the answers come from a simulated controller instead of the fixed messages,
+#   e.g. a controller running 60 times faster than real time with slow and unreliable answers:
+#   python TestServer.py 5001 --simulate --speed 60 --latency 0.2 --errors 0.05
+if __name__ == '__main__':
+    import argparse
+    Parser = argparse.ArgumentParser(description='Fake LN2 fill controller for testing')
+    Parser.add_argument('port', type=int, nargs='?', default=5000)
+    Parser.add_argument('--simulate', action='store_true', help='Simulate fills instead of serving fixed messages')
+    Parser.add_argument('--speed', type=float, default=1.0, help='Simulated seconds per real second')
+    Parser.add_argument('--lines', type=int, default=4, help='Number of fill lines')
+    Parser.add_argument('--active', type=int, default=2, help='Number of active lines')
+    Parser.add_argument('--fail', type=float, default=0.0, help='Fraction of fills which never go cold')
+    Parser.add_argument('--latency', type=float, default=0.0, help='Extra seconds before each answer')
+    Parser.add_argument('--errors', type=float, default=0.0, help='Fraction of requests answered with HTTP 500')
+    Parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable simulations')
+    Args = Parser.parse_args()
+    if Args.simulate:
+        Sim = Simulator.NewSimulator(Lines=Args.lines, Active=Args.active, Speed=Args.speed, Seed=Args.seed, FailRate=Args.fail)
+        Latency, ErrorRate = Args.latency, Args.errors
+        random.seed(Args.seed)
+    app.run(host='localhost', port=Args.port, threaded=True)
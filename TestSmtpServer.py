@@ -0,0 +1,58 @@
+# Minimal SMTP server standing in for the mail relay while testing the notification queue.
+# Accepts every mail and prints a summary of it (sender, recipients, size, subject).
+#   python TestSmtpServer.py [port]    (default 2525, set Settings['SmtpPort'] to match)
+# Add "fail" to the command line to reject every mail, to test retries.
+
+import socketserver
+import sys
+
+Reject = 'fail' in sys.argv[1:]
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+
+    def Reply(self, Line):
+        self.wfile.write(Line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.Reply('220 localhost fake SMTP ready')
+        Sender, Recipients = None, []
+        for Line in self.rfile:
+            Command = Line.decode('ascii', 'replace').strip()
+            Verb = Command[0:4].upper()
+            if Verb in ('HELO', 'EHLO'):
+                self.Reply('250 localhost')
+            elif Verb == 'MAIL':
+                Sender, Recipients = Command[10:], []
+                self.Reply('250 OK')
+            elif Verb == 'RCPT':
+                Recipients.append(Command[8:])
+                self.Reply('250 OK')
+            elif Verb == 'DATA':
+                self.Reply('354 End data with <CR><LF>.<CR><LF>')
+                Data = []
+                for DataLine in self.rfile:
+                    if DataLine in (b'.\r\n', b'.\n'):
+                        break
+                    Data.append(DataLine)
+                Subject = next((Item.strip() for Item in Data if Item.startswith(b'Subject:')), b'')
+                if Reject:
+                    self.Reply('554 Rejected for testing')
+                else:
+                    print("Mail from {} to {}: {} bytes, {}".format(Sender, ', '.join(Recipients),
+                                                                   sum(map(len, Data)), Subject.decode('ascii', 'replace')))
+                    self.Reply('250 OK')
+            elif Verb == 'NOOP' or Verb == 'RSET':
+                self.Reply('250 OK')
+            elif Verb == 'QUIT':
+                self.Reply('221 Bye')
+                return
+            else:
+                self.Reply('502 Command not implemented')
+
+
+if __name__ == '__main__':
+    Port = int(next((Arg for Arg in sys.argv[1:] if Arg.isdigit()), 2525))
+    with socketserver.ThreadingTCPServer(('localhost', Port), SmtpHandler) as Server:
+        print("Fake SMTP server on port {}".format(Port))
+        Server.serve_forever()
@@ -0,0 +1,104 @@
+# Fill trace archive for LN2 Fill control Server
+# Keeps the LED ADC curve (LineFillStatus in the parsed Status) of every fill of every line.
+#
+#  - Archive is a directory holding two flat binary files, both read with numpy.memmap:
+#       Index.bin  - one IndexDtype record per trace (time of fill, line, number of points, interval)
+#       Traces.bin - one row of TraceWidth int16 ADC values per trace, zero padded
+#  - Row N of Traces.bin belongs to record N of Index.bin.  Traces are written before their
+#       index record, so a crash can only leave unreferenced rows which are trimmed on the next append.
+#  - Loading the last year of one line is a boolean mask over the index and a gather of rows,
+#       no text parsing involved.
+
+import os
+import time as t
+
+import numpy as np
+
+IndexDtype = np.dtype([('Time', '<f8'), ('Line', '<u2'), ('Length', '<u2'), ('Interval', '<u2'), ('Pad', '<u2')])
+TraceDtype = np.dtype('<i2')
+TraceWidth = 128  # Points per row, must be >= FILLLOGLENGTH in LN2Fill.ino (73 at present)
+
+IndexFile = 'Index.bin'
+TracesFile = 'Traces.bin'
+
+
+# Number of complete index records in the archive
+def Count(Path):
+    IndexPath = os.path.join(Path, IndexFile)
+    if not os.path.isfile(IndexPath):
+        return 0
+    return os.path.getsize(IndexPath) // IndexDtype.itemsize
+
+
+# Append the traces of every active line (or only Lines, if given) in a status taken after a fill
+#   - Returns the number of traces stored
+def Append(Path, Status, Time=None, Lines=None):
+    if Time is None:
+        Time = t.time()
+    Scale = Status.FillTimeScale
+    Interval = Scale[1] - Scale[0] if len(Scale) > 1 else 0
+    Rows = []
+    for FillLine, Trace in zip(Status.LineStatus, Status.LineFillStatus):
+        if FillLine[1] == b'Y' and len(Trace) > 0 and (Lines is None or FillLine[0] in Lines):
+            Rows.append((FillLine[0], Trace[0:TraceWidth]))
+    if not Rows:
+        return 0
+
+    Index = np.zeros(len(Rows), dtype=IndexDtype)
+    Traces = np.zeros((len(Rows), TraceWidth), dtype=TraceDtype)
+    for Row, (Line, Trace) in enumerate(Rows):
+        Index[Row] = (Time, Line, len(Trace), Interval, 0)
+        Traces[Row, 0:len(Trace)] = Trace
+
+    os.makedirs(Path, exist_ok=True)
+    N = Count(Path)
+    # Trim partial index records and any trace rows not referenced by the index
+    with open(os.path.join(Path, IndexFile), 'ab') as File:
+        File.truncate(N * IndexDtype.itemsize)
+    with open(os.path.join(Path, TracesFile), 'ab') as File:
+        File.truncate(N * TraceWidth * TraceDtype.itemsize)
+        File.write(Traces.tobytes())
+        File.flush()
+        os.fsync(File.fileno())
+    with open(os.path.join(Path, IndexFile), 'ab') as File:
+        File.write(Index.tobytes())
+        File.flush()
+        os.fsync(File.fileno())
+    return len(Rows)
+
+
+# Memory map the index and traces, returns (Index, Traces) or (None, None) for an empty archive
+def Map(Path):
+    N = Count(Path)
+    if N == 0:
+        return None, None
+    Index = np.memmap(os.path.join(Path, IndexFile), dtype=IndexDtype, mode='r', shape=(N,))
+    Traces = np.memmap(os.path.join(Path, TracesFile), dtype=TraceDtype, mode='r', shape=(N, TraceWidth))
+    return Index, Traces
+
+
+# Load the most recent traces for one line, optionally limited to a time range
+#   - Returns (Times, Lengths, Traces) as numpy arrays, Traces is (n, TraceWidth) zero padded.
+#   - Count=None returns every matching trace.
+def Load(Path, Line, Count=None, Start=None, End=None):
+    Index, Traces = Map(Path)
+    if Index is None:
+        return np.zeros(0), np.zeros(0, dtype=np.uint16), np.zeros((0, TraceWidth), dtype=TraceDtype)
+    Mask = Index['Line'] == Line
+    if Start is not None:
+        Mask &= Index['Time'] >= Start
+    if End is not None:
+        Mask &= Index['Time'] < End
+    Rows = np.flatnonzero(Mask)
+    if Count is not None:
+        Rows = Rows[-Count:]
+    return np.array(Index['Time'][Rows]), np.array(Index['Length'][Rows]), np.array(Traces[Rows])
+
+
+# Most recent trace for each line as lists of ints, the layout used by CheckFillSuccess.LastFill
+def LastTraces(Path, NumberOfFillLines):
+    LastFill = []
+    for Line in range(1, NumberOfFillLines + 1):
+        Times, Lengths, Traces = Load(Path, Line, Count=1)
+        LastFill.append(Traces[0, 0:Lengths[0]].tolist() if len(Times) else [])
+    return LastFill
@@ -0,0 +1,205 @@
+# HTTP transport for LN2 Fill control Server
+# Requests to the controllers, with connection reuse, retries with backoff and a circuit breaker per controller.
+#
+#  - One Link per controller address ("host:port"), holding a urllib3 connection pool so connections
+#       are kept alive and reused for as long as the Bridge allows, with separate connect
+#       (TransportConnectTimeout) and read (ControllerTimeout) timeouts.
+#  - Request() retries a failed request up to TransportRetries times, waiting a random time between 0
+#       and TransportBackoffBase * 2^attempt seconds (at most TransportBackoffMax) before each retry, so
+#       a short hiccup costs seconds and clients coming back after an outage do not all retry at once.
+#  - Circuit breaker: after BreakerThreshold failures in a row the Link is opened and requests fail at
+#       once with CircuitOpen, without touching the network, for BreakerResetTime seconds.  It is then
+#       half open: one trial request is let through, success closes the Link again, failure opens it for
+#       twice as long as before (at most BreakerResetMax seconds).
+#  - Every request is counted, and the latency of successful ones goes in a histogram (LatencyBuckets)
+#       per Link.  Summary() describes a Link in one line for the log.
+#  - Allow(), Succeeded(), Failed() and Backoff() are the same logic without the I/O, for the asyncio
+#       poller which sends its own requests.  A request allowed as the half open trial must end in
+#       Succeeded(), Failed() or Release() (given up, e.g. cancelled), or no other request is let through.
+#  - Commands which change the controller (fills, valves) should be sent with Retries=0: a command
+#       which timed out may still have been carried out, read the status back rather than send it again.
+#  - urllib3 is only imported when the first pool is opened.
+#  - Retries and breaker trips are also counted in Metrics, labelled with the address.
+
+import bisect
+import random
+import threading
+import time as t
+import urllib.parse
+
+import Logger
+import Metrics
+
+CLOSED, OPEN, HALFOPEN = 'Closed', 'Open', 'HalfOpen'
+LatencyBuckets = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)  # Upper edges in seconds, plus one bucket above
+
+
+# Raised for any failed request, an OSError so callers can treat it like a connection problem
+class TransportError(OSError):
+    pass
+
+
+# Raised without sending anything while a Link's circuit breaker is open
+class CircuitOpen(TransportError):
+    pass
+
+
+# Module state: one Link per controller address
+Links = {}
+LinksLock = threading.Lock()
+
+
+# Create the state of one controller address
+def NewLink(S, Address):
+    return {
+        'S': S,
+        'Address': Address,
+        'Pool': None,
+        'State': CLOSED,
+        'Failures': 0,        # In a row
+        'OpenUntil': 0,
+        'OpenTime': S['BreakerResetTime'],
+        'Trial': False,       # A half open trial request is in flight
+        'Requests': 0,
+        'Errors': 0,
+        'Trips': 0,
+        'Histogram': [0] * (len(LatencyBuckets) + 1),
+        'LatencySum': 0.0,
+        'Lock': threading.Lock(),
+    }
+
+
+# The Link of an address, created on first use
+def GetLink(S, Address):
+    with LinksLock:
+        if Address not in Links:
+            Links[Address] = NewLink(S, Address)
+        return Links[Address]
+
+
+def OpenPool(Link):
+    import urllib3
+    S = Link['S']
+    Host, _, Port = Link['Address'].partition(':')
+    Link['Pool'] = urllib3.HTTPConnectionPool(Host, int(Port or 80), maxsize=S['TransportPoolSize'], block=False, retries=False,
+                                              timeout=urllib3.Timeout(connect=S['TransportConnectTimeout'], read=S['ControllerTimeout']))
+
+
+# True if a request may be sent now, moves an open Link to half open once BreakerResetTime has passed
+def Allow(Link):
+    with Link['Lock']:
+        if Link['State'] == CLOSED:
+            return True
+        if Link['State'] == OPEN:
+            if t.time() < Link['OpenUntil']:
+                return False
+            Link['State'] = HALFOPEN
+            Logger.Info("Circuit to {} half open, sending a trial request",Link['Address'])
+        if Link['Trial']:
+            return False
+        Link['Trial'] = True
+        return True
+
+
+# Seconds until an open Link lets a trial request through, 0 if it is not open
+def OpenRemaining(Link):
+    return max(0, Link['OpenUntil'] - t.time()) if Link['State'] == OPEN else 0
+
+
+# Record a successful request which took Latency seconds
+def Succeeded(Link, Latency):
+    with Link['Lock']:
+        Link['Requests'] += 1
+        Link['Histogram'][bisect.bisect_left(LatencyBuckets, Latency)] += 1
+        Link['LatencySum'] += Latency
+        if Link['State'] != CLOSED:
+            Logger.Info("Circuit to {} closed again",Link['Address'])
+        Link['State'], Link['Trial'], Link['Failures'] = CLOSED, False, 0
+        Link['OpenTime'] = Link['S']['BreakerResetTime']
+
+
+# Give up a request without a result (cancelled or interrupted), letting another trial through if it was one
+def Release(Link):
+    with Link['Lock']:
+        Link['Trial'] = False
+
+
+# Record a failed request, opening the breaker after BreakerThreshold failures in a row or a failed trial
+def Failed(Link):
+    S = Link['S']
+    with Link['Lock']:
+        Link['Requests'] += 1
+        Link['Errors'] += 1
+        Link['Failures'] += 1
+        if Link['State'] == HALFOPEN:
+            Link['OpenTime'] = min(Link['OpenTime'] * 2, S['BreakerResetMax'])
+        elif Link['State'] != CLOSED or Link['Failures'] < S['BreakerThreshold']:
+            return
+        Link['State'], Link['Trial'] = OPEN, False
+        Link['OpenUntil'] = t.time() + Link['OpenTime']
+        Link['Trips'] += 1
+        Metrics.Count('breaker_trips', Controller=Link['Address'])
+        Logger.Warning("=== Circuit to {} open after {} failures, no requests for {:.0f} s ===",
+                       Link['Address'],Link['Failures'],Link['OpenTime'])
+
+
+# Seconds to wait before retry number Attempt (0 = first retry), exponential with full jitter
+def Backoff(Link, Attempt):
+    S = Link['S']
+    return random.uniform(0, min(S['TransportBackoffMax'], S['TransportBackoffBase'] * 2 ** min(Attempt, 30)))
+
+
+# GET Url from a controller, returns the body as bytes
+#   - Retries up to Retries times (TransportRetries if None) with backoff
+#   - Raises CircuitOpen while the breaker is open, TransportError once the retries are used up
+def Request(S, Url, Retries=None):
+    import urllib3
+    if Retries is None:
+        Retries = S['TransportRetries']
+    Parts = urllib.parse.urlsplit(Url)
+    Link = GetLink(S, Parts.netloc)
+    if Link['Pool'] is None:
+        OpenPool(Link)
+    Path = Parts.path + ('?' + Parts.query if Parts.query else '')
+    for Attempt in range(Retries + 1):
+        if not Allow(Link):
+            raise CircuitOpen("Circuit to {} open for {:.0f} more s".format(Link['Address'], OpenRemaining(Link)))
+        Start = t.perf_counter()
+        try:
+            Response = Link['Pool'].urlopen('GET', Path, preload_content=True)
+            if Response.status != 200:
+                raise TransportError("HTTP {} from {}".format(Response.status, Link['Address']))
+        except (urllib3.exceptions.HTTPError, OSError) as Error:
+            Failed(Link)
+            LastError = Error
+            if Attempt < Retries:
+                Metrics.Count('retries', Controller=Link['Address'])
+                Logger.Debug("Request to {} failed ({}), retrying",Link['Address'],repr(Error))
+                t.sleep(Backoff(Link, Attempt))
+            continue
+        except BaseException:
+            Release(Link)
+            raise
+        Succeeded(Link, t.perf_counter() - Start)
+        return Response.data
+    raise TransportError("{} failed after {} attempts ({})".format(Url, Retries + 1, repr(LastError)))
+
+
+# Latency below which Fraction of the successful requests of a Link were answered (upper bucket edge)
+def Percentile(Link, Fraction, Buckets=LatencyBuckets):
+    Total = sum(Link['Histogram'])
+    if Total == 0:
+        return 0
+    Count = 0
+    for Index, Number in enumerate(Link['Histogram']):
+        Count += Number
+        if Count >= Fraction * Total:
+            return Buckets[Index] if Index < len(Buckets) else float('inf')
+
+
+# One line description of a Link for the log
+def Summary(Link):
+    Good = Link['Requests'] - Link['Errors']
+    return "{}: {} requests, {} failed, breaker {} (tripped {} times), latency mean {:.2f} s, p50 <= {} s, p95 <= {} s".format(
+        Link['Address'], Link['Requests'], Link['Errors'], Link['State'], Link['Trips'],
+        Link['LatencySum'] / Good if Good else 0, Percentile(Link, 0.5), Percentile(Link, 0.95))
@@ -0,0 +1,42 @@
+# Fixtures for the tests of LN2 Fill control Server
+# Run from the top directory with "python -m pytest -q" (needs pytest, flask and urllib3).
+#
+#  - Settings is Config.Configure() with every file in a temporary directory, logging, mail and ELog off.
+#  - Controller serves TestServer.py backed by a simulated controller (Simulator.py) on a free local port,
+#       its 'Sim' and 'Address' are the simulation and "host:port" to send requests to.
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Config
+import Simulator
+import TestServer
+
+
+@pytest.fixture
+def Settings(tmp_path):
+    S = Config.Configure()
+    Dir = str(tmp_path) + '/'
+    S.update(LogActive=0, MailNotificationActive=0, ELogActive=0, PLOTS=0, MetricsActive=0, DashboardActive=0,
+             LogPath=Dir, LogFilePath=Dir + 'log.txt', PlotPath=Dir, FillHistoryFile=Dir + 'history.bin',
+             FillRecordSaveFile=Dir + 'record.txt', TraceArchivePath=Dir + 'traces/', TelemetryFile=Dir + 'telemetry.npz',
+             ScheduleFile=Dir + 'schedule.json', CheckpointFile=Dir + 'checkpoint.json')
+    return S
+
+
+@pytest.fixture
+def Controller():
+    from werkzeug.serving import make_server
+    TestServer.Sim = Simulator.NewSimulator(Speed=60, Seed=1)
+    TestServer.Latency, TestServer.ErrorRate = 0, 0
+    Server = make_server('127.0.0.1', 0, TestServer.app, threaded=True)
+    Thread = threading.Thread(target=Server.serve_forever, daemon=True)
+    Thread.start()
+    yield {'Sim': TestServer.Sim, 'Address': '127.0.0.1:{}'.format(Server.server_port)}
+    Server.shutdown()
+    TestServer.Sim = None
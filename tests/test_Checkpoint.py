@@ -0,0 +1,65 @@
+# Checkpoint of the control script's runtime state, for warm restarts
+
+import json
+import pickle
+import time as t
+
+import pytest
+
+import Checkpoint
+import FillHistory
+import Simulator
+import StatusParser
+
+
+@pytest.fixture
+def State(Settings):
+    Sim = Simulator.NewSimulator(Seed=6)
+    Simulator.StartFill(Sim, 1)
+    Status = StatusParser.Parse(Simulator.StatusText(Sim).encode())
+    FillHistory.Append(Settings['FillHistoryFile'], FillHistory.RecordsFromStatus(Status, Time=1000.25))
+    return {'TotalFillTimeRecord': [[320, -720], [360], [], []], 'LastFill': [[120, 130, 400], [], [], []],
+            'Warned': {(1, 'Slower'), (2, 'Boiloff')}, 'Failures': 2,
+            'TraceCache': {'Generation': 7, 'ControllerTime': 84000, 'Traces': {1: [120, 130], 3: [0]}},
+            'LineResults': Checkpoint.LineResults(Status), 'Fill': {'Lines': [1], 'Started': 999.5}}, Status
+
+
+def test_RoundTrip(Settings, State):
+    State, Status = State
+    Checkpoint.Save(Settings, State)
+    Loaded = Checkpoint.Load(Settings)
+    for Key in State:
+        assert Loaded[Key] == State[Key], Key
+    assert Checkpoint.HistoryMatches(Settings, Loaded)
+    assert Checkpoint.Changed(Loaded, Status) == []
+    with open(Settings['CheckpointFile'], 'r') as File:
+        assert json.load(File)['Version'] == Checkpoint.CheckpointVersion
+
+
+def test_Changed(Settings, State):
+    State, Status = State
+    Checkpoint.Save(Settings, State)
+    FillHistory.Append(Settings['FillHistoryFile'], FillHistory.RecordsFromStatus(Status, Time=2000.0, Lines=[2]))
+    Loaded = Checkpoint.Load(Settings)
+    assert not Checkpoint.HistoryMatches(Settings, Loaded)
+    Finished = Status._replace(LineStatus=[FillLine._replace(FillResult=b'Succ!', FillTime=330) if FillLine.LineNum == 1 else FillLine
+                                           for FillLine in Status.LineStatus])
+    assert Checkpoint.Changed(Loaded, Finished) == [1]
+
+
+@pytest.mark.parametrize('Change', [{'ControllerIP': '10.0.0.2'}, {'NumberOfFillLines': 8}, {'CheckpointMaxAge': -1}])
+def test_NotUsed(Settings, State, Change):
+    Checkpoint.Save(Settings, State[0])
+    Settings.update(Change)
+    assert Checkpoint.Load(Settings) is None
+
+
+def test_Unreadable(Settings, State):
+    assert Checkpoint.Load(Settings) is None
+    # A pickle (the format of older versions) is never loaded
+    with open(Settings['CheckpointFile'], 'wb') as File:
+        pickle.dump(dict(State[0], Version=Checkpoint.CheckpointVersion, Time=t.time()), File)
+    assert Checkpoint.Load(Settings) is None
+    with open(Settings['CheckpointFile'], 'w') as File:
+        File.write('{"Version": ')
+    assert Checkpoint.Load(Settings) is None
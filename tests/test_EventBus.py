@@ -0,0 +1,66 @@
+# What each EventBus policy does with a subscriber which is behind
+
+import threading
+
+import pytest
+
+import EventBus
+
+
+@pytest.fixture
+def Bus(Settings):
+    Settings['EventBusBlockTimeout'] = 5
+    EventBus.Start(Settings)
+    yield
+    for Name in list(EventBus.Subscribers):
+        EventBus.Unsubscribe(Name)
+
+
+# Subscribe a handler which holds its first event until Release is set, returns the events it saw and Release
+def Stalled(Name, Policy, QueueSize=2):
+    Seen, Release, Holding = [], threading.Event(), threading.Event()
+    def Handler(Event):
+        Holding.set()
+        Release.wait(10)
+        Seen.append(Event.Fields['Number'])
+    EventBus.Subscribe(Name, Handler, ['StatusPolled'], Policy=Policy, QueueSize=QueueSize)
+    EventBus.Publish('StatusPolled', Number=0)
+    assert Holding.wait(10)
+    return Seen, Release
+
+
+@pytest.mark.parametrize('Policy, Expected', [('oldest', [0, 4, 5]), ('newest', [0, 1, 2])])
+def test_Dropping(Bus, Policy, Expected):
+    Seen, Release = Stalled('Test', Policy)
+    for Number in range(1, 6):
+        EventBus.Publish('StatusPolled', Number=Number)
+    Release.set()
+    assert EventBus.Flush(10)
+    assert Seen == Expected
+    assert EventBus.Subscribers['Test']['Dropped'] == 3
+
+
+def test_Block(Bus):
+    Seen, Release = Stalled('Test', 'block')
+    Publisher = threading.Thread(target=lambda: [EventBus.Publish('StatusPolled', Number=Number) for Number in range(1, 6)])
+    Publisher.start()
+    Publisher.join(0.5)
+    assert Publisher.is_alive()  # Waiting for room
+    Release.set()
+    Publisher.join(10)
+    assert EventBus.Flush(10)
+    assert Seen == [0, 1, 2, 3, 4, 5] and EventBus.Subscribers['Test']['Dropped'] == 0
+
+
+def test_SlowSubscriberDoesNotHoldUpOthers(Bus):
+    Seen, Release = Stalled('Slow', 'oldest', QueueSize=1)
+    Fast = []
+    EventBus.Subscribe('Fast', lambda Event: Fast.append(Event.Type), ['StatusPolled', 'FillResult'])
+    EventBus.Publish('FillResult', Number=1)
+    EventBus.Publish('StatusPolled', Number=2)
+    EventBus.Subscribers['Fast']['Queue'].join()
+    assert Fast == ['FillResult', 'StatusPolled'] and Seen == []
+    Release.set()
+    assert EventBus.Flush(10) and Seen == [0, 2]
+    with pytest.raises(ValueError):
+        EventBus.Publish('NoSuchEvent')
@@ -0,0 +1,53 @@
+# Binary fill history store
+
+import os
+import struct
+
+import FillHistory
+import Simulator
+import StatusParser
+
+
+def Record(Time, Line, FillTime):
+    return FillHistory.FillRecord(Time, Line, FillHistory.SUCCESS if FillTime > 0 else FillHistory.FAIL, 1, FillTime,
+                                  1.75, 60, 720, 20)
+
+
+def test_Format(Settings):
+    Path = Settings['FillHistoryFile']
+    FillHistory.Append(Path, [Record(1000.5, 1, 320), Record(1000.5, 2, -720)])
+    with open(Path, 'rb') as File:
+        Data = File.read()
+    assert Data[:len(FillHistory.Magic)] == FillHistory.Magic
+    assert len(Data) == len(FillHistory.Magic) + 2 * FillHistory.RecordSize
+    assert struct.unpack_from(FillHistory.RecordFormat, Data, len(FillHistory.Magic))[:5] == (1000.5, 1, FillHistory.SUCCESS, 1, 320)
+
+
+def test_RoundTrip(Settings):
+    Path = Settings['FillHistoryFile']
+    assert FillHistory.ReadAll(Path) == [] and FillHistory.Last(Path) == (0, None)
+    Records = [Record(1000.0, 1, 320), Record(1000.0, 2, 360), Record(5000.0, 1, -720)]
+    FillHistory.Append(Path, Records[:2])
+    FillHistory.Append(Path, Records[2:])
+    assert FillHistory.ReadAll(Path) == Records
+    assert FillHistory.Last(Path) == (3, Records[2])
+    assert FillHistory.FillTimeRecord(Path, 4) == [[320, -720], [360], [], []]
+    assert FillHistory.LastFillTimes(Path) == {1: 5000.0, 2: 1000.0}
+
+
+def test_PartialRecordTrimmed(Settings):
+    Path = Settings['FillHistoryFile']
+    FillHistory.Append(Path, [Record(1000.0, 1, 320)])
+    with open(Path, 'ab') as File:
+        File.write(b'\x01\x02\x03')  # Left by a crash part way through a write
+    assert FillHistory.Last(Path)[0] == 1 and len(FillHistory.ReadAll(Path)) == 1
+    FillHistory.Append(Path, [Record(2000.0, 2, 360)])
+    assert os.path.getsize(Path) == len(FillHistory.Magic) + 2 * FillHistory.RecordSize
+    assert [Fill.Line for Fill in FillHistory.ReadAll(Path)] == [1, 2]
+
+
+def test_RecordsFromStatus():
+    Sim = Simulator.NewSimulator(Seed=5)
+    Status = StatusParser.Parse(Simulator.StatusText(Sim).encode())
+    Records = FillHistory.RecordsFromStatus(Status, Time=100.0, Lines=[2])
+    assert [(Fill.Time, Fill.Line, Fill.Active, Fill.MaxFillTime) for Fill in Records] == [(100.0, 2, 1, 720)]
@@ -0,0 +1,49 @@
+# Fill schedule, kept in ScheduleFile across restarts
+
+import multiprocessing
+
+import Scheduler
+
+Day = 24 * 60 * 60
+
+
+def test_SavedAcrossRestarts(Settings):
+    Schedule = Scheduler.Load(Settings)
+    assert Schedule['Entries'] == {} and Schedule['LastStart'] == 0
+    Scheduler.Seed(Schedule, Settings, 'Main', {1: 1000.0, 2: 2000.0})
+    Scheduler.Record(Schedule, Settings, 'Main', 1, 600, False, Now=5000.0)
+    Scheduler.Drift(Schedule, Settings, 'Main', 2, Now=6000.0)
+    assert Scheduler.TryStart(Schedule, Settings, Now=7000.0)
+
+    Loaded = Scheduler.Load(Settings)
+    assert Loaded['Entries'] == Schedule['Entries'] and Loaded['LastStart'] == 7000.0
+    assert Loaded['Entries']['Main/1'] == {'LastFill': 5000.0, 'Interval': Day / Settings['ScheduleMaxStep'], 'Early': 0}
+    assert Scheduler.NextFill(Loaded['Entries']['Main/2']) == 6000.0 + Settings['ScheduleDriftDelay']
+    # Lines already in the schedule keep their entry when it is seeded again
+    Scheduler.Seed(Loaded, Settings, 'Main', {1: 0.0})
+    assert Loaded['Entries']['Main/1']['LastFill'] == 5000.0
+
+
+def test_DueLines(Settings):
+    Settings['LineSchedules'] = {2: {'FillFrequency': Day / 2}}
+    Schedule = Scheduler.Load(Settings)
+    Scheduler.Seed(Schedule, Settings, 'Main', {1: 0.0, 2: 0.0, 3: 1000.0})
+    Scheduler.Record(Schedule, Settings, 'Main', 1, 300, False, Now=1000.0)
+    Scheduler.Record(Schedule, Settings, 'Main', 2, 300, False, Now=1000.0)
+    assert Scheduler.DueLines(Schedule, Settings, 'Main', [1, 2, 3, 4], Now=1000.0 + Day / 2) == [2, 4]
+    assert Scheduler.DueLines(Schedule, Settings, 'Main', [1, 2, 3, 4], Now=1000.0 + Day) == [1, 2, 3, 4]
+
+
+def test_Stagger(Settings):
+    Schedule = Scheduler.Load(Settings)
+    Stagger = Settings['ScheduleStagger']
+    assert Scheduler.TryStart(Schedule, Settings, Now=10000.0)
+    assert not Scheduler.TryStart(Schedule, Settings, Now=10000.0 + Stagger - 1)
+    assert Scheduler.TryStart(Schedule, Settings, Now=10000.0 + Stagger)
+
+    # Worker processes of Supervisor.py share the last start
+    Shared = multiprocessing.Value('d', 0)
+    Workers = [dict(Scheduler.NewSchedule(Settings), Shared=Shared, Forward=lambda Entries: None) for Worker in range(2)]
+    assert Scheduler.TryStart(Workers[0], Settings, Now=20000.0)
+    assert not Scheduler.TryStart(Workers[1], Settings, Now=20000.0 + Stagger - 1)
+    assert Shared.value == 20000.0
@@ -0,0 +1,77 @@
+# Both status formats of a simulated controller parse the same, and the trace cache of the compact one
+
+import pytest
+
+import Simulator
+import StatusParser
+import TestServer
+
+
+# Stop the simulated clock at Time and make the LED readings repeat, so two requests see the same moment
+def Freeze(monkeypatch, Sim, Time):
+    monkeypatch.setattr(Simulator, 'SimTime', lambda Sim, Wall=None: Time)
+    Simulator.Update(Sim)
+    State = Sim['Random'].getstate()
+    Adc = Simulator.Adc
+    def Repeat(Sim, Line, Time):
+        if Line['Number'] == 1:
+            Sim['Random'].setstate(State)
+        return Adc(Sim, Line, Time)
+    monkeypatch.setattr(Simulator, 'Adc', Repeat)
+
+
+def Read(Client, Path):
+    Response = Client.get(Path)
+    assert Response.status_code == 200
+    return Response.data
+
+
+@pytest.fixture
+def Client():
+    TestServer.Sim = Simulator.NewSimulator(Speed=60, Seed=2)
+    yield TestServer.app.test_client()
+    TestServer.Sim = None
+
+
+@pytest.mark.parametrize('Elapsed', [0, 150, 400, 1000])
+def test_TextAndCsvAgree(monkeypatch, Client, Elapsed):
+    Sim = TestServer.Sim
+    Start = Simulator.SimTime(Sim)
+    Read(Client, '/arduino/fillall/0')
+    Freeze(monkeypatch, Sim, Start + Elapsed)
+    Text = StatusParser.Parse(Read(Client, '/arduino/readstatus/0'))
+    Csv = StatusParser.Parse(Read(Client, '/arduino/readstatuscsv/0'))
+    assert Text.FillGeneration is None and Csv.FillGeneration == Sim['Generation']
+    assert Csv.ControllerTime == int(Start + Elapsed)
+    for Key in StatusParser.StatusKeys:
+        assert getattr(Text, Key) == getattr(Csv, Key), Key
+
+
+def test_CsvOnlySendsChangedTraces(Client):
+    Read(Client, '/arduino/fillline/1')
+    Cache = StatusParser.NewTraceCache()
+    First = StatusParser.MergeTraces(Cache, StatusParser.Parse(Read(Client, '/arduino/readstatuscsv/0')))
+    assert sorted(First.TraceGenerations) == [1, 2, 3, 4]
+    Since = Cache['Generation']
+    Next = StatusParser.Parse(Read(Client, '/arduino/readstatuscsv/{}'.format(Since)))
+    assert all(Line == 1 for Line in Next.TraceGenerations)
+    Merged = StatusParser.MergeTraces(Cache, Next)
+    assert Merged.LineFillStatus[1:] == First.LineFillStatus[1:]
+
+
+def test_MergeTracesAfterRestart():
+    Cache = StatusParser.NewTraceCache()
+    Sim = Simulator.NewSimulator(Seed=3)
+    Simulator.StartFill(Sim, 2)
+    StatusParser.MergeTraces(Cache, StatusParser.Parse(Simulator.StatusCsv(Sim, 0).encode()))
+    assert Cache['Traces'][2] and Cache['Generation'] == Sim['Generation']
+
+    # A restarted controller counts fill generations from the start again, the cached traces are dropped
+    Restarted = Simulator.NewSimulator(Seed=4)
+    Restarted['Epoch'] = Sim['Epoch'] - 1000
+    Partial = StatusParser.Parse(Simulator.StatusCsv(Restarted, Cache['Generation']).encode())
+    assert StatusParser.MergeTraces(Cache, Partial) is Partial
+    assert Cache == StatusParser.NewTraceCache()
+    Full = StatusParser.MergeTraces(Cache, StatusParser.Parse(Simulator.StatusCsv(Restarted, 0).encode()))
+    assert Full.LineFillStatus == [[0]] * 4
+    assert Cache['Generation'] == Restarted['Generation']
@@ -0,0 +1,60 @@
+# Circuit breaker of Transport.py against a simulated controller which can be made to fail
+
+import time as t
+
+import pytest
+
+import TestServer
+import Transport
+
+
+@pytest.fixture
+def Breaker(Settings, Controller):
+    Settings.update(TransportRetries=0, BreakerThreshold=2, BreakerResetTime=0.2, BreakerResetMax=0.4)
+    Transport.Links.pop(Controller['Address'], None)
+    yield Settings, 'http://{}/arduino/readstatus/0'.format(Controller['Address']), Transport.GetLink(Settings, Controller['Address'])
+    Transport.Links.pop(Controller['Address'], None)
+
+
+def test_OpenHalfOpenClose(Breaker, Controller):
+    S, Url, Link = Breaker
+    assert Transport.Request(S, Url).startswith(b'# University of Liverpool')
+    assert Link['State'] == Transport.CLOSED
+
+    # BreakerThreshold failures in a row open it, then nothing is sent until BreakerResetTime has passed
+    TestServer.ErrorRate = 1
+    for Attempt in range(2):
+        with pytest.raises(Transport.TransportError):
+            Transport.Request(S, Url)
+    assert Link['State'] == Transport.OPEN and Link['Trips'] == 1
+    Requests = Controller['Sim']['Requests']
+    with pytest.raises(Transport.CircuitOpen):
+        Transport.Request(S, Url)
+    assert Controller['Sim']['Requests'] == Requests
+
+    # A failed trial opens it again for twice as long
+    t.sleep(0.25)
+    with pytest.raises(Transport.TransportError):
+        Transport.Request(S, Url)
+    assert Link['State'] == Transport.OPEN and Link['OpenTime'] == 0.4
+    t.sleep(0.25)
+    with pytest.raises(Transport.CircuitOpen):
+        Transport.Request(S, Url)
+
+    # A good trial closes it
+    t.sleep(0.2)
+    TestServer.ErrorRate = 0
+    Transport.Request(S, Url)
+    assert Link['State'] == Transport.CLOSED and Link['Failures'] == 0 and Link['OpenTime'] == 0.2
+
+
+def test_OneTrialAtATime(Breaker):
+    S, Url, Link = Breaker
+    for Attempt in range(2):
+        Transport.Failed(Link)
+    t.sleep(0.25)
+    assert Transport.Allow(Link) and Link['State'] == Transport.HALFOPEN
+    assert not Transport.Allow(Link)
+    # A trial given up without a result lets the next one through
+    Transport.Release(Link)
+    assert Transport.Allow(Link)